@@ -1,4 +1,5 @@
 import unittest
+import logging
 from hunk_search_and_replace import parse_arguments
 
 
@@ -41,6 +42,20 @@ class TestArgumentParsing(unittest.TestCase):
         self.assertEqual(args.searches, expected_searches)
         self.assertEqual(args.replacements, expected_replacements)
 
+    def test_min_similarity_argument(self):
+        args = parse_arguments(['-f', '/path/to/math.rs', '-s', 'a + b', '--min-similarity', '85'])
+        self.assertEqual(args.min_similarity, 85.0)
+
+        with self.assertRaises(SystemExit):
+            parse_arguments(['-f', '/path/to/math.rs', '-s', 'a + b', '--min-similarity', '150'])
+
+    def test_log_level_argument(self):
+        args = parse_arguments(['-f', '/path/to/math.rs', '-s', 'a + b', '--log-level', 'debug'])
+        self.assertEqual(args.log_level, logging.DEBUG)
+
+        with self.assertRaises(SystemExit):
+            parse_arguments(['-f', '/path/to/math.rs', '-s', 'a + b', '--log-level', 'loud'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import os
+import sys
+
+# Add the directory containing the script to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark_hunk_search_and_replace import parse_patch, scale_content, udiff_coder_module, UDIFF_CODER_FILE
+from hunk_search_and_replace import compare_hunks_to_files
+
+
+class TestBenchmarkCorpus(unittest.TestCase):
+    def test_parse_patch(self):
+        patch = """--- base/Cargo.toml\t2024-06-06 23:57:15.609555686 +0000
++++ changed/Cargo.toml\t2024-06-06 23:35:45.061381176 +0000
+@@ -1,3 +1,3 @@
+ [package]
+-name = "example"
++name = "example_changed"
+ edition = "2018"
+@@ -7,0 +8,2 @@
++serde = "1.0"
++
+"""
+        hunks = parse_patch(patch)
+
+        self.assertEqual(len(hunks), 1)
+        self.assertEqual(hunks[0]["search"], '[package]\nname = "example"\nedition = "2018"')
+        self.assertEqual(hunks[0]["replace"], '[package]\nname = "example_changed"\nedition = "2018"')
+        self.assertEqual(hunks[0]["lines"][1], '-name = "example"\n')
+
+    def test_scale_content_keeps_hunks_unique(self):
+        content = 'fn add(a: i32, b: i32) -> i32 {\n    a + b\n}\n'
+        scaled = scale_content(content, 1000)
+
+        self.assertGreaterEqual(scaled.count('\n'), 900)
+        result = compare_hunks_to_files({'math.rs': [[content.strip()]]}, {'math.rs': scaled})
+        self.assertEqual(len(result['math.rs']['hunks'][0]['candidates']), 1)
+        self.assertEqual(result['math.rs']['hunks'][0]['matchPercentage'], 100)
+
+    @unittest.skipIf(udiff_coder_module is None, "aider is not installed")
+    def test_udiff_coder_is_the_repository_copy(self):
+        self.assertEqual(os.path.abspath(udiff_coder_module.__file__), UDIFF_CODER_FILE)
+        self.assertEqual(udiff_coder_module.apply_hunk("a\nb\nc\n", [" a\n", "-b\n", "+B\n", " c\n"]), "a\nB\nc\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
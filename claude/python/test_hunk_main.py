@@ -120,6 +120,17 @@ pub fn subtract(a: i32, b: i32) -> i32 {
         self.assertIn("let result = a + b;", math_content)
         self.assertIn("result", math_content)
 
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_main_function_reports_replacement_that_cannot_be_encoded(self, mock_stdout):
+        math_file = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        sys.argv = ['hunk_search_and_replace.py', '-f', math_file, '-s', 'a - b', '-r', 'a - b // \ud800']
+
+        main()
+
+        self.assertIn(f"Error: Cannot write {math_file}", mock_stdout.getvalue())
+        with open(math_file, 'r') as f:
+            self.assertEqual(f.read(), self.test_files[os.path.join('src', 'utils', 'math.rs')])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,13 +1,20 @@
 import unittest
 import os
 import sys
+import json
 import shutil
+from io import StringIO
+from unittest.mock import patch
 
 # Add the directory containing the script to the Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from hunk_search_and_replace import compare_hunks_to_files, replace_hunks_in_files, read_file, write_file, \
-    create_backup, create_patch, create_base64_patch, find_common_ancestor
+    create_backup, create_patch, create_base64_patch, find_common_ancestor, build_line_index, build_prefix_hashes, \
+    bounded_edit_distance, unified_diff, FileCache, serve_lines, timing_logger, iter_manifest_entries, \
+    process_manifest, ManifestEntry, ndjson_hunk_writer, summarize_search_results, FileTransaction, \
+    recover_transactions, BackupStore, restore_session, apply_file_hunks, check_hunk_overlaps, \
+    find_project_root
 
 
 class TestHunkSearch(unittest.TestCase):
@@ -69,6 +76,150 @@ fn main() {
         self.assertEqual(result[os.path.join(self.project_root, 'src', 'main.rs')]["hunks"][0]["matchPercentage"], 100)
         self.assertEqual(result[os.path.join(self.project_root, 'src', 'main.rs')]["hunks"][1]["matchPercentage"], 100)
 
+    def test_build_line_index(self):
+        non_empty_lines = [("}", 3), ("a + b", 2), ("}", 7), ("a - b", 6)]
+        line_index = build_line_index(non_empty_lines)
+        self.assertEqual(line_index["}"], [3, 7])
+        self.assertEqual(line_index["a + b"], [2])
+        self.assertNotIn("", line_index)
+
+    def test_compare_hunks_reports_first_occurrence(self):
+        file_path = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        searches = {file_path: [["}"]]}
+
+        result = compare_hunks_to_files(searches, {file_path: read_file(file_path)})
+        self.assertEqual(result[file_path]["hunks"][0]["matches"],
+                         [{"hunkLineNum": 1, "fileLineNum": 3, "content": "}"}])
+
+    def test_compare_hunks_prefers_contiguous_block(self):
+        file_path = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        searches = {file_path: [["    a - b\n}"]]}
+
+        result = compare_hunks_to_files(searches, {file_path: read_file(file_path)})
+        hunk_result = result[file_path]["hunks"][0]
+        self.assertEqual([match["fileLineNum"] for match in hunk_result["matches"]], [6, 7])
+        self.assertEqual(hunk_result["candidates"], [{"startLineNum": 6, "endLineNum": 7, "score": 100.0}])
+
+    def test_compare_hunks_scores_partial_candidates(self):
+        file_path = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        searches = {file_path: [["pub fn subtract(a: i32, b: i32) -> i32 {\n    a * b\n}"]]}
+
+        result = compare_hunks_to_files(searches, {file_path: read_file(file_path)})
+        hunk_result = result[file_path]["hunks"][0]
+        self.assertEqual(hunk_result["candidates"][0]["startLineNum"], 5)
+        self.assertAlmostEqual(hunk_result["candidates"][0]["score"], 200 / 3)
+        self.assertEqual(len(hunk_result["errors"]), 1)
+
+    def test_compare_hunks_rejects_lines_found_out_of_order(self):
+        file_path = os.path.join(self.project_root, 'src', 'order.rs')
+        searches = {file_path: [["y();\nx();"]]}
+
+        result = compare_hunks_to_files(searches, {file_path: "fn a() {\n    x();\n}\nfn b() {\n    y();\n}"})
+        hunk_result = result[file_path]["hunks"][0]
+        self.assertEqual([match["fileLineNum"] for match in hunk_result["matches"]], [5, 2])
+        self.assertEqual(len(hunk_result["errors"]), 1)
+        self.assertIn("not as one contiguous block", hunk_result["errors"][0])
+
+    def test_rolling_hash_collisions_are_not_matches(self):
+        file_path = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        searches = {file_path: [["    a * b\n}"]]}
+        file_system = {file_path: read_file(file_path)}
+
+        # Make every window collide with the hunk's hash
+        with patch('hunk_search_and_replace.window_hash', return_value=build_prefix_hashes(["a * b", "}"])[-1]):
+            for search_mode in ("block", "multi"):
+                hunk_result = compare_hunks_to_files(searches, file_system, search_mode)[file_path]["hunks"][0]
+                self.assertTrue(all(candidate["score"] < 100 for candidate in hunk_result["candidates"]))
+                self.assertEqual(hunk_result["mismatches"], [{"hunkLineNum": 1, "content": "a * b"}])
+
+    def test_multi_search_mode_matches_block_mode(self):
+        file_path = os.path.join(self.project_root, 'src', 'main.rs')
+        searches = {
+            file_path: [
+                ["fn main() {\n    let mut map = HashMap::new();"],
+                ["    }\n}"],
+                ["// Iterate over the map\n    for (key, value) in &map {"],
+                ["This line does not exist"]
+            ]
+        }
+        file_system = {file_path: read_file(file_path)}
+
+        block = compare_hunks_to_files(searches, file_system, "block")
+        multi = compare_hunks_to_files(searches, file_system, "multi")
+        for block_hunk, multi_hunk in zip(block[file_path]["hunks"], multi[file_path]["hunks"]):
+            self.assertEqual(block_hunk["matches"], multi_hunk["matches"])
+            self.assertEqual(block_hunk["errors"], multi_hunk["errors"])
+        self.assertEqual([match["fileLineNum"] for match in multi[file_path]["hunks"][1]["matches"]], [12, 13])
+
+    def test_bounded_edit_distance(self):
+        self.assertEqual(bounded_edit_distance("a + b", "a + b", 0), 0)
+        self.assertEqual(bounded_edit_distance("kitten", "sitting", 5), 3)
+        self.assertEqual(bounded_edit_distance("kitten", "sitting", 2), 3)
+        self.assertEqual(bounded_edit_distance("a - b", "a - b - c - d", 3), 4)
+
+    def test_fuzzy_match_requires_min_similarity(self):
+        file_path = os.path.join(self.project_root, 'src', 'main.rs')
+        searches = {file_path: [["    map.insert(\"key1\", \"valeu1\");\n    map.insert(\"key2\", \"value2\");"]]}
+        file_system = {file_path: read_file(file_path)}
+
+        exact = compare_hunks_to_files(searches, file_system)
+        self.assertEqual(len(exact[file_path]["hunks"][0]["errors"]), 1)
+
+        fuzzy = compare_hunks_to_files(searches, file_system, min_similarity=90)
+        hunk_result = fuzzy[file_path]["hunks"][0]
+        self.assertEqual(hunk_result["errors"], [])
+        self.assertEqual([match["fileLineNum"] for match in hunk_result["matches"]], [6, 7])
+        self.assertGreaterEqual(hunk_result["matchPercentage"], 90)
+        self.assertLess(hunk_result["matchPercentage"], 100)
+
+    def test_streamed_search_matches_in_memory_search(self):
+        file_path = os.path.join(self.project_root, 'src', 'main.rs')
+        searches = {file_path: [["    }\n}"], ["// Main function\nfn main() {"], ["Not in the file"]]}
+
+        in_memory = compare_hunks_to_files(searches, {file_path: read_file(file_path)})
+        streamed = compare_hunks_to_files(searches, {}, streamed_files=[file_path])
+        self.assertEqual(streamed[file_path]["fileLines"], in_memory[file_path]["fileLines"])
+        for in_memory_hunk, streamed_hunk in zip(in_memory[file_path]["hunks"], streamed[file_path]["hunks"]):
+            self.assertEqual(streamed_hunk["matches"], in_memory_hunk["matches"])
+            self.assertEqual(streamed_hunk["errors"], in_memory_hunk["errors"])
+
+    def test_timing_events_per_phase(self):
+        file_path = os.path.join(self.project_root, 'src', 'main.rs')
+        searches = {file_path: [['map.insert("key1", "value1");']]}
+
+        with self.assertLogs(timing_logger, level='INFO') as logs:
+            compare_hunks_to_files(searches, {file_path: self.test_files[os.path.join('src', 'main.rs')]})
+
+        events = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual([(event["event"], event["phase"], event["file"]) for event in events],
+                         [("phase", "search", file_path)])
+        self.assertGreaterEqual(events[0]["ms"], 0)
+
+    def test_ndjson_output_streams_one_record_per_hunk(self):
+        main_file = os.path.join(self.project_root, 'src', 'main.rs')
+        missing_file = os.path.join(self.project_root, 'src', 'missing.rs')
+        searches = {
+            main_file: [['map.insert("key1", "value1");\nmap.insert("key2", "value2");'], ["not in the file"]],
+            missing_file: [["anything"]]
+        }
+        output = StringIO()
+
+        result = compare_hunks_to_files(searches, {main_file: read_file(main_file)},
+                                        on_hunk=ndjson_hunk_writer(output, summary=True))
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+
+        self.assertEqual([(record["fileName"], record["hunkIndex"]) for record in records],
+                         [(main_file, 0), (main_file, 1), (missing_file, 0)])
+        self.assertEqual((records[0]["startLineNum"], records[0]["endLineNum"]), (6, 7))
+        self.assertEqual(records[1]["mismatchedLines"], [1])
+        self.assertEqual(records[1]["errors"], [f"Line 1 of hunk not found in {main_file}"])
+        self.assertNotIn("not in the file", output.getvalue())
+        self.assertNotIn("matches", records[0])
+        self.assertIn("error", records[2])
+        self.assertEqual(summarize_search_results(result)[main_file]["hunks"], [
+            {key: value for key, value in record.items() if key not in ("fileName", "hunkIndex")}
+            for record in records[0:2]])
+
     def test_non_existent_file(self):
         searches = {
             os.path.join(self.project_root, 'src', 'non_existent.rs'): [["This file does not exist"]]
@@ -109,6 +260,380 @@ fn main() {
         self.assertIn("--- src/utils/math.rs", patch_content)
         self.assertIn("+++ src/utils/math.rs", patch_content)
 
+    def test_replace_hunks_applies_all_hunks_at_their_original_lines(self):
+        main_file = os.path.join(self.project_root, 'src', 'main.rs')
+        searches = {main_file: [
+            ['println!("{}: {}", key, value);'],
+            ['fn main() {\n    let mut map = HashMap::new();'],
+            ['map.insert("key2", "value2");']
+        ]}
+        replacements = {main_file: [
+            ['println!("{} = {}", key, value);'],
+            ['fn main() {\n    // Build the map\n    let mut map = HashMap::new();'],
+            ['map.insert("key2", "value3");']
+        ]}
+
+        search_results, updated_files, backup_files, patch_file, base64_patch_file, common_ancestor = replace_hunks_in_files(
+            searches, replacements, {main_file: read_file(main_file)})
+
+        expected = self.test_files[os.path.join('src', 'main.rs')] \
+            .replace('println!("{}: {}"', 'println!("{} = {}"') \
+            .replace('fn main() {\n', 'fn main() {\n    // Build the map\n') \
+            .replace('"value2"', '"value3"')
+        self.assertEqual(read_file(main_file), expected)
+
+    def test_replace_hunks_rejects_overlapping_hunks(self):
+        math_file = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        searches = {math_file: [["pub fn add(a: i32, b: i32) -> i32 {\n    a + b"], ["a + b\n}"]]}
+        replacements = {math_file: [["pub fn add(a: i32, b: i32) -> i32 {\n    b + a"], ["a + b + 0\n}"]]}
+
+        search_results, updated_files, backup_files, patch_file, base64_patch_file, common_ancestor = replace_hunks_in_files(
+            searches, replacements, {math_file: read_file(math_file)})
+
+        self.assertEqual(search_results[math_file]["hunks"][0]["errors"], [])
+        self.assertIn("Hunk 2 overlaps hunk 1", search_results[math_file]["hunks"][1]["errors"][0])
+        self.assertEqual(backup_files, {})
+        self.assertEqual(read_file(math_file), self.test_files[os.path.join('src', 'utils', 'math.rs')])
+
+    def test_ndjson_records_include_overlap_errors(self):
+        math_file = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        searches = [["pub fn add(a: i32, b: i32) -> i32 {\n    a + b"], ["a + b\n}"]]
+        replacements = [["pub fn add(a: i32, b: i32) -> i32 {\n    b + a"], ["a + b + 0\n}"]]
+        output = StringIO()
+
+        replace_hunks_in_files({math_file: searches}, {math_file: replacements}, {math_file: read_file(math_file)},
+                               on_hunk=ndjson_hunk_writer(output, summary=True))
+        process_manifest([ManifestEntry(math_file, search[0], replacement[0])
+                          for search, replacement in zip(searches, replacements)], FileCache(),
+                         on_hunk=ndjson_hunk_writer(output, summary=True))
+
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([record["hunkIndex"] for record in records], [0, 1, 0, 1])
+        for record in records[1::2]:
+            self.assertIn("Hunk 2 overlaps hunk 1", record["errors"][0])
+        self.assertEqual(read_file(math_file), self.test_files[os.path.join('src', 'utils', 'math.rs')])
+
+    def test_hunks_ending_before_they_start_are_rejected(self):
+        math_file = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        content = self.test_files[os.path.join('src', 'utils', 'math.rs')]
+        hunk_results = [{
+            "matches": [{"hunkLineNum": 1, "fileLineNum": 6, "content": "a - b"},
+                        {"hunkLineNum": 2, "fileLineNum": 2, "content": "a + b"}],
+            "mismatches": [], "hunkLines": 2, "matchPercentage": 100, "errors": [], "candidates": []
+        }]
+
+        with self.assertRaises(ValueError):
+            apply_file_hunks(math_file, hunk_results, [["a - b\na + b"]], content,
+                             FileTransaction(BackupStore(os.path.join(self.project_root, '.hunk_backups'))))
+
+        self.assertTrue(check_hunk_overlaps(math_file, hunk_results))
+        self.assertIn("Hunk 1 ends before it starts", hunk_results[0]["errors"][0])
+
+    def test_replace_hunks_preserves_line_endings_and_encoding(self):
+        main_file = os.path.join(self.project_root, 'src', 'main.rs')
+        math_file = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        main_bytes = b'\xef\xbb\xbf' + self.test_files[os.path.join('src', 'main.rs')].replace('\n', '\r\n').encode()
+        math_bytes = ('// Fonctions de base, écrites en Latin-1\n'
+                      + self.test_files[os.path.join('src', 'utils', 'math.rs')]).encode('latin-1')
+        for file_path, data in ((main_file, main_bytes), (math_file, math_bytes)):
+            with open(file_path, 'wb') as f:
+                f.write(data)
+
+        searches = {
+            main_file: [["// Main function\nuse std::collections::HashMap;"], ["println!(\"{}: {}\", key, value);"]],
+            math_file: [["a - b"]]
+        }
+        replacements = {
+            main_file: [["// Main function\r\nuse std::collections::BTreeMap;"], ["println!(\"{} = {}\", key, value);"]],
+            math_file: [["a - b // différence"]]
+        }
+
+        streamed = compare_hunks_to_files(searches, {}, streamed_files=[main_file, math_file])
+        self.assertTrue(all(not hunk["errors"] for result in streamed.values() for hunk in result["hunks"]))
+
+        replace_hunks_in_files(searches, replacements, {main_file: read_file(main_file), math_file: read_file(math_file)})
+
+        with open(main_file, 'rb') as f:
+            self.assertEqual(f.read(), main_bytes.replace(b'HashMap;', b'BTreeMap;')
+                             .replace(b'"{}: {}"', b'"{} = {}"'))
+        with open(math_file, 'rb') as f:
+            self.assertEqual(f.read(), math_bytes.replace(b'a - b', 'a - b // différence'.encode('utf-8')))
+
+    def test_replace_hunks_keeps_untouched_bytes_of_mostly_utf8_file(self):
+        math_file = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        math_bytes = ('// Opérations de base\n' + self.test_files[os.path.join('src', 'utils', 'math.rs')]).encode() \
+            .replace(b'a - b', b'a - b // \xff')
+        with open(math_file, 'wb') as f:
+            f.write(math_bytes)
+
+        replace_hunks_in_files({math_file: [["a + b"]]}, {math_file: [["b + a"]]}, {math_file: read_file(math_file)})
+
+        with open(math_file, 'rb') as f:
+            self.assertEqual(f.read(), math_bytes.replace(b'a + b', b'b + a'))
+
+    def test_replace_hunks_with_jobs(self):
+        main_file = os.path.join(self.project_root, 'src', 'main.rs')
+        math_file = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        searches = {
+            main_file: [["map.insert(\"key2\", \"value2\");"]],
+            math_file: [["a - b"]]
+        }
+        replacements = {
+            main_file: [["map.insert(\"key2\", \"value3\");"]],
+            math_file: [["b - a"]]
+        }
+
+        search_results, updated_files, backup_files, patch_file, base64_patch_file, common_ancestor = replace_hunks_in_files(
+            searches, replacements, {file_path: read_file(file_path) for file_path in searches}, jobs=4)
+
+        self.assertEqual(list(backup_files), [main_file, math_file])
+        self.assertIn("value3", read_file(main_file))
+        self.assertIn("b - a", read_file(math_file))
+        with open(patch_file, 'r') as f:
+            patch_content = f.read()
+        self.assertLess(patch_content.index("main.rs"), patch_content.index("math.rs"))
+
+    def test_iter_manifest_entries(self):
+        ndjson = '{"file": "a.rs", "search": "x", "replace": "y"}\n{"file": "b.rs", "search": "z"}\n'
+        array = '[\n  {"file": "a.rs",\n   "search": "x", "replace": "y"},\n  {"file": "b.rs", "search": "z"}\n]\n'
+        batch = json.dumps({"searches": {"a.rs": [["x"]], "b.rs": [["z"]]}, "replacements": {"a.rs": [["y"]]}})
+        expected = [ManifestEntry("a.rs", "x", "y"), ManifestEntry("b.rs", "z", None)]
+
+        for manifest in (ndjson, array, batch):
+            self.assertEqual(list(iter_manifest_entries(StringIO(manifest))), expected)
+
+        with self.assertRaises(ValueError):
+            list(iter_manifest_entries(StringIO('{"file": "a.rs", "search": ')))
+        with self.assertRaises(ValueError):
+            list(iter_manifest_entries(StringIO('{"path": "a.rs"}')))
+
+    def test_process_manifest(self):
+        main_file = os.path.join(self.project_root, 'src', 'main.rs')
+        math_file = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        entries = [
+            ManifestEntry(main_file, 'map.insert("key2", "value2");', 'map.insert("key2", "value3");'),
+            ManifestEntry(math_file, "a - b", "b - a"),
+            ManifestEntry(main_file, 'map.insert("key1", "value1");', 'map.insert("key1", "value0");'),
+            ManifestEntry(math_file, "a * b", "b * a")
+        ]
+
+        search_results, backup_files, patch_file, base64_patch_file, common_ancestor = process_manifest(
+            iter(entries), FileCache())
+
+        self.assertEqual(len(search_results[main_file]["hunks"]), 2)
+        self.assertTrue(search_results[math_file]["hunks"][1]["errors"])
+        self.assertIn("value0", read_file(main_file))
+        self.assertIn("value3", read_file(main_file))
+        self.assertIn("b - a", read_file(math_file))
+        self.assertIn('"value2"', read_file(backup_files[main_file]))
+        with open(patch_file, 'r') as f:
+            patch_content = f.read()
+        self.assertEqual(patch_content.count("+++ src/main.rs"), 1)
+        self.assertIn("+++ src/utils/math.rs", patch_content)
+
+    def test_replace_hunks_with_each_durability_level(self):
+        math_file = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        for level, search, replace in [("none", "a - b", "b - a"), ("file", "b - a", "a - b"),
+                                       ("batch", "a - b", "b - a"), ("verify", "b - a", "a - b")]:
+            with self.subTest(durability=level):
+                search_results, updated_files, backup_files, patch_file, base64_patch_file, common_ancestor = \
+                    replace_hunks_in_files({math_file: [[search]]}, {math_file: [[replace]]},
+                                           {math_file: read_file(math_file)}, durability=level)
+                self.assertEqual(read_file(math_file), updated_files[math_file])
+                self.assertIn(replace, read_file(math_file))
+                self.assertFalse(any(name.endswith('.tmp') for name in os.listdir(os.path.dirname(math_file))))
+
+        with self.assertRaises(ValueError):
+            FileTransaction(BackupStore(os.path.join(self.project_root, '.hunk_backups')), durability="paranoid")
+
+    def test_batch_durability_fsyncs_blobs_and_directories_at_commit(self):
+        main_file = os.path.join(self.project_root, 'src', 'main.rs')
+        store = BackupStore(os.path.join(self.project_root, '.hunk_backups'))
+        transaction = FileTransaction(store, durability="batch")
+        with patch('hunk_transactions.os.fsync') as fsync:
+            transaction.stage(main_file, "new main")
+        fsync.assert_not_called()
+
+        with patch('hunk_transactions.fsync_path') as fsync_path:
+            transaction.commit()
+        synced = [call.args[0] for call in fsync_path.call_args_list]
+        blob = store.find(transaction.committed[0].snapshot)
+        for path in (blob, os.path.dirname(blob), store.journal_dir()):
+            self.assertIn(path, synced)
+        # The journal's entry is on disk before any file is replaced
+        self.assertLess(synced.index(store.journal_dir()), synced.index(os.path.dirname(main_file)))
+
+    def test_transaction_rolls_back_all_files_on_failure(self):
+        main_file = os.path.join(self.project_root, 'src', 'main.rs')
+        math_file = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        store = BackupStore(os.path.join(self.project_root, '.hunk_backups'))
+        transaction = FileTransaction(store)
+        transaction.stage(main_file, "new main")
+        transaction.stage(math_file, "new math")
+        self.assertEqual(read_file(main_file), self.test_files[os.path.join('src', 'main.rs')])
+
+        os.remove(transaction.staged[math_file].staged_path)
+        with self.assertRaises(FileNotFoundError):
+            transaction.commit()
+
+        self.assertEqual(read_file(main_file), self.test_files[os.path.join('src', 'main.rs')])
+        self.assertEqual(os.listdir(os.path.join(store.store_dir, 'journal')), [])
+        self.assertEqual([name for _, _, names in os.walk(os.path.join(store.store_dir, 'objects')) for name in names], [])
+        self.assertFalse(any(name.endswith('.tmp') for name in os.listdir(os.path.dirname(main_file))))
+
+    def test_recover_interrupted_transaction(self):
+        main_file = os.path.join(self.project_root, 'src', 'main.rs')
+        math_file = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        store = BackupStore(os.path.join(self.project_root, '.hunk_backups'))
+        transaction = FileTransaction(store)
+        transaction.stage(main_file, "new main")
+        transaction.stage(math_file, "new math")
+        replace = os.replace
+
+        def fail_on_math(source, destination):
+            if destination == math_file:
+                raise KeyboardInterrupt
+            replace(source, destination)
+
+        # Simulate the process dying halfway through the commit
+        with patch('os.replace', fail_on_math), patch.object(FileTransaction, 'rollback'), \
+                self.assertRaises(KeyboardInterrupt):
+            transaction.commit()
+        self.assertEqual(read_file(main_file), "new main")
+
+        self.assertEqual(recover_transactions(store), [main_file])
+        self.assertEqual(read_file(main_file), self.test_files[os.path.join('src', 'main.rs')])
+        self.assertEqual(recover_transactions(store), [])
+
+    def test_backup_store_deduplicates_and_restores_sessions(self):
+        main_file = os.path.join(self.project_root, 'src', 'main.rs')
+        original = self.test_files[os.path.join('src', 'main.rs')]
+        store = BackupStore(os.path.join(self.project_root, '.hunk_backups'))
+
+        first = FileTransaction(store)
+        first.stage(main_file, "edited once")
+        first.commit()
+        blob = store.find(first.staged[main_file].snapshot)
+        self.assertEqual(read_file(blob), original)
+
+        # Going back to the original content reuses its blob instead of storing it again
+        second = FileTransaction(store)
+        second.stage(main_file, original)
+        second.commit()
+        third = FileTransaction(store)
+        third.stage(main_file, "edited twice")
+        third.commit()
+        self.assertFalse(third.staged[main_file].snapshot_created)
+        self.assertEqual(third.staged[main_file].snapshot, first.staged[main_file].snapshot)
+        self.assertEqual(len(os.listdir(os.path.dirname(blob))), 1)
+
+        restored, session_id = restore_session(store, third.session_id)
+        self.assertEqual(restored, [main_file])
+        self.assertEqual(read_file(main_file), original)
+        self.assertEqual([session["id"] for session in store.sessions()][-1], session_id)
+        self.assertEqual(read_file(blob), original)
+
+    def test_backup_store_prunes_old_sessions(self):
+        main_file = os.path.join(self.project_root, 'src', 'main.rs')
+        math_file = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        store = BackupStore(os.path.join(self.project_root, '.hunk_backups'))
+        transactions = []
+        for file_path, content in ((main_file, "edited once"), (main_file, "edited twice"), (math_file, "edited")):
+            transaction = FileTransaction(store)
+            transaction.stage(file_path, content)
+            transaction.commit()
+            transactions.append(transaction)
+        first = transactions[0].staged[main_file].snapshot
+
+        # A blob named in the journal of an interrupted transaction is kept for recover_transactions
+        with open(os.path.join(store.journal_dir(), 'interrupted.json'), 'w') as f:
+            json.dump({"id": "interrupted", "files": [[main_file, main_file + ".tmp", first]]}, f)
+        self.assertEqual(store.prune(2), [transactions[0].session_id])
+        self.assertIsNotNone(store.find(first))
+
+        os.remove(os.path.join(store.journal_dir(), 'interrupted.json'))
+        self.assertEqual(store.prune(2), [])
+        self.assertIsNone(store.find(first))
+        self.assertEqual([session["id"] for session in store.sessions()],
+                         [transaction.session_id for transaction in transactions[1:]])
+        self.assertEqual(read_file(store.find(transactions[1].staged[main_file].snapshot)), "edited once")
+
+        self.assertEqual(len(store.prune(0)), 2)
+        self.assertEqual(os.listdir(os.path.join(store.store_dir, 'objects')), [])
+
+    def test_replace_hunks_only_recovers_when_a_journal_was_left(self):
+        math_file = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        searches = {math_file: [["a - b"]]}
+        replacements = {math_file: [["b - a"]]}
+
+        with patch('hunk_search_and_replace.recover_transactions') as recover:
+            replace_hunks_in_files(searches, replacements, {math_file: read_file(math_file)})
+            self.assertFalse(recover.called)
+
+            # The store replace_hunks_in_files uses, under the project root it finds
+            store = BackupStore(os.path.join(find_project_root([math_file]), '.hunk_backups'))
+            journal_path = os.path.join(store.journal_dir(), 'interrupted.json')
+            with open(journal_path, 'w') as f:
+                json.dump({"id": "interrupted", "files": []}, f)
+            try:
+                replace_hunks_in_files({math_file: [["b - a"]]}, {math_file: [["a - b"]]},
+                                       {math_file: read_file(math_file)})
+            finally:
+                os.remove(journal_path)
+            recover.assert_called_once()
+
+    def test_unified_diff_format(self):
+        original = "a\nb\nc\nd\ne\nf\ng\nh\ni\nj\nk\n"
+        updated = "a\nB\nc\nd\ne\nf\ng\nh\ni\nj\nK"
+
+        self.assertEqual(unified_diff(original, updated, "src/x.txt", "src/x.txt"), (
+            "--- src/x.txt\n"
+            "+++ src/x.txt\n"
+            "@@ -1,5 +1,5 @@\n"
+            " a\n-b\n+B\n c\n d\n e\n"
+            "@@ -8,4 +8,4 @@\n"
+            " h\n i\n j\n-k\n+K\n"
+            "\\ No newline at end of file\n"
+        ))
+        self.assertEqual(unified_diff(original, original, "src/x.txt", "src/x.txt"), "")
+
+    def test_serve_lines_reuses_cache_until_file_changes(self):
+        file_path = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        cache = FileCache()
+        requests = [
+            {"id": 1, "searches": {file_path: [["a - b"]]}},
+            {"id": 2, "searches": {file_path: [["a - b"]]}, "replacements": {file_path: [["b - a"]]}},
+            {"id": 3, "searches": {file_path: [["b - a"]]}},
+            {"id": 4, "searches": {}}
+        ]
+        output = StringIO()
+
+        serve_lines(StringIO("".join(json.dumps(request) + "\n" for request in requests)), output, cache)
+        responses = [json.loads(line) for line in output.getvalue().splitlines()]
+
+        self.assertEqual([response["id"] for response in responses], [1, 2, 3, 4])
+        self.assertEqual(responses[0]["result"][file_path]["hunks"][0]["matchPercentage"], 100)
+        self.assertTrue(responses[1]["replaced"])
+        self.assertEqual(responses[2]["result"][file_path]["hunks"][0]["matchPercentage"], 100)
+        self.assertIn("error", responses[3])
+        self.assertIn("b - a", cache.get(file_path)[0])
+
+    def test_file_cache_evicts_least_recently_used(self):
+        main_file = os.path.join(self.project_root, 'src', 'main.rs')
+        math_file = os.path.join(self.project_root, 'src', 'utils', 'math.rs')
+        cache = FileCache(max_bytes=os.path.getsize(main_file) + os.path.getsize(math_file))
+
+        main_content, main_index = cache.get(main_file)
+        cache.get(math_file)
+        self.assertIs(cache.get(main_file)[1], main_index)
+        self.assertEqual(cache.total_bytes, cache.max_bytes)
+
+        with open(math_file, 'a') as f:
+            f.write("\n")
+        cache.get(math_file)
+        self.assertLessEqual(cache.total_bytes, cache.max_bytes)
+        self.assertIsNot(cache.get(main_file)[1], main_index)
+
     def test_find_common_ancestor(self):
         file_paths = [
             os.path.join(self.project_root, 'src', 'main.rs'),
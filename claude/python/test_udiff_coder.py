@@ -0,0 +1,351 @@
+import unittest
+import os
+import shutil
+import tempfile
+import importlib.util
+from unittest.mock import patch
+
+# The installed aider package: the repository's udiff coder is loaded into it below
+import aider.coders  # noqa: F401
+
+UDIFF_CODER_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'textBasedStuff',
+                                'diffing', 'aider', 'udiff', 'udiff_coder.py')
+
+
+def load_udiff_coder():
+    # A module of aider.coders, so the file's relative imports resolve to aider's own modules
+    spec = importlib.util.spec_from_file_location('aider.coders.repo_udiff_coder', UDIFF_CODER_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+udiff_coder = load_udiff_coder()
+
+
+def new_coder():
+    # Coder.__init__ needs a model and a repo: the tests set the few attributes they use themselves
+    with patch.object(udiff_coder.Coder, '__init__', lambda self, *args, **kwargs: None):
+        return udiff_coder.UnifiedDiffCoder()
+
+
+def c_functions(count):
+    return "".join(f"int f{i}(int a) {{\n    if (a > {i}) {{\n        return g{i}(a);\n    }}\n    return 0;\n}}\n\n"
+                   for i in range(count))
+
+
+class FileIO:
+    """Reads and writes files like aider's InputOutput, counting the calls."""
+
+    def __init__(self):
+        self.reads = []
+        self.writes = []
+
+    def read_text(self, path):
+        self.reads.append(path)
+        try:
+            with open(path, 'r') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def write_text(self, path, content):
+        self.writes.append(path)
+        with open(path, 'w') as f:
+            f.write(content)
+
+
+class TestUnifiedDiffCoder(unittest.TestCase):
+    def setUp(self):
+        self.project_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.project_root)
+
+    def write_files(self, files):
+        for file_name, content in files.items():
+            with open(os.path.join(self.project_root, file_name), 'w') as f:
+                f.write(content)
+
+    def read_file(self, file_name):
+        with open(os.path.join(self.project_root, file_name), 'r') as f:
+            return f.read()
+
+    def make_coder(self, response):
+        coder = new_coder()
+        coder.io = FileIO()
+        coder.abs_root_path = lambda path: os.path.join(self.project_root, path)
+        coder.partial_response_content = response
+        return coder
+
+    def test_new_lines_are_found_against_the_whole_file(self):
+        # Made-up context lines (ending in Z) in a file much longer than the hunks: only the lines
+        # the model added may be written, however far the rest of the file is from the hunks
+        content = c_functions(60)
+        self.write_files({'funcs.c': content})
+        coder = self.make_coder(
+            "```diff\n--- funcs.c\n+++ funcs.c\n"
+            "@@ @@\n }\n \n int f48(int a) {Z\n     if (a > 48) {\n         return g48(a);\n+// cF\n"
+            "     }\n     return 0;\n"
+            "@@ @@\n     }\n+// cB\n     return 0;\n }\n \n int f39(int a) {\n     if (a > 39) {Z\n"
+            "         return g39(a);\n"
+            "```\n")
+
+        coder.apply_edits(coder.get_edits())
+
+        self.assertEqual(self.read_file('funcs.c'), content
+                         .replace("        return g38(a);\n    }\n", "        return g38(a);\n    }\n// cB\n")
+                         .replace("        return g48(a);\n", "        return g48(a);\n// cF\n"))
+
+    def test_hunk_header_past_the_end_of_the_file(self):
+        self.write_files({'vars.py': "a = 1\nb = 2\nc = 3\n}\n"})
+        coder = self.make_coder("```diff\n--- vars.py\n+++ vars.py\n@@ -9,1 +8,0 @@\n-}\n```\n")
+
+        coder.apply_edits(coder.get_edits())
+
+        self.assertEqual(self.read_file('vars.py'), "a = 1\nb = 2\nc = 3\n")
+
+    def test_hint_does_not_pick_one_of_two_identical_blocks(self):
+        # Applied to the whole file every copy changes, and a header pointing at one must not change that
+        block = "def check(a):\n    if a:\n        return 1\n    return 0\n\n"
+        content = "x = 1\n\n" + block + "y = 2\n\n" + block
+        expected = content.replace("        return 1\n", "        return 1\n    # checked\n")
+        for header in ("@@ -10,3 +10,4 @@", "@@ -3,3 +3,4 @@", "@@ @@"):
+            with self.subTest(header=header):
+                self.write_files({'check.py': content})
+                coder = self.make_coder(
+                    "```diff\n--- check.py\n+++ check.py\n"
+                    f"{header}\n     if a:\n         return 1\n+    # checked\n     return 0\n"
+                    "```\n")
+
+                coder.apply_edits(coder.get_edits())
+
+                self.assertEqual(self.read_file('check.py'), expected)
+
+    def test_hints_move_with_the_lines_added_above_them(self):
+        # The second header counts lines of the file before the first hunk added ten lines above it
+        content = c_functions(10)
+        self.write_files({'funcs.c': content})
+        added = "".join(f"+    // {i}\n" for i in range(10))
+        coder = self.make_coder(
+            "```diff\n--- funcs.c\n+++ funcs.c\n"
+            f"@@ -8,2 +8,12 @@\n int f1(int a) {{\n{added}     if (a > 1) {{\n"
+            "@@ -37,3 +47,4 @@\n int f5(int a) {\n+    // five\n     if (a > 5) {\n"
+            "```\n")
+
+        hints = []
+        apply_hunk = udiff_coder.apply_hunk
+
+        def record_hint(content, hunk):
+            hints.append(hunk.hint)
+            return apply_hunk(content, hunk)
+
+        with patch.object(udiff_coder, 'apply_hunk', record_hint):
+            coder.apply_edits(coder.get_edits())
+
+        self.assertEqual(hints, [7, 46])
+        self.assertEqual(self.read_file('funcs.c'), content
+                         .replace("int f1(int a) {\n",
+                                  "int f1(int a) {\n" + "".join(f"    // {i}\n" for i in range(10)))
+                         .replace("int f5(int a) {\n", "int f5(int a) {\n    // five\n"))
+
+    def test_each_file_is_read_and_written_once(self):
+        self.write_files({name: c_functions(4) for name in ('a.c', 'b.c', 'c.c')})
+        coder = self.make_coder(
+            "```diff\n"
+            "--- a.c\n+++ a.c\n@@ @@\n int f0(int a) {\n+    // a0\n     if (a > 0) {\n"
+            "--- c.c\n+++ c.c\n@@ @@\n int f9(int a) {\n+    // c9\n     if (a > 9) {\n"
+            "--- b.c\n+++ b.c\n@@ @@\n int f1(int a) {\n+    // b1\n     if (a > 1) {\n"
+            "--- a.c\n+++ a.c\n@@ @@\n int f8(int a) {\n+    // a8\n     if (a > 8) {\n"
+            "@@ @@\n int f2(int a) {\n+    // a2\n     if (a > 2) {\n"
+            "```\n")
+
+        with self.assertRaises(ValueError) as cm:
+            coder.apply_edits(coder.get_edits())
+
+        # Errors come in the order of the hunks in the response
+        message = str(cm.exception)
+        self.assertLess(message.index("int f9"), message.index("int f8"))
+
+        paths = [os.path.join(self.project_root, name) for name in ('a.c', 'c.c', 'b.c')]
+        self.assertEqual(coder.io.reads, paths)
+        self.assertEqual(coder.io.writes, [paths[0], paths[2]])
+        self.assertEqual(self.read_file('a.c'), c_functions(4)
+                         .replace("int f0(int a) {\n", "int f0(int a) {\n    // a0\n")
+                         .replace("int f2(int a) {\n", "int f2(int a) {\n    // a2\n"))
+        self.assertEqual(self.read_file('c.c'), c_functions(4))
+
+
+class TestContentIndex(unittest.TestCase):
+    content = ("def f():\n    x = 1\n    y = 2\n    return x\n\n"
+               "def g():\n    x = 1\n    y = 2\n    return y\n")
+
+    def setUp(self):
+        self.index = udiff_coder.ContentIndex(self.content)
+
+    def test_find_runs(self):
+        # Inner lines match whole stripped lines; the first and last may match part of a line
+        self.assertEqual(self.index.find_runs("x = 1\n  y = 2\nreturn", None), [1, 6])
+        self.assertEqual(self.index.find_runs("x = 1\n  y = 2\nreturn", 1), [1])
+        self.assertEqual(self.index.find_runs("f():\n    x = 1\n    y = 2\n", None), [0])
+        self.assertEqual(self.index.find_runs("x = 1\nz = 2\nreturn\n", None), [])
+
+    def test_find_runs_needs_three_lines(self):
+        self.assertIsNone(self.index.find_runs("x = 1\ny = 2\n", None))
+
+    def test_may_contain(self):
+        # The first and last lines may be part of a line, the others have to be whole lines
+        self.assertTrue(self.index.may_contain("def f():\n    x = 1\n"))
+        self.assertTrue(self.index.may_contain("f():\n    x = 1\n    y"))
+        self.assertFalse(self.index.may_contain("def h():\n    x = 1\n"))
+        self.assertTrue(self.index.may_contain("    x = 1\n    y = 2\n    return y\n"))
+        self.assertFalse(self.index.may_contain("    x = 1\n    y = 3\n    return y\n"))
+        self.assertFalse(self.index.may_contain("    x = 1\n  = 2\n    return y\n"))
+
+    def test_may_repeat(self):
+        self.assertTrue(self.index.may_repeat("    x = 1\n    y = 2\n    return\n"))
+        self.assertFalse(self.index.may_repeat("    y = 2\n    return x\n\ndef g():\n"))
+        # The inner lines are all repeated, but only once in this order
+        self.assertFalse(self.index.may_repeat("    x = 1\n    y = 2\n    return y\n"))
+        # Without inner lines to count, it can't be ruled out
+        self.assertTrue(self.index.may_repeat("def g():\n    x = 1\n"))
+
+
+class TestPartialHunks(unittest.TestCase):
+    content = c_functions(5)
+    preceding = [" }\n", " int f2(int a) {Z\n", "     if (a > 2) {\n"]
+    changes = ["+        // two\n"]
+    following = ["         return g2(a);\n", "     }Z\n", "     return 0;\n"]
+
+    def hunks(self):
+        return [udiff_coder.Hunk(lines) for lines in (self.preceding, self.changes, self.following)]
+
+    def test_failed_search_texts_are_not_tried_again(self):
+        content = TestContentIndex.content
+        index = udiff_coder.ContentIndex(content)
+        hunk = udiff_coder.Hunk(["-    x = 1\n", "-    return y\n", "+    z = 3\n"])
+        self.assertIsNone(udiff_coder.directly_apply_hunk(content, hunk, index))
+        self.assertIn((hunk.before, hunk.after), index.failed)
+
+        hunk = udiff_coder.Hunk(["-def g():\n", "+def h():\n", "     x = 1\n"])
+        index.failed.add((hunk.before, hunk.after))
+        self.assertIsNone(udiff_coder.directly_apply_hunk(content, hunk, index))
+        self.assertEqual(udiff_coder.directly_apply_hunk(content, hunk),
+                         content.replace("def g():", "def h():"))
+
+    def test_max_following_context(self):
+        index = udiff_coder.ContentIndex(self.content)
+        window = udiff_coder.context_windows(*self.hunks())
+        # "}Z" can't follow, and "int f2(int a) {Z" can't precede
+        self.assertEqual(udiff_coder.max_following_context(index, window, 3, 3), [1, 1, -1, -1])
+
+    def test_index_does_not_change_the_window_found(self):
+        expected = self.content.replace("(a > 2) {\n", "(a > 2) {\n        // two\n")
+        index = udiff_coder.ContentIndex(self.content)
+        self.assertEqual(udiff_coder.apply_partial_hunk(self.content, *self.hunks(), index), expected)
+        self.assertEqual(udiff_coder.apply_partial_hunk(self.content, *self.hunks()), expected)
+
+
+class TestDiffParser(unittest.TestCase):
+    # The last block is never closed, and the response doesn't end in a newline
+    response = ("Some text\n```diff\n--- a.py\n+++ a.py\n"
+                "@@ -1,2 +1,2 @@\n-x = 1\n+x = 2\n y = 3\n@@ -10,2 +10,2 @@\n-z\n+w\n```\n"
+                "```diff\n--- b.py\n+++ b.py\n@@ ... @@\n a\n+b\n```\nmore\n"
+                "```diff\n--- c.py\n+++ c.py\n@@ -3 +3 @@\n-q\n+r")
+
+    def parse_in_chunks(self, response, size):
+        parser = udiff_coder.DiffParser()
+        edits = []
+        for start in range(0, len(response), size):
+            edits += parser.feed(response[start:start + size])
+        return edits + parser.close()
+
+    def test_chunks_find_the_same_edits_as_the_whole_response(self):
+        for response in (self.response, self.response.replace("\n", "\r\n")):
+            expected = udiff_coder.find_diffs(response)
+            self.assertEqual(len(expected), 4)
+            for size in range(1, 10):
+                with self.subTest(crlf="\r" in response, size=size):
+                    self.assertEqual(self.parse_in_chunks(response, size), expected)
+
+    def test_edits_are_returned_as_soon_as_their_hunk_ends(self):
+        parser = udiff_coder.DiffParser()
+        self.assertEqual(parser.feed(self.response[:self.response.index("+w")]),
+                         [('a.py', ['-x = 1\n', '+x = 2\n', ' y = 3\n'], 0)])
+
+    def test_snapshot_is_closed_without_disturbing_the_parser(self):
+        expected = udiff_coder.find_diffs(self.response)
+        for cut in range(0, len(self.response), 5):
+            with self.subTest(cut=cut):
+                parser = udiff_coder.DiffParser()
+                edits = parser.feed(self.response[:cut])
+                self.assertEqual(edits + parser.snapshot().close(), udiff_coder.find_diffs(self.response[:cut]))
+                edits += parser.feed(self.response[cut:])
+                self.assertEqual(edits + parser.close(), expected)
+
+    def test_coder_starts_over_on_a_new_response(self):
+        coder = new_coder()
+        coder.get_new_edits(self.response)
+        # As long as the first and ending the same, like a retried answer
+        other = self.response.replace("a.py\n+++ a.py", "d.py\n+++ d.py")
+        self.assertNotEqual(udiff_coder.find_diffs(other), udiff_coder.find_diffs(self.response))
+        coder.partial_response_content = other
+        self.assertEqual([(path, list(hunk), hunk.hint) for path, hunk in coder.get_edits()],
+                         udiff_coder.find_diffs(other))
+
+    def test_coder_parses_a_growing_response_once(self):
+        coder = new_coder()
+        edits = []
+        for end in range(0, len(self.response), 7):
+            edits += coder.get_new_edits(self.response[:end])
+        coder.partial_response_content = self.response
+        self.assertEqual([hunk for _, hunk, _ in edits],
+                         [hunk for _, hunk, _ in udiff_coder.find_diffs(self.response)][:len(edits)])
+        self.assertEqual([(path, list(hunk), hunk.hint) for path, hunk in coder.get_edits()],
+                         udiff_coder.find_diffs(self.response))
+
+
+class TestParseHunkHeader(unittest.TestCase):
+    def test_line_numbers(self):
+        # 0-based line of the old file the hunk starts at
+        self.assertEqual(udiff_coder.parse_hunk_header("@@ -12,4 +12,5 @@\n"), 11)
+        self.assertEqual(udiff_coder.parse_hunk_header("@@ -1 +1 @@\n"), 0)
+        self.assertEqual(udiff_coder.parse_hunk_header("@@ -0,0 +1,3 @@\n"), 0)
+
+    def test_headers_without_old_line_numbers(self):
+        for line in ("@@ @@\n", "@@ ... @@\n", "@@ +3,4 @@\n"):
+            with self.subTest(line=line):
+                self.assertIsNone(udiff_coder.parse_hunk_header(line))
+
+
+class TestHunk(unittest.TestCase):
+    lines = [" a\n", "-b\n", "+c\n", " d\n"]
+
+    def test_views(self):
+        hunk = udiff_coder.Hunk(self.lines, 5)
+        self.assertEqual(hunk.before_lines, ("a\n", "b\n", "d\n"))
+        self.assertEqual(hunk.after_lines, ("a\n", "c\n", "d\n"))
+        self.assertEqual(hunk.before, "a\nb\nd\n")
+        self.assertEqual(hunk.after, "a\nc\nd\n")
+        self.assertEqual((len(hunk), list(hunk), hunk[1]), (4, self.lines, "-b\n"))
+        self.assertEqual(udiff_coder.hunk_to_before_after(self.lines), (hunk.before, hunk.after))
+
+    def test_slices_and_joins_match_parsing_the_lines(self):
+        hunk = udiff_coder.Hunk(self.lines, 5)
+        self.assertEqual(hunk[1:], udiff_coder.Hunk(self.lines[1:]))
+        self.assertIsNone(hunk[1:].hint)
+
+        joined = udiff_coder.Hunk.join([hunk[:2], hunk[2:]], 7)
+        self.assertEqual(joined.hint, 7)
+        for view in ("lines", "before_lines", "after_lines", "before", "after"):
+            self.assertEqual(getattr(joined, view), getattr(hunk, view))
+
+    def test_equal_whatever_the_hint(self):
+        hunks = [udiff_coder.Hunk(self.lines, 5), udiff_coder.Hunk(self.lines, 9),
+                 udiff_coder.Hunk(self.lines)]
+        self.assertEqual(len(set(hunks)), 1)
+        self.assertNotEqual(hunks[0], udiff_coder.Hunk(self.lines[:-1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,6 @@
+import copy
 import difflib
+import re
 from itertools import groupby
 from pathlib import Path
 
@@ -48,22 +50,58 @@ class UnifiedDiffCoder(Coder):
 
     def __init__(self, *args, **kwargs):
         self.gpt_prompts = UnifiedDiffPrompts()
+        self.diff_parser = None
+        self.parsed_length = 0
+        self.parsed_head = ""
+        self.parsed_tail = ""
+        self.parsed_edits = []
         super().__init__(*args, **kwargs)
 
+    # get_new_edits takes a response for the one it parsed so far, grown,
+    # when it starts and ends in the same this many characters
+    parsed_ends_length = 64
+
+    def get_new_edits(self, content):
+        """Parse only what was added to the response since the last call,
+        and return the edits whose hunks it completed. Can be called as
+        the response streams in to start on hunks before it ends."""
+
+        # a streamed response only grows, so comparing both ends of the
+        # part already parsed tells it from a new response without
+        # rescanning all of it
+        length = self.parsed_length
+        if (
+            self.diff_parser is None
+            or len(content) < length
+            or not content.startswith(self.parsed_head)
+            or content[length - len(self.parsed_tail) : length] != self.parsed_tail
+        ):
+            self.diff_parser = DiffParser()
+            self.parsed_edits = []
+            length = 0
+
+        new_edits = self.diff_parser.feed(content[length:])
+        self.parsed_length = len(content)
+        self.parsed_head = content[: self.parsed_ends_length]
+        self.parsed_tail = content[-self.parsed_ends_length :]
+        self.parsed_edits += new_edits
+        return new_edits
+
     def get_edits(self):
         content = self.partial_response_content
 
         # might raise ValueError for malformed ORIG/UPD blocks
-        raw_edits = list(find_diffs(content))
+        self.get_new_edits(content)
+        raw_edits = self.parsed_edits + self.diff_parser.snapshot().close()
 
         last_path = None
         edits = []
-        for path, hunk in raw_edits:
+        for path, hunk, hint in raw_edits:
             if path:
                 last_path = path
             else:
                 path = last_path
-            edits.append((path, hunk))
+            edits.append((path, Hunk(hunk, hint)))
 
         return edits
 
@@ -75,54 +113,85 @@ class UnifiedDiffCoder(Coder):
             if not hunk:
                 continue
 
-            this = [path + "\n"] + hunk
-            this = "".join(this)
-
+            this = (path, hunk)
             if this in seen:
                 continue
             seen.add(this)
 
-            uniq.append((path, hunk))
+            uniq.append(this)
+
+        # Apply all the hunks for a file to one copy of its content, so each
+        # file is read and written once
+        file_hunks = dict()
+        for hunk_num, (path, hunk) in enumerate(uniq):
+            file_hunks.setdefault(path, []).append((hunk_num, hunk))
 
         errors = []
-        for path, hunk in uniq:
-            full_path = self.abs_root_path(path)
-            content = self.io.read_text(full_path)
+        for path, hunks in file_hunks.items():
+            content = self.io.read_text(self.abs_root_path(path))
+            content, file_errors = self.apply_file_edits(path, content, hunks)
+            if content is not None:
+                self.io.write_text(self.abs_root_path(path), content)
+            errors += file_errors
+        errors = [error for _, error in sorted(errors)]
+
+        if errors:
+            errors = "\n\n".join(errors)
+            if len(errors) < len(uniq):
+                errors += other_hunks_applied
+            raise ValueError(errors)
+
+    def apply_file_edits(self, path, content, hunks):
+        """Apply a file's hunks to its content, in order.
+
+        Returns the new content, or None if no hunk applied, and the
+        (hunk number, error) pairs of the hunks that failed.
+        """
+        full_path = self.abs_root_path(path)
 
-            original, _ = hunk_to_before_after(hunk)
+        errors = []
+        applied = False
+        # hints are line numbers in the file as it was before any hunk was
+        # applied, so each one moves by the lines added or removed above it
+        moves = []
+        for hunk_num, hunk in hunks:
+            hint = hunk.hint
+            if hint is not None:
+                move = sum(lines for line_num, lines in moves if line_num < hint)
+                if move:
+                    hunk = copy.copy(hunk)
+                    hunk.hint = max(0, hint + move)
 
             try:
-                content = do_replace(full_path, content, hunk)
+                new_content = do_replace(full_path, content, hunk)
+                error = None if new_content else no_match_error
             except SearchTextNotUnique:
-                errors.append(
-                    not_unique_error.format(
-                        path=path, original=original, num_lines=len(original.splitlines())
-                    )
-                )
-                continue
+                error = not_unique_error
 
-            if not content:
-                errors.append(
-                    no_match_error.format(
-                        path=path, original=original, num_lines=len(original.splitlines())
-                    )
+            if error:
+                original = hunk.before
+                error = error.format(
+                    path=path, original=original, num_lines=len(original.splitlines())
                 )
+                errors.append((hunk_num, error))
                 continue
 
             # SUCCESS!
-            self.io.write_text(full_path, content)
+            if hint is not None:
+                moves.append((hint, new_content.count("\n") - content.count("\n")))
+            content = new_content
+            applied = True
 
-        if errors:
-            errors = "\n\n".join(errors)
-            if len(errors) < len(uniq):
-                errors += other_hunks_applied
-            raise ValueError(errors)
+        if not applied:
+            content = None
+
+        return content, errors
 
 
 def do_replace(fname, content, hunk):
     fname = Path(fname)
 
-    before_text, after_text = hunk_to_before_after(hunk)
+    before_text, after_text = hunk.before, hunk.after
 
     # does it want to make a new file?
     if not fname.exists() and not before_text.strip():
@@ -149,17 +218,107 @@ def collapse_repeats(s):
     return "".join(k for k, g in groupby(s))
 
 
-def apply_hunk(content, hunk):
-    before_text, after_text = hunk_to_before_after(hunk)
+class ContentIndex:
+    """The stripped lines of a file's content and where each one occurs,
+    built once per apply_hunk call and shared by every attempt to apply
+    its sections.
+
+    Whatever the search strategies do with blank lines and indentation,
+    the inner lines of a search text have to be whole, consecutive lines
+    of the content; only its first line may start mid-line and its last
+    may end mid-line. Looking for such runs here rules out most search
+    texts without scanning the file.
+
+    It also remembers the (before, after) pairs that already failed to
+    apply to this content, so no attempt is made twice.
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self.raw_lines = content.split("\n")
+        self.lines = [line.strip() for line in self.raw_lines]
+        self.line_numbers = dict()
+        for line_num, line in enumerate(self.lines):
+            self.line_numbers.setdefault(line, []).append(line_num)
+        self.failed = set()
+
+    def find_runs(self, text, limit):
+        lines = [line.strip() for line in text.strip("\n").split("\n")]
+        if len(lines) < 3:
+            return
+
+        inner = lines[1:-1]
+        offset, anchor = min(
+            enumerate(inner, 1), key=lambda item: len(self.line_numbers.get(item[1], ()))
+        )
+
+        runs = []
+        for line_num in self.line_numbers.get(anchor, ()):
+            start = line_num - offset
+            end = start + len(lines) - 1
+            if start < 0 or end >= len(self.lines):
+                continue
+            if self.lines[start + 1 : end] != inner:
+                continue
+            if not self.lines[start].endswith(lines[0]):
+                continue
+            if not self.lines[end].startswith(lines[-1]):
+                continue
+            runs.append(start)
+            if len(runs) == limit:
+                break
+
+        return runs
+
+    def find_copies(self, text, limit):
+        # find_runs, but texts of one or two lines are looked for line by line
+        runs = self.find_runs(text, limit)
+        if runs is not None:
+            return runs
+
+        lines = [line.strip() for line in text.strip("\n").split("\n")]
+        runs = []
+        for start in range(len(self.lines) - len(lines) + 1):
+            if len(lines) == 1:
+                if lines[0] not in self.lines[start]:
+                    continue
+            elif not (
+                self.lines[start].endswith(lines[0]) and self.lines[start + 1].startswith(lines[1])
+            ):
+                continue
+            runs.append(start)
+            if len(runs) == limit:
+                break
+
+        return runs
+
+    def may_contain(self, text):
+        runs = self.find_runs(text, 1)
+        if runs is None:
+            lines = text.strip("\n").split("\n")
+            return lines[0].strip() in self.content and lines[-1].strip() in self.content
+        return bool(runs)
+
+    def may_repeat(self, text):
+        runs = self.find_runs(text, 2)
+        return runs is None or len(runs) > 1
+
+
+def apply_hunk(content, hunk, hint=None):
+    # hunk is a Hunk, or a list of diff lines starting at the hinted line
+    if not isinstance(hunk, Hunk):
+        hunk = Hunk(hunk, hint)
+    hint = hunk.hint
 
-    res = directly_apply_hunk(content, hunk)
+    index = ContentIndex(content)
+    res = directly_apply_hunk(content, hunk, index)
     if res:
         return res
 
     hunk = make_new_lines_explicit(content, hunk)
 
     # just consider space vs not-space
-    ops = "".join([line[0] for line in hunk])
+    ops = "".join([line[0] for line in hunk.lines])
     ops = ops.replace("-", "x")
     ops = ops.replace("+", "x")
     ops = ops.replace("\n", " ")
@@ -174,21 +333,31 @@ def apply_hunk(content, hunk):
             sections.append(section)
             section = []
             cur_op = op
-        section.append(hunk[i])
+        section.append(hunk.lines[i])
 
     sections.append(section)
     if cur_op != " ":
         sections.append([])
 
+    sections = [Hunk(section) for section in sections]
+
+    # where each section starts, once the sections before it are applied
+    offset = 0
+
     all_done = True
     for i in range(2, len(sections), 2):
         preceding_context = sections[i - 2]
         changes = sections[i - 1]
         following_context = sections[i]
 
-        res = apply_partial_hunk(content, preceding_context, changes, following_context)
+        section_hint = None if hint is None else hint + offset
+        res = apply_partial_hunk(
+            content, preceding_context, changes, following_context, index, section_hint
+        )
         if res:
             content = res
+            index = ContentIndex(content)
+            offset += len(preceding_context.after_lines) + len(changes.after_lines)
         else:
             all_done = False
             # FAILED!
@@ -208,8 +377,10 @@ def flexi_just_search_and_replace(texts):
 
 
 def make_new_lines_explicit(content, hunk):
-    before, after = hunk_to_before_after(hunk)
+    before, after = hunk.before, hunk.after
 
+    # Always against the whole content: how diff_lines lines up the hunk
+    # depends on all of it, and no window of it gives the same diff
     diff = diff_lines(before, content)
 
     back_diff = []
@@ -221,7 +392,7 @@ def make_new_lines_explicit(content, hunk):
 
         back_diff.append(line)
 
-    new_before = directly_apply_hunk(before, back_diff)
+    new_before = directly_apply_hunk(before, Hunk(back_diff))
     if not new_before:
         return hunk
 
@@ -238,7 +409,7 @@ def make_new_lines_explicit(content, hunk):
     new_hunk = difflib.unified_diff(new_before, after, n=max(len(new_before), len(after)))
     new_hunk = list(new_hunk)[3:]
 
-    return new_hunk
+    return Hunk(new_hunk, hunk.hint)
 
 
 def cleanup_pure_whitespace_lines(lines):
@@ -249,41 +420,157 @@ def cleanup_pure_whitespace_lines(lines):
 
 
 def normalize_hunk(hunk):
-    before, after = hunk_to_before_after(hunk, lines=True)
-
-    before = cleanup_pure_whitespace_lines(before)
-    after = cleanup_pure_whitespace_lines(after)
+    before = cleanup_pure_whitespace_lines(hunk.before_lines)
+    after = cleanup_pure_whitespace_lines(hunk.after_lines)
 
     diff = difflib.unified_diff(before, after, n=max(len(before), len(after)))
     diff = list(diff)[3:]
-    return diff
+    return Hunk(diff, hunk.hint)
 
 
-def directly_apply_hunk(content, hunk):
-    before, after = hunk_to_before_after(hunk)
+def directly_apply_hunk(content, hunk, index=None):
+    before, after = hunk.before, hunk.after
 
     if not before:
         return
 
-    before_lines, _ = hunk_to_before_after(hunk, lines=True)
-    before_lines = "".join([line.strip() for line in before_lines])
+    if index and ((before, after) in index.failed or not index.may_contain(before)):
+        return
+
+    before_chars = sum(len(line.strip()) for line in hunk.before_lines)
 
     # Refuse to do a repeated search and replace on a tiny bit of non-whitespace context
-    if len(before_lines) < 10 and content.count(before) > 1:
-        return
+    if before_chars < 10 and (not index or index.may_repeat(before)):
+        if content.count(before) > 1:
+            return
 
     try:
-        new_content = flexi_just_search_and_replace([before, after, content])
+        if index and hunk.hint is not None:
+            new_content = search_and_replace_near(before, after, index, hunk.hint)
+        else:
+            new_content = flexi_just_search_and_replace([before, after, content])
     except SearchTextNotUnique:
         new_content = None
 
+    if not new_content and index:
+        index.failed.add((before, after))
+
     return new_content
 
 
-def apply_partial_hunk(content, preceding_context, changes, following_context):
+def search_and_replace_near(before, after, index, hint):
+    # Apply the search strategies to a small window of the content, instead
+    # of the whole file, when the search text can only be in one place.
+    # A text that matches line by line in more than one place is applied to
+    # the whole file, as it was before hints were used, so every copy still
+    # changes: the hint never picks one copy over another. When no lines
+    # match, only the fuzzy strategies can place the text, and the window
+    # grows around the line the hunk's @@ header points to. The whole file
+    # comes last.
+    lines = index.raw_lines
+    num_lines = before.count("\n") + 1
+    # a hint past the end would make a window of just the text's last
+    # lines, which a deletion leaves empty, and the search strategies
+    # take an empty result for a failure
+    hint = max(0, min(hint, len(lines) - num_lines))
+
+    runs = index.find_copies(before, 2)
+    if len(runs) > 1:
+        windows = []
+    elif runs:
+        # runs start at the first line that isn't blank
+        blank = len(before) - len(before.lstrip("\n"))
+        windows = [(runs[0] - blank - 1, runs[0] + num_lines + 1)]
+    else:
+        windows = []
+        radius = num_lines
+        while radius < len(lines):
+            windows.append((hint - radius, hint + num_lines + radius))
+            radius *= 4
+
+    for first, last in windows:
+        first = max(0, first)
+        last = min(len(lines), last)
+        # start and end on lines that aren't empty, or strip_blank_lines
+        # would treat the window's edges as the edges of the file
+        while first > 0 and not lines[first]:
+            first -= 1
+        while last < len(lines) and not lines[last - 1]:
+            last += 1
+
+        prefix = "\n".join(lines[:first]) + "\n" if first else ""
+        window = "\n".join(lines[first:last])
+        suffix = ""
+        if last < len(lines):
+            window += "\n"
+            suffix = "\n".join(lines[last:])
+
+        res = flexi_just_search_and_replace([before, after, window])
+        if res is not None:
+            return prefix + res + suffix
+
+    return flexi_just_search_and_replace([before, after, index.content])
+
+
+def context_windows(preceding_context, changes, following_context, hint=None):
+    # The hunks made of the changes and some of the context around them.
+    # Each is joined from slices of the context parsed once up front, and
+    # only built the first time it is asked for.
+    len_prec = len(preceding_context)
+    precs = [preceding_context[len_prec - use_prec :] for use_prec in range(len_prec + 1)]
+    folls = [following_context[:use_foll] for use_foll in range(len(following_context) + 1)]
+    windows = dict()
+
+    def window(use_prec, use_foll):
+        key = (use_prec, use_foll)
+        if key not in windows:
+            window_hint = None if hint is None else hint + len_prec - use_prec
+            windows[key] = Hunk.join([precs[use_prec], changes, folls[use_foll]], window_hint)
+        return windows[key]
+
+    return window
+
+
+def max_following_context(index, window, len_prec, len_foll):
+    # For each amount of preceding context, the most following context that
+    # could still be found in the content. Adding context only adds lines
+    # that have to be there, so once a window can't match neither can any
+    # window holding it: each limit is found by bisection, and can only
+    # shrink as the preceding context grows.
+    def may_match(use_prec, use_foll):
+        before = window(use_prec, use_foll).before
+        return not before or index.may_contain(before)
+
+    limits = []
+    hi = len_foll
+    for use_prec in range(len_prec + 1):
+        if hi < 0 or not may_match(use_prec, 0):
+            hi = -1
+        else:
+            lo = 0
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if may_match(use_prec, mid):
+                    lo = mid
+                else:
+                    hi = mid - 1
+        limits.append(hi)
+
+    return limits
+
+
+def apply_partial_hunk(
+    content, preceding_context, changes, following_context, index=None, hint=None
+):
     len_prec = len(preceding_context)
     len_foll = len(following_context)
 
+    window = context_windows(preceding_context, changes, following_context, hint)
+    if index:
+        max_foll = max_following_context(index, window, len_prec, len_foll)
+    else:
+        max_foll = [len_foll] * (len_prec + 1)
+
     use_all = len_prec + len_foll
 
     # if there is a - in the hunk, we can go all the way to `use=0`
@@ -295,17 +582,10 @@ def apply_partial_hunk(content, preceding_context, changes, following_context):
                 continue
 
             use_foll = use - use_prec
-            if use_foll > len_foll:
+            if use_foll > max_foll[use_prec]:
                 continue
 
-            if use_prec:
-                this_prec = preceding_context[-use_prec:]
-            else:
-                this_prec = []
-
-            this_foll = following_context[:use_foll]
-
-            res = directly_apply_hunk(content, this_prec + changes + this_foll)
+            res = directly_apply_hunk(content, window(use_prec, use_foll), index)
             if res:
                 return res
 
@@ -314,20 +594,9 @@ def find_diffs(content):
     # We can always fence with triple-quotes, because all the udiff content
     # is prefixed with +/-/space.
 
-    if not content.endswith("\n"):
-        content = content + "\n"
-
-    lines = content.splitlines(keepends=True)
-    line_num = 0
-    edits = []
-    while line_num < len(lines):
-        while line_num < len(lines):
-            line = lines[line_num]
-            if line.startswith("```diff"):
-                line_num, these_edits = process_fenced_block(lines, line_num + 1)
-                edits += these_edits
-                break
-            line_num += 1
+    parser = DiffParser()
+    edits = parser.feed(content)
+    edits += parser.close()
 
     # For now, just take 1!
     # edits = edits[:1]
@@ -335,31 +604,133 @@ def find_diffs(content):
     return edits
 
 
-def process_fenced_block(lines, start_line_num):
-    for line_num in range(start_line_num, len(lines)):
-        line = lines[line_num]
+class DiffParser:
+    """Find the hunks in the ```diff fenced blocks of a response, one
+    piece of the response at a time.
+
+    feed() returns the (path, hunk) edits completed by each new piece, so
+    hunks can be handled while the response is still streaming in, and
+    no part of the response is scanned twice. close() returns the edits
+    completed by the end of the response. Together they find the same
+    edits as parsing the whole response at once. snapshot() gives a copy
+    to close() while more of the response is still to come.
+
+    A line is only processed once the next one has arrived: a fenced
+    block that is never closed ends before the response's last line.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.ends_with_newline = False
+        self.pending = None
+
+        self.in_block = False
+        self.header = None
+        self.fname = None
+        self.keeper = False
+        self.hunk = []
+        self.hint = None
+
+    def feed(self, text):
+        if not text:
+            return []
+
+        self.ends_with_newline = text.endswith("\n")
+        self.buffer += text
+
+        lines = self.buffer.splitlines(keepends=True)
+        last = lines[-1]
+        # a "\r" may still turn out to be the start of "\r\n"
+        if last.endswith("\r") or last.splitlines()[0] == last:
+            self.buffer = lines.pop()
+        else:
+            self.buffer = ""
+
+        edits = []
+        for line in lines:
+            if self.pending is not None:
+                self.process_line(self.pending, edits)
+            self.pending = line
+
+        return edits
+
+    def close(self):
+        text = self.buffer
+        self.buffer = ""
+        if not self.ends_with_newline:
+            text += "\n"
+        edits = self.feed(text)
+
+        if not self.in_block and self.pending is not None:
+            self.process_line(self.pending, edits)
+        self.pending = None
+
+        if self.in_block:
+            self.end_block(edits)
+
+        return edits
+
+    def snapshot(self):
+        # A copy that can be closed without disturbing this parser. The
+        # pending hunk and header are the only state changed in place, so
+        # they are all that is copied, not the whole parser.
+        parser = copy.copy(self)
+        parser.hunk = list(self.hunk)
+        if self.header is not None:
+            parser.header = list(self.header)
+        return parser
+
+    def process_line(self, line, edits):
+        if not self.in_block:
+            if line.startswith("```diff"):
+                self.in_block = True
+                self.header = []
+            return
+
         if line.startswith("```"):
-            break
+            self.end_block(edits)
+            return
 
-    block = lines[start_line_num:line_num]
-    block.append("@@ @@")
+        if self.header is None:
+            self.process_block_line(line, edits)
+            return
 
-    if block[0].startswith("--- ") and block[1].startswith("+++ "):
-        # Extract the file path, considering that it might contain spaces
-        fname = block[1][4:].strip()
-        block = block[2:]
-    else:
-        fname = None
+        self.header.append(line)
+        if len(self.header) == 2:
+            self.process_header(edits)
 
-    edits = []
+    def process_header(self, edits):
+        block = self.header
+        self.header = None
 
-    keeper = False
-    hunk = []
-    op = " "
-    for line in block:
+        if block[0].startswith("--- ") and block[1].startswith("+++ "):
+            # Extract the file path, considering that it might contain spaces
+            self.fname = block[1][4:].strip()
+            block = block[2:]
+        else:
+            self.fname = None
+
+        for line in block:
+            self.process_block_line(line, edits)
+
+    def end_block(self, edits):
+        if self.header is None:
+            self.process_block_line("@@ @@", edits)
+        else:
+            self.header.append("@@ @@")
+            self.process_header(edits)
+
+        self.in_block = False
+        self.fname = None
+        self.keeper = False
+        self.hunk = []
+        self.hint = None
+
+    def process_block_line(self, line, edits):
+        hunk = self.hunk
         hunk.append(line)
         if len(line) < 2:
-            continue
+            return
 
         if line.startswith("+++ ") and hunk[-2].startswith("--- "):
             if hunk[-3] == "\n":
@@ -367,29 +738,38 @@ def process_fenced_block(lines, start_line_num):
             else:
                 hunk = hunk[:-2]
 
-            edits.append((fname, hunk))
-            hunk = []
-            keeper = False
+            edits.append((self.fname, hunk, self.hint))
+            self.hunk = []
+            self.keeper = False
+            self.hint = None
 
-            fname = line[4:].strip()
-            continue
+            self.fname = line[4:].strip()
+            return
 
         op = line[0]
         if op in "-+":
-            keeper = True
-            continue
+            self.keeper = True
+            return
         if op != "@":
-            continue
-        if not keeper:
-            hunk = []
-            continue
+            return
+        if not self.keeper:
+            self.hunk = []
+            self.hint = parse_hunk_header(line)
+            return
 
         hunk = hunk[:-1]
-        edits.append((fname, hunk))
-        hunk = []
-        keeper = False
+        edits.append((self.fname, hunk, self.hint))
+        self.hunk = []
+        self.keeper = False
+        self.hint = parse_hunk_header(line)
+
 
-    return line_num + 1, edits
+def parse_hunk_header(line):
+    # The 0-based line a hunk starts at in the file being edited, from the
+    # "-a,b" part of its "@@ -a,b +c,d @@" header, if the header has one
+    match = re.match(r"@@ -(\d+)", line)
+    if match:
+        return max(0, int(match.group(1)) - 1)
 
 
 def hunk_to_before_after(hunk, lines=False):
@@ -419,3 +799,62 @@ def hunk_to_before_after(hunk, lines=False):
     after = "".join(after)
 
     return before, after
+
+
+class Hunk:
+    """The diff lines of a hunk, parsed once into the lines and text it
+    expects to find and the ones it leaves in their place.
+
+    Every step of applying a hunk, and every window of context tried on
+    the way, works from these views instead of parsing the lines again.
+    Hunks with the same lines are equal whatever their hint, and cache
+    their hash, so repeated hunks are cheap to find.
+    """
+
+    __slots__ = ("lines", "hint", "before_lines", "after_lines", "before", "after", "_hash")
+
+    def __init__(self, lines, hint=None):
+        self.lines = tuple(lines)
+        self.hint = hint
+
+        before_lines, after_lines = hunk_to_before_after(self.lines, lines=True)
+        self.before_lines = tuple(before_lines)
+        self.after_lines = tuple(after_lines)
+        self.before = "".join(before_lines)
+        self.after = "".join(after_lines)
+        self._hash = None
+
+    @classmethod
+    def join(cls, hunks, hint=None):
+        # each line is parsed on its own, so the views of the joined hunk
+        # are just the views of its parts put end to end
+        joined = cls.__new__(cls)
+        joined.lines = tuple(line for hunk in hunks for line in hunk.lines)
+        joined.hint = hint
+        joined.before_lines = tuple(line for hunk in hunks for line in hunk.before_lines)
+        joined.after_lines = tuple(line for hunk in hunks for line in hunk.after_lines)
+        joined.before = "".join(hunk.before for hunk in hunks)
+        joined.after = "".join(hunk.after for hunk in hunks)
+        joined._hash = None
+        return joined
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return Hunk(self.lines[key])
+        return self.lines[key]
+
+    def __eq__(self, other):
+        if not isinstance(other, Hunk):
+            return NotImplemented
+        return self.lines == other.lines
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(self.lines)
+        return self._hash
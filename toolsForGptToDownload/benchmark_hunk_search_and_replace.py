@@ -0,0 +1,419 @@
+"""
+Benchmark hunk matching and replacement over the diffing case-study corpus.
+
+The corpus under textBasedStuff/diffing/case-studies/example1/ holds, for several files, the
+base version, the changed version and unified diffs of the change produced by `diff` with
+different context sizes (u0-u10) and by GPT. Every patch is split into search/replace hunks
+and replayed through compare_hunks_to_files, replace_hunks_in_files and, when aider is
+installed, the udiff coder's apply_hunk (the repository's own udiff_coder.py, loaded from its file). The same hunks are then replayed against synthetic
+versions of each base file scaled to a given number of lines, with the base file embedded
+once in the middle of altered copies of itself so every hunk still has a single exact match.
+
+For every workload the report gives throughput, p50/p99 latency and peak traced memory as
+JSON, so runs can be compared before and after a change.
+
+Usage examples:
+1. Benchmark the corpus and the default synthetic sizes:
+   python benchmark_hunk_search_and_replace.py
+
+2. Include the 1M-line files and write the report to a file:
+   python benchmark_hunk_search_and_replace.py --sizes 1000,10000,100000,1000000 --output baseline.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import importlib.util
+from types import ModuleType
+from typing import Callable, Dict, List, Optional, Tuple
+
+from typing_extensions import TypedDict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from hunk_search_and_replace import compare_hunks_to_files, replace_hunks_in_files  # noqa: E402
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CORPUS = os.path.join(REPO_ROOT, 'textBasedStuff', 'diffing', 'case-studies', 'example1')
+UDIFF_CODER_FILE = os.path.join(REPO_ROOT, 'textBasedStuff', 'diffing', 'aider', 'udiff', 'udiff_coder.py')
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# The stand-in package the udiff coder is loaded into, in place of aider.coders
+UDIFF_PACKAGE = "vendored_aider"
+
+
+def load_udiff_coder(file_path: str = UDIFF_CODER_FILE) -> Optional[ModuleType]:
+    """
+    Load the repository's udiff coder from its file, rather than the one installed with aider.
+
+    The module imports its neighbours in aider's package relatively, so it is loaded into a
+    stand-in package: search_replace, which does the actual matching, is the installed aider's,
+    while dump, base_coder and udiff_prompts, only needed to declare the coder class, are stubs.
+    UnifiedDiffCoder can then be used without a model or a repository, given an `io` with
+    read_text and write_text and an `abs_root_path` method.
+
+    Args:
+    file_path: The path of udiff_coder.py.
+
+    Returns:
+    The loaded module, or None if aider is not installed.
+    """
+    try:
+        from aider.coders import search_replace
+    except ImportError:
+        return None
+
+    modules = {name: ModuleType(name) for name in (
+        UDIFF_PACKAGE, f"{UDIFF_PACKAGE}.dump", f"{UDIFF_PACKAGE}.coders", f"{UDIFF_PACKAGE}.coders.base_coder",
+        f"{UDIFF_PACKAGE}.coders.udiff_prompts")}
+    modules[UDIFF_PACKAGE].__path__ = []
+    modules[f"{UDIFF_PACKAGE}.coders"].__path__ = []
+    modules[f"{UDIFF_PACKAGE}.dump"].dump = lambda *args: None
+    modules[f"{UDIFF_PACKAGE}.coders.base_coder"].Coder = type("Coder", (), {})
+    modules[f"{UDIFF_PACKAGE}.coders.udiff_prompts"].UnifiedDiffPrompts = type("UnifiedDiffPrompts", (), {})
+    modules[f"{UDIFF_PACKAGE}.coders.search_replace"] = search_replace
+    sys.modules.update(modules)
+
+    spec = importlib.util.spec_from_file_location(f"{UDIFF_PACKAGE}.coders.udiff_coder", file_path)
+    udiff_coder = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = udiff_coder
+    spec.loader.exec_module(udiff_coder)
+    return udiff_coder
+
+
+udiff_coder_module = load_udiff_coder()
+apply_hunk = udiff_coder_module.apply_hunk if udiff_coder_module is not None else None
+
+
+class PatchHunk(TypedDict):
+    search: str
+    replace: str
+    lines: List[str]
+
+
+class CorpusCase(TypedDict):
+    name: str
+    patch: str
+    base: str
+    changed: str
+    hunks: List[PatchHunk]
+
+
+class WorkloadReport(TypedDict):
+    workload: str
+    case: str
+    patch: str
+    fileLines: int
+    hunks: int
+    iterations: int
+    p50Ms: float
+    p99Ms: float
+    meanMs: float
+    linesPerSecond: float
+    hunksPerSecond: float
+    peakMemoryBytes: int
+    exact: Optional[bool]
+
+
+def parse_patch(patch_content: str) -> List[PatchHunk]:
+    """
+    Split a unified diff into search/replace hunks.
+
+    File headers and "\\ No newline" markers are skipped; hunks are separated by their "@@"
+    lines, whether or not those carry line numbers.
+
+    Args:
+    patch_content: The content of the patch.
+
+    Returns:
+    The hunks of the patch, each with its search text (context and removed lines), its
+    replacement text (context and added lines) and its raw diff lines for apply_hunk.
+    """
+    hunks: List[PatchHunk] = []
+    current: Optional[List[str]] = None
+    for line in patch_content.splitlines(keepends=True):
+        if line.startswith('--- ') or line.startswith('+++ ') or line.startswith('\\'):
+            continue
+        if line.startswith('@@'):
+            current = []
+            hunks.append({"search": "", "replace": "", "lines": current})
+            continue
+        if current is not None:
+            current.append(line if line[:1] in ' -+' else ' ' + line)
+
+    for hunk in hunks:
+        search = [line[1:] for line in hunk["lines"] if line[0] in ' -']
+        replace = [line[1:] for line in hunk["lines"] if line[0] in ' +']
+        hunk["search"] = ''.join(search).rstrip('\n')
+        hunk["replace"] = ''.join(replace).rstrip('\n')
+
+    return [hunk for hunk in hunks if hunk["search"].strip()]
+
+
+def load_corpus(corpus_dir: str) -> List[CorpusCase]:
+    """
+    Load every base/changed file pair and its patches from the case-study corpus.
+
+    Args:
+    corpus_dir: The corpus directory, holding one sub-directory per case.
+
+    Returns:
+    One CorpusCase per patch that has at least one hunk with search text.
+    """
+    cases: List[CorpusCase] = []
+    for name in sorted(os.listdir(corpus_dir)):
+        case_dir = os.path.join(corpus_dir, name)
+        if not os.path.isdir(case_dir):
+            continue
+        files = sorted(os.listdir(case_dir))
+        base = next((f for f in files if f.startswith('base.')), None)
+        changed = next((f for f in files if f.startswith('changed.')), None)
+        if base is None or changed is None:
+            continue
+
+        with open(os.path.join(case_dir, base), 'r') as f:
+            base_content = f.read()
+        with open(os.path.join(case_dir, changed), 'r') as f:
+            changed_content = f.read()
+
+        for patch in (f for f in files if f.endswith('.patch')):
+            with open(os.path.join(case_dir, patch), 'r') as f:
+                hunks = parse_patch(f.read())
+            if hunks:
+                cases.append({
+                    "name": name,
+                    "patch": patch,
+                    "base": base_content,
+                    "changed": changed_content,
+                    "hunks": hunks
+                })
+    return cases
+
+
+def scale_content(content: str, target_lines: int) -> str:
+    """
+    Grow a file to about `target_lines` lines while keeping its original text unique.
+
+    Altered copies of the file (every non-empty line tagged with its copy number) are placed
+    before and after one untouched copy, so hunks taken from the original still match exactly
+    once while the file keeps the same mix of lines, braces and blank lines.
+
+    Args:
+    content: The original file content.
+    target_lines: The approximate number of lines wanted.
+
+    Returns:
+    The scaled content.
+    """
+    lines = content.split('\n')
+    copies = max(0, target_lines // max(1, len(lines)) - 1)
+    filler = []
+    for copy in range(copies):
+        filler.extend(f"{line} {copy}" if line.strip() else line for line in lines)
+    middle = (len(filler) // 2) // max(1, len(lines)) * len(lines)
+    return '\n'.join(filler[:middle] + lines + filler[middle:])
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """
+    Return the nearest-rank percentile of a list of samples.
+
+    Args:
+    samples: The samples, in any order.
+    fraction: The percentile as a fraction, e.g. 0.99.
+
+    Returns:
+    The sample at that rank.
+    """
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def measure(run: Callable[[], Optional[bool]], iterations: int) -> Tuple[List[float], int, Optional[bool]]:
+    """
+    Time a workload and measure its peak memory.
+
+    The workload runs `iterations` times untraced for timing, then once more under
+    tracemalloc, which slows it down too much to be timed, to get its peak allocation.
+
+    Args:
+    run: The workload; it may return whether its output was the expected one.
+    iterations: The number of timed runs.
+
+    Returns:
+    The latencies in seconds, the peak traced memory in bytes and the workload's last result.
+    """
+    latencies = []
+    exact = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        exact = run()
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return latencies, peak, exact
+
+
+def report(workload: str, case: CorpusCase, content: str, iterations: int,
+           run: Callable[[], Optional[bool]]) -> WorkloadReport:
+    """
+    Measure one workload on one case and summarize it.
+
+    Args:
+    workload: The name of the workload.
+    case: The corpus case being replayed.
+    content: The file content the workload runs against.
+    iterations: The number of timed runs.
+    run: The workload.
+
+    Returns:
+    The WorkloadReport.
+    """
+    latencies, peak, exact = measure(run, iterations)
+    total = sum(latencies) or 1e-9
+    file_lines = content.count('\n') + 1
+    return {
+        "workload": workload,
+        "case": case["name"],
+        "patch": case["patch"],
+        "fileLines": file_lines,
+        "hunks": len(case["hunks"]),
+        "iterations": iterations,
+        "p50Ms": percentile(latencies, 0.5) * 1000,
+        "p99Ms": percentile(latencies, 0.99) * 1000,
+        "meanMs": total / len(latencies) * 1000,
+        "linesPerSecond": file_lines * len(latencies) / total,
+        "hunksPerSecond": len(case["hunks"]) * len(latencies) / total,
+        "peakMemoryBytes": peak,
+        "exact": exact
+    }
+
+
+def benchmark_case(case: CorpusCase, content: str, expected: Optional[str], iterations: int,
+                   work_dir: str) -> List[WorkloadReport]:
+    """
+    Replay one case through every workload against the given content.
+
+    Args:
+    case: The corpus case to replay.
+    content: The file content to search and edit (the base file, possibly scaled).
+    expected: The content the edit should produce, or None if unknown.
+    iterations: The number of timed runs per workload.
+    work_dir: A scratch directory for the files replace_hunks_in_files writes.
+
+    Returns:
+    One WorkloadReport per workload that could run.
+    """
+    file_path = os.path.join(work_dir, case["name"], os.path.basename(case["name"]))
+    searches = {file_path: [[hunk["search"]] for hunk in case["hunks"]]}
+    replacements = {file_path: [[hunk["replace"]] for hunk in case["hunks"]]}
+
+    def compare() -> bool:
+        result = compare_hunks_to_files(searches, {file_path: content})
+        return all(not hunk["errors"] for hunk in result[file_path]["hunks"])
+
+    def replace() -> Optional[bool]:
+        shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+        os.makedirs(os.path.dirname(file_path))
+        with open(file_path, 'w') as f:
+            f.write(content)
+        _, updated_files, _, _, _, _ = replace_hunks_in_files(searches, replacements, {file_path: content})
+        return None if expected is None else updated_files[file_path] == expected
+
+    def udiff() -> Optional[bool]:
+        updated = content
+        for hunk in case["hunks"]:
+            updated = apply_hunk(updated, hunk["lines"])
+            if not updated:
+                return False
+        return None if expected is None else updated == expected
+
+    reports = [
+        report("compare_hunks_to_files", case, content, iterations, compare),
+        report("replace_hunks_in_files", case, content, iterations, replace)
+    ]
+    if apply_hunk is not None:
+        reports.append(report("udiff_apply_hunk", case, content, iterations, udiff))
+    return reports
+
+
+def run_benchmarks(corpus_dir: str, sizes: List[int], iterations: int) -> Dict:
+    """
+    Run every workload over the corpus and its scaled versions.
+
+    Args:
+    corpus_dir: The case-study corpus directory.
+    sizes: The line counts of the synthetic files.
+    iterations: The number of timed runs per workload on the unscaled corpus; scaled files
+        get fewer runs as they grow, but at least one.
+
+    Returns:
+    The report: environment details and one entry per workload, case and size.
+    """
+    cases = load_corpus(corpus_dir)
+    results: List[Dict] = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for case in cases:
+            for entry in benchmark_case(case, case["base"], case["changed"], iterations, work_dir):
+                results.append({"size": "corpus", **entry})
+
+            for size in sizes:
+                scaled = scale_content(case["base"], size)
+                scaled_iterations = max(1, iterations * 1000 // max(size, 1000))
+                for entry in benchmark_case(case, scaled, None, scaled_iterations, work_dir):
+                    results.append({"size": size, **entry})
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": corpus_dir,
+        "cases": len(cases),
+        "udiffAvailable": apply_hunk is not None,
+        "results": results
+    }
+
+
+def parse_arguments(args: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark hunk matching and replacement over the diffing case-study corpus.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="Case-study corpus directory")
+    parser.add_argument("--sizes", default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help="Comma-separated line counts of the synthetic files (empty for none)")
+    parser.add_argument("--iterations", type=int, default=20, help="Timed runs per workload on the corpus")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+
+    parsed_args = parser.parse_args(args)
+    parsed_args.sizes = [int(size) for size in parsed_args.sizes.split(',') if size.strip()]
+    if parsed_args.iterations < 1:
+        parser.error("--iterations must be at least 1")
+    return parsed_args
+
+
+def main():
+    args = parse_arguments()
+
+    # Unmatched hunks in scaled files log warnings; keep them off stderr and out of the measurements
+    logging.disable(logging.WARNING)
+
+    benchmark = run_benchmarks(args.corpus, args.sizes, args.iterations)
+    output = json.dumps(benchmark, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -33,26 +33,80 @@ Usage examples:
        def __init__(self):
            self.value = 1"
 
+5. Apply a batch of hunks from a JSON or NDJSON manifest (or '-' for stdin), one entry per hunk:
+   python hunk_search_and_replace.py --manifest hunks.ndjson
+   {"file": "file.py", "search": "def old():", "replace": "def new():"}
+
+6. Keep the tool running and send it JSON requests, one per line, on stdin (or a Unix socket):
+   python hunk_search_and_replace.py --serve [--socket /tmp/hunks.sock]
+   {"id": 1, "searches": {"file.py": [["def old():"]]}, "replacements": {"file.py": [["def new():"]]}}
+
+7. List the backup sessions of the current project, undo one of them, or keep only the latest 20:
+   python hunk_search_and_replace.py --list-sessions
+   python hunk_search_and_replace.py --restore 20240101T120000123456-1234-0a1b2c3d
+   python hunk_search_and_replace.py --prune-sessions 20
+
+8. Stream one compact JSON line per hunk as soon as it is resolved, without matched line content:
+   python hunk_search_and_replace.py --output ndjson --summary -f file.txt -s "search hunk"
+
+9. Log debug messages and one JSON timing event per phase to stderr:
+   HUNK_TIMINGS=1 python hunk_search_and_replace.py --log-level DEBUG -f file.txt -s "search hunk"
+
 Note: When using multi-line hunks, be careful with indentation and newline characters.
 In some shells, you may need to escape newlines with backslashes for multi-line input.
 """
+import io
 import os
+import mmap
+import sys
 import json
+import time
 import shutil
 import base64
-import subprocess
+import datetime
+import difflib
 import logging
-from typing import Dict, List, Union, Tuple
+from bisect import bisect_left
+from typing import IO, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Union, Tuple
 import argparse
-import tempfile
+import socketserver
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from itertools import groupby, islice
+from concurrent.futures import ThreadPoolExecutor
 
 from typing_extensions import TypedDict
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+from hunk_transactions import DURABILITY_LEVELS, TEXT_ENCODING, TEXT_ERRORS, BackupStore, FileTransaction, \
+    decode_text, encode_text, new_session_id, recover_transactions, restore_session
+
+# Logging is configured by main(); as a library the tool only logs through these loggers
+logger = logging.getLogger("hunk_search_and_replace")
+timing_logger = logging.getLogger("hunk_search_and_replace.timing")
+
+LOG_LEVEL_ENV = "HUNK_LOG_LEVEL"
+TIMINGS_ENV = "HUNK_TIMINGS"
+DEFAULT_LOG_LEVEL = "WARNING"
 
 # Type definitions
 FileSystem = Dict[str, str]
+LineIndex = Dict[str, List[int]]
+
+# Polynomial rolling hash parameters used to compare runs of stripped lines
+HASH_BASE = 1_000_003
+HASH_MOD = (1 << 61) - 1
+
+SEARCH_MODES = ("block", "multi")
+OUTPUT_FORMATS = ("json", "ndjson")
+
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+DEFAULT_STREAM_THRESHOLD = 64 * 1024 * 1024
+
+UTF8_BOM = "\ufeff"
+
+# Snapshots and transaction journals are kept here, under the project root
+BACKUP_DIR_NAME = ".hunk_backups"
 
 
 class HunkMatch(TypedDict):
@@ -61,12 +115,19 @@ class HunkMatch(TypedDict):
     content: str
 
 
+class HunkCandidate(TypedDict):
+    startLineNum: int
+    endLineNum: int
+    score: float
+
+
 class HunkResult(TypedDict):
     matches: List[HunkMatch]
     mismatches: List[Dict[str, Union[int, str]]]
     hunkLines: int
     matchPercentage: float
     errors: List[str]
+    candidates: List[HunkCandidate]
 
 
 class FileResult(TypedDict):
@@ -82,8 +143,801 @@ class ErrorResult(TypedDict):
 
 SearchResult = Dict[str, Union[FileResult, ErrorResult]]
 
+# Called with the file name, the hunk's index in the file, its result and the file's error, if any
+HunkCallback = Callable[[str, int, Dict, Optional[str]], None]
+
+
+class HunkSummary(TypedDict):
+    hunkLines: int
+    matchPercentage: float
+    startLineNum: Optional[int]
+    endLineNum: Optional[int]
+    mismatchedLines: List[int]
+    errors: List[str]
+    candidates: List[HunkCandidate]
+
+
+class FileChange(NamedTuple):
+    rel_path: str
+    original: str
+    updated: str
+    original_mtime_ns: int
+    updated_mtime_ns: int
+
+
+class FileIndex(NamedTuple):
+    lines: List[str]
+    non_empty_lines: List[Tuple[str, int]]
+    line_numbers: List[int]
+    line_index: LineIndex
+    prefix_hashes: List[int]
+
+
+class ManifestEntry(NamedTuple):
+    file: str
+    search: str
+    replace: Optional[str]
+
+
+class LazyJson:
+    """
+    Defer JSON serialization of a log argument until a handler actually formats the record.
+
+    Passed as a %s argument, the value is only dumped if the log level lets the record through.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self) -> str:
+        return json.dumps(self.value, indent=2)
+
+
+@contextmanager
+def timed_phase(phase: str, **fields) -> Iterator[None]:
+    """
+    Emit a structured timing event for a phase of work on the timing logger.
+
+    The event is one compact JSON object, e.g. {"event": "phase", "phase": "search", "ms": 1.2,
+    "file": "main.rs"}. Nothing is measured unless the timing logger is enabled for INFO.
+
+    Args:
+    phase: The name of the phase: "load", "search", "apply", "patch" or "request".
+    fields: Extra fields to include in the event.
+    """
+    if not timing_logger.isEnabledFor(logging.INFO):
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        event = {"event": "phase", "phase": phase, "ms": round((time.perf_counter() - start) * 1000, 3)}
+        event.update(fields)
+        timing_logger.info("%s", json.dumps(event))
+
+
+def parse_log_level(level: Union[str, int]) -> int:
+    """
+    Convert a log level name (case-insensitive) or number to a logging level.
+
+    Args:
+    level: The level, e.g. "debug", "WARNING" or "10".
+
+    Returns:
+    The numeric logging level.
+
+    Raises:
+    ValueError: If the level is not a known level name or a number.
+    """
+    if isinstance(level, int) or str(level).strip().isdigit():
+        return int(level)
+    value = logging.getLevelName(str(level).strip().upper())
+    if not isinstance(value, int):
+        raise ValueError(f"Unknown log level: {level}")
+    return value
+
+
+def configure_logging(level: Union[str, int] = DEFAULT_LOG_LEVEL, timings: bool = False) -> None:
+    """
+    Send the tool's log records and, optionally, its timing events to stderr.
+
+    Log records go through the root logger at the given level. Timing events are written one
+    JSON object per line, without the usual prefix, so they can be parsed as they arrive.
+
+    Args:
+    level: The log level for the tool's messages.
+    timings: Whether to emit a timing event per phase.
+    """
+    logging.basicConfig(level=parse_log_level(level), format='%(asctime)s - %(levelname)s - %(message)s')
+
+    timing_logger.propagate = False
+    timing_logger.handlers.clear()
+    if timings:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        timing_logger.addHandler(handler)
+        timing_logger.setLevel(logging.INFO)
+    else:
+        timing_logger.setLevel(logging.CRITICAL + 1)
+
+
+def build_line_index(non_empty_lines: List[Tuple[str, int]]) -> LineIndex:
+    """
+    Build an index mapping each stripped line to the line numbers where it occurs.
+
+    The index is built once per file and shared by every hunk searched in that file, so
+    resolving a hunk line becomes a dictionary lookup instead of a scan over the whole file.
+    Line numbers are appended in file order, so each list is already sorted and its first
+    element is the first occurrence of that line.
+
+    Args:
+    non_empty_lines: (stripped line, 1-based line number) pairs for every non-empty line of a file.
+
+    Returns:
+    A LineIndex mapping stripped line content to its sorted 1-based line numbers.
+    """
+    line_index: LineIndex = {}
+    for line, line_num in non_empty_lines:
+        line_numbers = line_index.get(line)
+        if line_numbers is None:
+            line_index[line] = [line_num]
+        else:
+            line_numbers.append(line_num)
+    return line_index
+
+
+def build_prefix_hashes(lines: List[str]) -> List[int]:
+    """
+    Build prefix hashes over a sequence of lines for O(1) rolling-hash lookups of any window.
+
+    Entry i holds the hash of the first i lines, so the hash of lines[start:start + length]
+    can be derived from two entries with window_hash.
+
+    Args:
+    lines: The (stripped) lines to hash.
+
+    Returns:
+    A list of len(lines) + 1 prefix hashes.
+    """
+    prefix_hashes = [0] * (len(lines) + 1)
+    current = 0
+    for i, line in enumerate(lines):
+        current = (current * HASH_BASE + hash(line)) % HASH_MOD
+        prefix_hashes[i + 1] = current
+    return prefix_hashes
+
+
+def window_hash(prefix_hashes: List[int], start: int, length: int, power: int) -> int:
+    """
+    Return the rolling hash of the window of `length` lines beginning at `start`.
+
+    Args:
+    prefix_hashes: Prefix hashes as returned by build_prefix_hashes.
+    start: Index of the first line of the window.
+    length: Number of lines in the window.
+    power: pow(HASH_BASE, length, HASH_MOD), precomputed by the caller.
+
+    Returns:
+    The hash of the window, comparable with build_prefix_hashes(window)[-1].
+    """
+    return (prefix_hashes[start + length] - prefix_hashes[start] * power) % HASH_MOD
+
+
+def window_matches(non_empty_lines: List[Tuple[str, int]], start: int, hunk_lines: List[str]) -> bool:
+    """
+    Check that the window of non-empty lines beginning at `start` holds exactly the hunk's lines.
+
+    Equal rolling hashes only make a match likely, since different runs of lines can share a
+    hash, so every window whose hash matches a hunk is confirmed with this before it is reported.
+
+    Args:
+    non_empty_lines: The stripped non-empty lines of a file with their line numbers.
+    start: Index of the first line of the window.
+    hunk_lines: The stripped, non-empty lines of the hunk.
+
+    Returns:
+    True if every line of the window equals the hunk line at the same offset.
+    """
+    return all(non_empty_lines[start + offset][0] == line for offset, line in enumerate(hunk_lines))
+
+
+def build_file_index(content: str) -> FileIndex:
+    """
+    Split a file and build every lookup structure the matchers need, once per file.
+
+    Raw lines keep whatever the file had around them, such as the '\\r' of CRLF line endings
+    or a leading BOM; neither is part of the stripped lines hunks are compared with.
+
+    Args:
+    content: The full content of the file, as returned by read_file.
+
+    Returns:
+    A FileIndex holding the raw lines, the stripped non-empty lines with their 1-based line
+    numbers, the LineIndex and the prefix hashes over the stripped non-empty lines.
+    """
+    lines = content.split('\n')
+    stripped_lines = [line.strip() for line in lines]
+    if stripped_lines[0].startswith(UTF8_BOM):
+        stripped_lines[0] = stripped_lines[0][1:].strip()
+    non_empty_lines = [(line, index + 1) for index, line in enumerate(stripped_lines) if line]
+    return FileIndex(
+        lines=lines,
+        non_empty_lines=non_empty_lines,
+        line_numbers=[line_num for _, line_num in non_empty_lines],
+        line_index=build_line_index(non_empty_lines),
+        prefix_hashes=build_prefix_hashes([line for line, _ in non_empty_lines])
+    )
+
+
+def find_contiguous_candidates(hunk_lines: List[str], file_index: FileIndex) -> List[HunkCandidate]:
+    """
+    Find every location where a hunk could sit as a contiguous run of non-empty lines.
+
+    Candidates are seeded from the occurrences of the rarest hunk line that exists in the file,
+    so a hunk made mostly of `}` and other common lines is still anchored on its most
+    distinctive line. Each candidate window is checked against the hunk with a rolling hash;
+    windows that are not exact are scored by the share of lines that match in place.
+
+    Args:
+    hunk_lines: The stripped, non-empty lines of the hunk.
+    file_index: The FileIndex of the file to search.
+
+    Returns:
+    Candidates ordered by descending score, then by position in the file.
+    """
+    non_empty_lines, line_index = file_index.non_empty_lines, file_index.line_index
+    present = [(len(line_index[line]), offset) for offset, line in enumerate(hunk_lines) if line in line_index]
+    if not present:
+        return []
+
+    _, seed_offset = min(present)
+    hunk_length = len(hunk_lines)
+    power = pow(HASH_BASE, hunk_length, HASH_MOD)
+    hunk_hash = build_prefix_hashes(hunk_lines)[-1]
+
+    candidates: List[HunkCandidate] = []
+    for seed_line_num in line_index[hunk_lines[seed_offset]]:
+        start = bisect_left(file_index.line_numbers, seed_line_num) - seed_offset
+        if start < 0 or start + hunk_length > len(non_empty_lines):
+            continue
+
+        if window_hash(file_index.prefix_hashes, start, hunk_length, power) == hunk_hash and \
+                window_matches(non_empty_lines, start, hunk_lines):
+            score = 100.0
+        else:
+            matched = sum(1 for offset, line in enumerate(hunk_lines) if non_empty_lines[start + offset][0] == line)
+            score = (matched / hunk_length) * 100
+
+        candidates.append({
+            "startLineNum": non_empty_lines[start][1],
+            "endLineNum": non_empty_lines[start + hunk_length - 1][1],
+            "score": score
+        })
+
+    candidates.sort(key=lambda candidate: (-candidate["score"], candidate["startLineNum"]))
+    return candidates
+
+
+def find_hunks_in_one_pass(hunks_lines: List[List[str]], file_index: FileIndex) -> List[List[HunkCandidate]]:
+    """
+    Find the exact contiguous occurrences of many hunks with a single pass over a file.
+
+    All hunks are hashed up front and grouped by first line and length; the file is then walked
+    once and, at each position, the rolling hash of the window for every hunk length that can
+    start there is looked up among the hunk hashes (Rabin-Karp). The cost is one pass over the
+    file per search instead of one pass per hunk.
+
+    Args:
+    hunks_lines: The stripped, non-empty lines of every hunk searched in the file.
+    file_index: The FileIndex of the file to search.
+
+    Returns:
+    For each hunk, in order, the list of its exact occurrences as candidates with a score of 100.
+    """
+    # Hunk hashes grouped by the hunk's first line and length, so each file position only
+    # hashes the window lengths of hunks that can start with the line found there
+    targets: Dict[str, Dict[int, Dict[int, List[int]]]] = {}
+    for hunk_index, hunk_lines in enumerate(hunks_lines):
+        if hunk_lines:
+            hunk_hash = build_prefix_hashes(hunk_lines)[-1]
+            by_length = targets.setdefault(hunk_lines[0], {})
+            by_length.setdefault(len(hunk_lines), {}).setdefault(hunk_hash, []).append(hunk_index)
+
+    powers: Dict[int, int] = {}
+    non_empty_lines, prefix_hashes = file_index.non_empty_lines, file_index.prefix_hashes
+    total = len(non_empty_lines)
+
+    found: List[List[HunkCandidate]] = [[] for _ in hunks_lines]
+    for start, (line, _) in enumerate(non_empty_lines):
+        by_length = targets.get(line)
+        if by_length is None:
+            continue
+        for length, hashes in by_length.items():
+            if start + length > total:
+                continue
+            power = powers.get(length)
+            if power is None:
+                power = powers[length] = pow(HASH_BASE, length, HASH_MOD)
+            hunk_indexes = hashes.get(window_hash(prefix_hashes, start, length, power))
+            if hunk_indexes is None:
+                continue
+            for hunk_index in hunk_indexes:
+                if not window_matches(non_empty_lines, start, hunks_lines[hunk_index]):
+                    continue
+                found[hunk_index].append({
+                    "startLineNum": non_empty_lines[start][1],
+                    "endLineNum": non_empty_lines[start + length - 1][1],
+                    "score": 100.0
+                })
+
+    return found
+
+
+def bounded_edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Compute the Levenshtein distance between two strings, giving up past a maximum.
+
+    The common prefix and suffix are skipped, and the rest is computed with the bit-parallel
+    algorithm of Myers and Hyyro, one integer operation sequence per character of `b`. The
+    computation stops as soon as the distance can no longer drop to max_distance, so comparing
+    two clearly different or nearly equal lines costs little more than a length check.
+
+    Args:
+    a: The first string.
+    b: The second string.
+    max_distance: The largest distance of interest.
+
+    Returns:
+    The edit distance, or max_distance + 1 if it is larger than max_distance.
+    """
+    if a == b:
+        return 0
+    too_far = max_distance + 1
+    if max_distance <= 0 or abs(len(a) - len(b)) > max_distance:
+        return too_far
+
+    prefix = 0
+    shortest = min(len(a), len(b))
+    while prefix < shortest and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < shortest - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+    a = a[prefix:len(a) - suffix]
+    b = b[prefix:len(b) - suffix]
+
+    if len(a) > len(b):
+        a, b = b, a
+    if not a:
+        return len(b) if len(b) <= max_distance else too_far
+
+    peq: Dict[str, int] = {}
+    for i, char in enumerate(a):
+        peq[char] = peq.get(char, 0) | (1 << i)
+
+    mask = (1 << len(a)) - 1
+    top = 1 << (len(a) - 1)
+    pv, mv = mask, 0
+    distance = len(a)
+    remaining = len(b)
+    for char in b:
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & top:
+            distance += 1
+        elif mh & top:
+            distance -= 1
+        remaining -= 1
+        if distance - remaining > max_distance:
+            return too_far
+        ph = (ph << 1) | 1
+        pv = ((mh << 1) | ~(xv | ph)) & mask
+        mv = ph & xv
+
+    return distance if distance <= max_distance else too_far
+
+
+def split_into_pieces(hunk_lines: List[str], piece_count: int) -> List[Tuple[int, str]]:
+    """
+    Split the lines of a hunk into at least `piece_count` disjoint pieces of similar length.
+
+    Pieces never span lines, so each one can be looked up as a substring of a single line.
+
+    Args:
+    hunk_lines: The stripped, non-empty lines of the hunk.
+    piece_count: The minimum number of pieces to produce.
+
+    Returns:
+    (hunk line offset, piece) pairs, or an empty list if the hunk has fewer characters than pieces.
+    """
+    total_chars = sum(len(line) for line in hunk_lines)
+    if piece_count > total_chars:
+        return []
+
+    counts = [len(line) * piece_count // total_chars for line in hunk_lines]
+    by_length = sorted(range(len(hunk_lines)), key=lambda offset: -len(hunk_lines[offset]))
+    missing = piece_count - sum(counts)
+    while missing > 0:
+        for offset in by_length:
+            if missing and counts[offset] < len(hunk_lines[offset]):
+                counts[offset] += 1
+                missing -= 1
+
+    pieces = []
+    for offset, (line, count) in enumerate(zip(hunk_lines, counts)):
+        for i in range(count):
+            pieces.append((offset, line[i * len(line) // count:(i + 1) * len(line) // count]))
+    return pieces
+
+
+def find_fuzzy_candidates(hunk_lines: List[str], file_index: FileIndex, min_similarity: float) -> List[HunkCandidate]:
+    """
+    Find windows of the file that match a hunk within a similarity threshold.
+
+    The similarity of a window is 100 * (1 - edits / hunk characters), where edits is the sum of
+    the per-line edit distances between the hunk and the window, so the threshold fixes an edit
+    budget. Candidate windows are found with a pigeonhole filter so the whole file is never
+    scored pairwise:
+
+    - If the budget is smaller than the number of hunk lines, a matching window contains at
+      least `len(hunk_lines) - budget` exactly equal lines, and is seeded from the exact-line
+      index using only the rarest hunk lines needed to guarantee one such anchor.
+    - Otherwise the hunk is cut into budget + 1 pieces; no budget of edits can touch them all,
+      so a matching window contains one of them verbatim and is seeded from its occurrences.
+
+    Each seeded window is then scored line by line with a bounded edit distance that stops as
+    soon as the remaining budget is spent.
+
+    Args:
+    hunk_lines: The stripped, non-empty lines of the hunk.
+    file_index: The FileIndex of the file to search.
+    min_similarity: The minimum similarity percentage a window needs to be reported.
+
+    Returns:
+    Candidates at or above min_similarity, ordered by descending score, then by position.
+    """
+    non_empty_lines, line_index = file_index.non_empty_lines, file_index.line_index
+    hunk_length = len(hunk_lines)
+    total = len(non_empty_lines)
+    if not hunk_length or hunk_length > total:
+        return []
+
+    hunk_chars = max(1, sum(len(line) for line in hunk_lines))
+    budget = int((1 - min_similarity / 100) * hunk_chars)
+    required_exact = hunk_length - budget
+    pieces = split_into_pieces(hunk_lines, budget + 1) if required_exact <= 0 else []
+
+    starts = set()
+    if required_exact > 0:
+        by_rarity = sorted(range(hunk_length), key=lambda offset: len(line_index.get(hunk_lines[offset], ())))
+        for offset in by_rarity[:hunk_length - required_exact + 1]:
+            for line_num in line_index.get(hunk_lines[offset], ()):
+                start = bisect_left(file_index.line_numbers, line_num) - offset
+                if 0 <= start <= total - hunk_length:
+                    starts.add(start)
+    elif pieces:
+        text = '\n'.join(line for line, _ in non_empty_lines)
+        line_starts = [0] * total
+        position = 0
+        for i, (line, _) in enumerate(non_empty_lines):
+            line_starts[i] = position
+            position += len(line) + 1
+
+        for offset, piece in pieces:
+            found = text.find(piece)
+            while found != -1:
+                line_position = bisect_left(line_starts, found + 1) - 1
+                start = line_position - offset
+                if 0 <= start <= total - hunk_length:
+                    starts.add(start)
+                if line_position + 1 >= total:
+                    break
+                found = text.find(piece, line_starts[line_position + 1])
+    else:
+        starts = set(range(total - hunk_length + 1))
+
+    candidates: List[HunkCandidate] = []
+    for start in sorted(starts):
+        # Cheap lower bound first: each line costs at least its length difference
+        remaining = budget
+        for offset, hunk_line in enumerate(hunk_lines):
+            remaining -= abs(len(hunk_line) - len(non_empty_lines[start + offset][0]))
+            if remaining < 0:
+                break
+        if remaining < 0:
+            continue
+
+        remaining = budget
+        for offset, hunk_line in enumerate(hunk_lines):
+            remaining -= bounded_edit_distance(hunk_line, non_empty_lines[start + offset][0], remaining)
+            if remaining < 0:
+                break
+        if remaining < 0:
+            continue
+
+        candidates.append({
+            "startLineNum": non_empty_lines[start][1],
+            "endLineNum": non_empty_lines[start + hunk_length - 1][1],
+            "score": (1 - (budget - remaining) / hunk_chars) * 100
+        })
 
-def compare_hunks_to_files(searches: Dict[str, List[List[str]]], file_system: FileSystem) -> SearchResult:
+    candidates.sort(key=lambda candidate: (-candidate["score"], candidate["startLineNum"]))
+    return candidates
+
+
+def build_hunk_result(file_name: str, hunk_lines: List[str], file_index: FileIndex,
+                      candidates: List[HunkCandidate], min_similarity: Optional[float] = None) -> HunkResult:
+    """
+    Resolve a hunk's matches from its candidates, falling back to per-line lookups.
+
+    Args:
+    file_name: The file the hunk was searched in, used in error messages.
+    hunk_lines: The stripped, non-empty lines of the hunk.
+    file_index: The FileIndex of the file.
+    candidates: The hunk's candidate locations, best first.
+    min_similarity: If set, a hunk without an exact occurrence is matched to its most similar
+        window scoring at least this percentage, and its candidates become the fuzzy candidates.
+
+    Returns:
+    The HunkResult for the hunk.
+    """
+    hunk_result: HunkResult = {
+        "matches": [],
+        "mismatches": [],
+        "hunkLines": len(hunk_lines),
+        "matchPercentage": 0,
+        "errors": [],
+        "candidates": candidates
+    }
+
+    best = None
+    exact = [candidate for candidate in candidates if candidate["score"] == 100]
+    if exact:
+        if len(exact) > 1:
+            logger.debug("Hunk occurs %d times in %s, using the first", len(exact), file_name)
+        best = exact[0]
+    elif min_similarity is not None:
+        fuzzy = find_fuzzy_candidates(hunk_lines, file_index, min_similarity)
+        if fuzzy:
+            logger.debug("Hunk fuzzily matched in %s with similarity %.1f", file_name, fuzzy[0]["score"])
+            hunk_result["candidates"] = fuzzy
+            best = fuzzy[0]
+
+    if best is not None:
+        start = bisect_left(file_index.line_numbers, best["startLineNum"])
+        hunk_result["matches"] = [{
+            "hunkLineNum": hunk_line_index + 1,
+            "fileLineNum": file_index.non_empty_lines[start + hunk_line_index][1],
+            "content": hunk_line
+        } for hunk_line_index, hunk_line in enumerate(hunk_lines)]
+        hunk_result["matchPercentage"] = best["score"]
+        return hunk_result
+
+    # No contiguous occurrence: fall back to matching each line on its own
+    def first_occurrence(line: str) -> Optional[int]:
+        line_numbers = file_index.line_index.get(line)
+        return line_numbers[0] if line_numbers else None
+
+    match_lines_individually(file_name, hunk_lines, first_occurrence, hunk_result)
+    return hunk_result
+
+
+def mismatch_error(file_name: str, hunk_line_num: int, hunk_line: Optional[str] = None) -> str:
+    """
+    Describe a hunk line that is not in the file, quoting the line unless it is left out.
+
+    Args:
+    file_name: The file the hunk was searched in.
+    hunk_line_num: The 1-based number of the line in the hunk.
+    hunk_line: The stripped content of the line, or None to leave it out.
+
+    Returns:
+    The error message.
+    """
+    message = f'Line {hunk_line_num} of hunk not found in {file_name}'
+    return message if hunk_line is None else f'{message}: "{hunk_line}"'
+
+
+def match_lines_individually(file_name: str, hunk_lines: List[str],
+                             first_occurrence: Callable[[str], Optional[int]], hunk_result: HunkResult) -> None:
+    """
+    Fill in a hunk result by matching each hunk line to its first occurrence in the file.
+
+    This is only done for hunks that have no contiguous occurrence, so even when every line is
+    found on its own the hunk is not in the file as written: it gets an error, and replacing it
+    is refused, rather than replacing whatever lies between its scattered first and last matches.
+
+    Args:
+    file_name: The file the hunk was searched in, used in error messages.
+    hunk_lines: The stripped, non-empty lines of the hunk.
+    first_occurrence: Returns the 1-based number of the first file line equal to a stripped
+        line, or None if there is none.
+    hunk_result: The result to add matches, mismatches, errors and the match percentage to.
+    """
+    for hunk_line_index, hunk_line in enumerate(hunk_lines):
+        line_num = first_occurrence(hunk_line)
+        if line_num is not None:
+            hunk_result["matches"].append({
+                "hunkLineNum": hunk_line_index + 1,
+                "fileLineNum": line_num,
+                "content": hunk_line
+            })
+        else:
+            hunk_result["mismatches"].append({
+                "hunkLineNum": hunk_line_index + 1,
+                "content": hunk_line
+            })
+            hunk_result["errors"].append(mismatch_error(file_name, hunk_line_index + 1, hunk_line))
+
+    hunk_result["matchPercentage"] = (len(hunk_result["matches"]) / len(hunk_lines)) * 100
+    if hunk_lines and not hunk_result["mismatches"]:
+        line_nums = [match["fileLineNum"] for match in hunk_result["matches"]]
+        hunk_result["errors"].append(
+            f"Lines of hunk found in {file_name} but not as one contiguous block "
+            f"(first occurrences at lines {', '.join(str(line_num) for line_num in line_nums)})"
+        )
+
+
+def iter_file_lines(file_path: str) -> Iterator[bytes]:
+    """
+    Lazily yield the raw lines of a file through a read-only memory map.
+
+    Lines are produced exactly as content.split(b'\\n') would produce them, including the
+    trailing empty line of a file ending in a newline, but only one line is held in memory at
+    a time and none is decoded.
+
+    Args:
+    file_path: The path of the file.
+
+    Yields:
+    Each line of the file as bytes, without its newline.
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            line = b''
+            for line in iter(mapped.readline, b''):
+                yield line[:-1] if line.endswith(b'\n') else line
+            if line.endswith(b'\n'):
+                yield b''
+
+
+def stream_search_file(file_name: str, hunks_lines: List[List[str]]) -> FileResult:
+    """
+    Search a large file for hunks in one streaming pass, without loading it into memory.
+
+    Lines are read lazily from a memory map. Only the prefix hashes and line numbers of the
+    last few non-empty lines (as many as the longest hunk) are kept, along with the lines
+    themselves, which is enough to detect and confirm every exact contiguous occurrence of every
+    hunk with a rolling hash when the hunk's last line goes by. The first occurrence of each individual hunk line is recorded along the way
+    for the per-line fallback. Partial and fuzzy candidates are not computed for streamed files.
+
+    File lines are never decoded: the hunk lines are encoded the way read_file decodes files and
+    compared with the raw lines as bytes. This gives the same matches as searching the decoded
+    file, except for lines padded with non-ASCII whitespace, which bytes.strip leaves in place.
+
+    Args:
+    file_name: The path of the file to search.
+    hunks_lines: The stripped, non-empty lines of every hunk searched in the file.
+
+    Returns:
+    The FileResult for the file, in the same shape compare_hunks_to_files produces.
+    """
+    encoded_hunks = [[line.encode(TEXT_ENCODING, TEXT_ERRORS) for line in hunk_lines] for hunk_lines in hunks_lines]
+    hunk_hashes = [build_prefix_hashes(hunk_lines)[-1] for hunk_lines in encoded_hunks]
+    by_last_line: Dict[bytes, List[int]] = {}
+    for hunk_index, hunk_lines in enumerate(encoded_hunks):
+        if hunk_lines:
+            by_last_line.setdefault(hunk_lines[-1], []).append(hunk_index)
+    powers = {len(hunk_lines): pow(HASH_BASE, len(hunk_lines), HASH_MOD) for hunk_lines in hunks_lines}
+    wanted = {line for hunk_lines in encoded_hunks for line in hunk_lines}
+    window = max((len(hunk_lines) for hunk_lines in hunks_lines), default=0)
+    bom = UTF8_BOM.encode(TEXT_ENCODING)
+
+    first_seen: Dict[bytes, int] = {}
+    recent_hashes = deque([0], maxlen=window + 1)
+    recent_numbers = deque(maxlen=window)
+    recent_lines = deque(maxlen=window)
+    candidates: List[List[HunkCandidate]] = [[] for _ in hunks_lines]
+    first_block: List[Optional[List[int]]] = [None for _ in hunks_lines]
+    current = 0
+    seen_non_empty = 0
+    file_lines = 0
+
+    for file_lines, raw_line in enumerate(iter_file_lines(file_name), 1):
+        line = raw_line.strip()
+        if file_lines == 1 and line.startswith(bom):
+            line = line[len(bom):].strip()
+        if not line:
+            continue
+        current = (current * HASH_BASE + hash(line)) % HASH_MOD
+        recent_hashes.append(current)
+        recent_numbers.append(file_lines)
+        recent_lines.append(line)
+        seen_non_empty += 1
+        if line in wanted and line not in first_seen:
+            first_seen[line] = file_lines
+
+        for hunk_index in by_last_line.get(line, ()):
+            length = len(hunks_lines[hunk_index])
+            if length > seen_non_empty:
+                continue
+            if (current - recent_hashes[-1 - length] * powers[length]) % HASH_MOD != hunk_hashes[hunk_index]:
+                continue
+            if list(islice(recent_lines, len(recent_lines) - length, None)) != encoded_hunks[hunk_index]:
+                continue
+            block = list(islice(recent_numbers, len(recent_numbers) - length, None))
+            candidates[hunk_index].append({"startLineNum": block[0], "endLineNum": block[-1], "score": 100.0})
+            if first_block[hunk_index] is None:
+                first_block[hunk_index] = block
+
+    file_result: FileResult = {
+        "fileName": file_name,
+        "fileLines": file_lines,
+        "hunks": []
+    }
+    for hunk_index, hunk_lines in enumerate(hunks_lines):
+        hunk_result: HunkResult = {
+            "matches": [],
+            "mismatches": [],
+            "hunkLines": len(hunk_lines),
+            "matchPercentage": 0,
+            "errors": [],
+            "candidates": candidates[hunk_index]
+        }
+        block = first_block[hunk_index]
+        if block is not None:
+            hunk_result["matches"] = [{
+                "hunkLineNum": hunk_line_index + 1,
+                "fileLineNum": line_num,
+                "content": hunk_line
+            } for hunk_line_index, (hunk_line, line_num) in enumerate(zip(hunk_lines, block))]
+            hunk_result["matchPercentage"] = 100
+        else:
+            match_lines_individually(file_name, hunk_lines,
+                                     lambda line: first_seen.get(line.encode(TEXT_ENCODING, TEXT_ERRORS)),
+                                     hunk_result)
+        file_result["hunks"].append(hunk_result)
+
+    return file_result
+
+
+def find_large_files(file_paths: Iterable[str], threshold: Optional[int]) -> Set[str]:
+    """
+    Select the files that should be searched by streaming rather than loaded into memory.
+
+    Args:
+    file_paths: The paths of the files to search.
+    threshold: The size in bytes above which a file is streamed; None disables streaming.
+
+    Returns:
+    The paths of the existing files larger than the threshold.
+    """
+    if threshold is None:
+        return set()
+    large_files = set()
+    for file_path in file_paths:
+        try:
+            if os.path.getsize(file_path) > threshold:
+                large_files.add(file_path)
+        except OSError:
+            continue
+    return large_files
+
+
+def compare_hunks_to_files(searches: Dict[str, List[List[str]]], file_system: FileSystem,
+                           search_mode: str = "block", min_similarity: Optional[float] = None,
+                           file_indexes: Optional[Dict[str, FileIndex]] = None,
+                           streamed_files: Iterable[str] = (),
+                           on_hunk: Optional[HunkCallback] = None) -> SearchResult:
     """
     Compare search hunks to files in the file system.
 
@@ -91,69 +945,187 @@ def compare_hunks_to_files(searches: Dict[str, List[List[str]]], file_system: Fi
     locate specific code segments within files, which is essential for targeted modifications.
     The detailed results it provides help in making informed decisions about replacements.
 
+    Each hunk is first searched as a contiguous run of non-empty lines; every candidate location
+    is reported with its score, and the first exact one provides the matches. Hunks without an
+    exact contiguous occurrence fall back to matching each line to its first occurrence.
+
+    In "multi" search mode all hunks of a file are first located together in one rolling-hash
+    pass over the file; only hunks without an exact occurrence are then searched on their own.
+    Both modes resolve the same matches, but for hunks found in that pass "multi" mode only
+    reports the exact occurrences as candidates.
+
+    Fuzzy matching is opt-in through min_similarity: a hunk with no exact occurrence is then
+    matched to the most similar window of the file, and its matchPercentage is that similarity.
+
     Args:
     searches: A dictionary mapping file paths to lists of search hunks.
     file_system: A dictionary representing the file system, mapping file paths to their content.
+    search_mode: "block" to search each hunk on its own, or "multi" to search all hunks of a file at once.
+    min_similarity: Minimum similarity percentage for fuzzy matches; None disables fuzzy matching.
+    file_indexes: Already built FileIndex objects for some of the files, which must match their
+        content in file_system; indexes for the other files are built on the fly.
+    streamed_files: Files to search with stream_search_file straight from disk instead of from
+        file_system; they only report exact candidates and are never fuzzily matched.
+    on_hunk: Called for every hunk as soon as it is resolved, e.g. to stream results out.
 
     Returns:
     A SearchResult dictionary containing detailed information about matches and mismatches.
     """
+    if search_mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode: {search_mode}")
+
     results: SearchResult = {}
+    streamed_files = set(streamed_files)
 
     for file_name, file_hunks in searches.items():
-        logging.debug(f"Processing file: {file_name}")
+        logger.debug("Processing file: %s", file_name)
+        if file_name in streamed_files:
+            if min_similarity is not None:
+                logger.warning("Fuzzy matching is not available for streamed file: %s", file_name)
+            hunks_lines = [[line.strip() for line in hunk[0].split('\n') if line.strip()] for hunk in file_hunks]
+            with timed_phase("search", file=file_name, hunks=len(file_hunks), streamed=True):
+                results[file_name] = stream_search_file(file_name, hunks_lines)
+            if on_hunk is not None:
+                report_hunks(on_hunk, file_name, results[file_name])
+            continue
+
         if file_name not in file_system:
             results[file_name] = {
                 "error": f'File "{file_name}" not found in the file system.',
                 "hunks": [{"hunkLines": len(hunk[0].split('\n')), "matchPercentage": 0} for hunk in file_hunks]
             }
+            if on_hunk is not None:
+                report_hunks(on_hunk, file_name, results[file_name])
             continue
 
-        file = file_system[file_name].split('\n')
-        non_empty_lines = [(line.strip(), index + 1) for index, line in enumerate(file) if line.strip()]
+        with timed_phase("search", file=file_name, hunks=len(file_hunks)):
+            file_index = (file_indexes or {}).get(file_name) or build_file_index(file_system[file_name])
 
-        file_result: FileResult = {
-            "fileName": file_name,
-            "fileLines": len(file),
-            "hunks": []
-        }
-
-        for hunk_index, hunk in enumerate(file_hunks):
-            logging.debug(f"Processing hunk {hunk_index + 1} for file: {file_name}")
-            hunk_lines = [line for line in hunk[0].split('\n') if line.strip()]
-            hunk_result: HunkResult = {
-                "matches": [],
-                "mismatches": [],
-                "hunkLines": len(hunk_lines),
-                "matchPercentage": 0,
-                "errors": []
+            file_result: FileResult = {
+                "fileName": file_name,
+                "fileLines": len(file_index.lines),
+                "hunks": []
             }
 
-            for hunk_line_index, hunk_line in enumerate(hunk_lines):
-                file_index = next((i for i, (line, _) in enumerate(non_empty_lines) if line == hunk_line.strip()), -1)
-                if file_index != -1:
-                    hunk_result["matches"].append({
-                        "hunkLineNum": hunk_line_index + 1,
-                        "fileLineNum": non_empty_lines[file_index][1],
-                        "content": hunk_line.strip()
-                    })
-                else:
-                    hunk_result["mismatches"].append({
-                        "hunkLineNum": hunk_line_index + 1,
-                        "content": hunk_line.strip()
-                    })
-                    hunk_result["errors"].append(
-                        f'Line {hunk_line_index + 1} of hunk not found in {file_name}: "{hunk_line.strip()}"'
-                    )
-
-            hunk_result["matchPercentage"] = (len(hunk_result["matches"]) / len(hunk_lines)) * 100
-            file_result["hunks"].append(hunk_result)
+            hunks_lines = [[line.strip() for line in hunk[0].split('\n') if line.strip()] for hunk in file_hunks]
+            if search_mode == "multi":
+                found = find_hunks_in_one_pass(hunks_lines, file_index)
+            else:
+                found = [[] for _ in hunks_lines]
+
+            for hunk_index, hunk_lines in enumerate(hunks_lines):
+                logger.debug("Processing hunk %d for file: %s", hunk_index + 1, file_name)
+                candidates = found[hunk_index] or find_contiguous_candidates(hunk_lines, file_index)
+                file_result["hunks"].append(
+                    build_hunk_result(file_name, hunk_lines, file_index, candidates, min_similarity))
+                if on_hunk is not None:
+                    on_hunk(file_name, hunk_index, file_result["hunks"][-1], None)
 
         results[file_name] = file_result
 
     return results
 
 
+def summarize_hunk_result(file_name: str, hunk_result: Dict) -> Dict:
+    """
+    Reduce a hunk result to its outcome, leaving out the content of every hunk and file line.
+
+    The matched range is kept as the file line numbers of the first and last matches, and
+    mismatches as the hunk line numbers that were not found. The errors about missing lines
+    give the line number without quoting the line. The placeholder hunks of a file that was
+    not found are returned as they are.
+
+    Args:
+    file_name: The file the hunk was searched in.
+    hunk_result: A hunk from the results of compare_hunks_to_files.
+
+    Returns:
+    The HunkSummary, or the hunk itself if it has no matches to summarize.
+    """
+    if "matches" not in hunk_result:
+        return hunk_result
+
+    matches = hunk_result["matches"]
+    # Every other error only names lines by their number
+    unquoted = {mismatch_error(file_name, mismatch["hunkLineNum"], mismatch["content"]):
+                mismatch_error(file_name, mismatch["hunkLineNum"]) for mismatch in hunk_result["mismatches"]}
+    summary: HunkSummary = {
+        "hunkLines": hunk_result["hunkLines"],
+        "matchPercentage": hunk_result["matchPercentage"],
+        "startLineNum": matches[0]["fileLineNum"] if matches else None,
+        "endLineNum": matches[-1]["fileLineNum"] if matches else None,
+        "mismatchedLines": [mismatch["hunkLineNum"] for mismatch in hunk_result["mismatches"]],
+        "errors": [unquoted.get(error, error) for error in hunk_result["errors"]],
+        "candidates": hunk_result["candidates"]
+    }
+    return summary
+
+
+def summarize_search_results(search_results: SearchResult) -> Dict[str, Dict]:
+    """
+    Apply summarize_hunk_result to every hunk of a SearchResult.
+
+    Args:
+    search_results: The results of compare_hunks_to_files.
+
+    Returns:
+    A copy of the results with summarized hunks.
+    """
+    return {
+        file_name: {**result, "hunks": [summarize_hunk_result(file_name, hunk) for hunk in result["hunks"]]}
+        for file_name, result in search_results.items()
+    }
+
+
+def write_ndjson(output_stream: IO[str], record: Dict) -> None:
+    """
+    Write a record as one compact JSON line and flush it, so readers get it right away.
+
+    Args:
+    output_stream: The stream to write to.
+    record: The JSON-serializable record.
+    """
+    output_stream.write(json.dumps(record, separators=(',', ':')) + '\n')
+    output_stream.flush()
+
+
+def ndjson_hunk_writer(output_stream: IO[str], summary: bool = False) -> HunkCallback:
+    """
+    Create an on_hunk callback that writes every resolved hunk as an NDJSON record.
+
+    Each record holds the file name, the hunk's index in the file's hunks, the file's error if
+    it was not found, and the hunk result (or its summary).
+
+    Args:
+    output_stream: The stream to write the records to.
+    summary: Whether to write summarized hunks, without per-line content.
+
+    Returns:
+    The callback.
+    """
+    def write(file_name: str, hunk_index: int, hunk_result: Dict, error: Optional[str]) -> None:
+        record = {"fileName": file_name, "hunkIndex": hunk_index}
+        if error is not None:
+            record["error"] = error
+        record.update(summarize_hunk_result(file_name, hunk_result) if summary else hunk_result)
+        write_ndjson(output_stream, record)
+
+    return write
+
+
+def report_hunks(on_hunk: HunkCallback, file_name: str, result: Dict) -> None:
+    """
+    Call on_hunk for every hunk of a file's result, with the file's error if it has one.
+
+    Args:
+    on_hunk: The callback.
+    file_name: The file the hunks were searched in.
+    result: The file's result from compare_hunks_to_files.
+    """
+    for hunk_index, hunk_result in enumerate(result["hunks"]):
+        on_hunk(file_name, hunk_index, hunk_result, result.get("error"))
+
+
 def create_backup(file_path: str) -> str:
     """
     Create a backup of the original file.
@@ -168,14 +1140,156 @@ def create_backup(file_path: str) -> str:
     Returns:
     The path of the created backup file.
     """
-    base, ext = os.path.splitext(file_path)
-    backup_path = f"{base}.old{ext}"
+    backup_path = backup_copy_path(file_path)
     shutil.copy2(file_path, backup_path)
-    logging.debug(f"Backup created: {backup_path}")
+    logger.debug("Backup created: %s", backup_path)
     return backup_path
 
 
-def create_patch(original_dir: str, updated_dir: str, patch_file: str) -> None:
+def backup_copy_path(file_path: str) -> str:
+    """
+    Return the path of the `.old` backup copy create_backup writes for a file.
+
+    Args:
+    file_path: The path of the file.
+
+    Returns:
+    The path of its backup copy, e.g. main.old.rs for main.rs.
+    """
+    base, ext = os.path.splitext(file_path)
+    return f"{base}.old{ext}"
+
+
+def format_diff_timestamp(mtime_ns: int) -> str:
+    """
+    Format a modification time the way `diff -u` prints it in file headers.
+
+    Args:
+    mtime_ns: The modification time in nanoseconds since the epoch.
+
+    Returns:
+    The timestamp as "YYYY-MM-DD HH:MM:SS.nnnnnnnnn +ZZZZ" in local time.
+    """
+    seconds, nanoseconds = divmod(mtime_ns, 1_000_000_000)
+    moment = datetime.datetime.fromtimestamp(seconds).astimezone()
+    return f"{moment.strftime('%Y-%m-%d %H:%M:%S')}.{nanoseconds:09d} {moment.strftime('%z')}"
+
+
+def group_opcodes(opcodes: List[Tuple[str, int, int, int, int]], context: int) -> List[List[Tuple[str, int, int, int, int]]]:
+    """
+    Group diff opcodes into hunks with `context` lines of context, merging nearby changes.
+
+    This is difflib.SequenceMatcher.get_grouped_opcodes for an opcode list that did not come
+    from a single SequenceMatcher.
+
+    Args:
+    opcodes: (tag, i1, i2, j1, j2) opcodes covering both sequences from start to end.
+    context: The number of context lines around each change.
+
+    Returns:
+    The opcodes of each hunk, with the equal runs at its edges trimmed to the context size.
+    """
+    merged: List[Tuple[str, int, int, int, int]] = []
+    for opcode in opcodes:
+        if merged and merged[-1][0] == opcode[0] == 'equal':
+            merged[-1] = ('equal', merged[-1][1], opcode[2], merged[-1][3], opcode[4])
+        elif opcode[1] != opcode[2] or opcode[3] != opcode[4]:
+            merged.append(opcode)
+    if not merged or all(opcode[0] == 'equal' for opcode in merged):
+        return []
+
+    if merged[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = merged[0]
+        merged[0] = (tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2)
+    if merged[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = merged[-1]
+        merged[-1] = (tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context))
+
+    groups = []
+    group: List[Tuple[str, int, int, int, int]] = []
+    for tag, i1, i2, j1, j2 in merged:
+        # End the current group and start a new one whenever there is a large range with no changes
+        if tag == 'equal' and i2 - i1 > context * 2:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            groups.append(group)
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        groups.append(group)
+    return groups
+
+
+def unified_diff(original: str, updated: str, original_label: str, updated_label: str) -> str:
+    """
+    Generate a unified diff of two file contents.
+
+    The hunks come from difflib with three lines of context, and missing trailing newlines are
+    marked with "\\ No newline at end of file". It is in the unified format `patch` and
+    `git apply` read, but not byte-for-byte what `diff -u` prints: difflib can align the lines
+    differently, so hunks may be split or grouped otherwise and hold other context lines.
+
+    Args:
+    original: The original file content.
+    updated: The updated file content.
+    original_label: The path (and optional tab-separated timestamp) for the "---" header.
+    updated_label: The path (and optional tab-separated timestamp) for the "+++" header.
+
+    Returns:
+    The diff, or an empty string if the contents are equal.
+    """
+    if original == updated:
+        return ""
+
+    original_lines = original.splitlines(keepends=True)
+    updated_lines = updated.splitlines(keepends=True)
+
+    def emit(prefix: str, line: str) -> str:
+        if line.endswith('\n'):
+            return prefix + line
+        return f"{prefix}{line}\n\\ No newline at end of file\n"
+
+    def format_range(start: int, length: int) -> str:
+        if length == 1:
+            return f"{start + 1}"
+        return f"{start + 1 if length else start},{length}"
+
+    # Only diff the region between the common leading and trailing lines; on large files
+    # with many repeated lines difflib would otherwise spend most of its time on lines that
+    # are known to be unchanged
+    prefix = 0
+    shortest = min(len(original_lines), len(updated_lines))
+    while prefix < shortest and original_lines[prefix] == updated_lines[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < shortest - prefix and original_lines[-1 - suffix] == updated_lines[-1 - suffix]:
+        suffix += 1
+
+    matcher = difflib.SequenceMatcher(None, original_lines[prefix:len(original_lines) - suffix],
+                                      updated_lines[prefix:len(updated_lines) - suffix])
+    opcodes = [('equal', 0, prefix, 0, prefix)] if prefix else []
+    opcodes.extend((tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix)
+                   for tag, i1, i2, j1, j2 in matcher.get_opcodes())
+    if suffix:
+        opcodes.append(('equal', len(original_lines) - suffix, len(original_lines),
+                        len(updated_lines) - suffix, len(updated_lines)))
+
+    output = [f"--- {original_label}\n", f"+++ {updated_label}\n"]
+    for group in group_opcodes(opcodes, 3):
+        first, last = group[0], group[-1]
+        output.append(f"@@ -{format_range(first[1], last[2] - first[1])} "
+                      f"+{format_range(first[3], last[4] - first[3])} @@\n")
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                output.extend(emit(' ', line) for line in original_lines[i1:i2])
+                continue
+            output.extend(emit('-', line) for line in original_lines[i1:i2])
+            output.extend(emit('+', line) for line in updated_lines[j1:j2])
+
+    return ''.join(output)
+
+
+def create_patch(changes: List[FileChange], patch_file: str) -> Optional[str]:
     """
     Create a patch file representing the differences between original and updated files.
 
@@ -183,49 +1297,233 @@ def create_patch(original_dir: str, updated_dir: str, patch_file: str) -> None:
     track modifications, review changes, and potentially apply or revert them later.
     The use of relative paths in the patch makes it more portable across different environments.
 
+    The patch is generated in memory from the contents already held by the caller, laid out
+    like `diff -ruN` output with paths rewritten under src/, so no copies of the files and no
+    `diff` binary are needed. See unified_diff for how its hunks can differ from `diff`'s.
+
     Args:
-    original_dir: Directory containing the original files.
-    updated_dir: Directory containing the updated files.
-    common_ancestor: Common ancestor directory for creating relative paths.
+    changes: The original and updated content of each changed file, keyed by relative path.
     patch_file: Path where the patch file should be created.
+
+    Returns:
+    The patch content, or None if there were no differences and no patch was written.
     """
-    logging.info("Starting patch creation process")
-    try:
-        result = subprocess.run(['diff', '-ruN', original_dir, updated_dir],
-                                capture_output=True, text=True, check=False)
-        logging.debug(f"Diff command return code: {result.returncode}")
-        logging.debug(f"Diff command stdout: {result.stdout}")
-        logging.debug(f"Diff command stderr: {result.stderr}")
-
-        if result.returncode == 1:
-            logging.info("Differences found")
-            patch_content = result.stdout
-
-            # Replace temporary directory paths with relative paths
-            patch_lines = patch_content.split('\n')
-            for i, line in enumerate(patch_lines):
-                if line.startswith('--- ') or line.startswith('+++ '):
-                    _, path = line.split(None, 1)
-                    rel_path = os.path.relpath(path, original_dir if line.startswith('---') else updated_dir)
-                    project_path = os.path.join('src', rel_path)
-                    patch_lines[i] = f"{line[:4]}{project_path}"
-
-            patch_content = '\n'.join(patch_lines)
-
-            with open(patch_file, 'w') as f:
-                f.write(patch_content)
-            logging.info(f"Patch file created: {patch_file}")
-        elif result.returncode == 0:
-            logging.info("No differences found")
-        else:
-            logging.warning(f"Unexpected return code from diff command: {result.returncode}")
+    logger.info("Starting patch creation process")
+    sections = []
+    for change in sorted(changes, key=lambda change: change.rel_path.split(os.sep)):
+        project_path = os.path.join('src', change.rel_path)
+        diff = unified_diff(
+            change.original, change.updated,
+            f"{project_path}\t{format_diff_timestamp(change.original_mtime_ns)}",
+            f"{project_path}\t{format_diff_timestamp(change.updated_mtime_ns)}"
+        )
+        if diff:
+            sections.append(f"diff -ruN {project_path} {project_path}\n{diff}")
+
+    if not sections:
+        logger.info("No differences found")
+        return None
+
+    logger.info("Differences found")
+    patch_content = ''.join(sections)
+    with open(patch_file, 'wb') as f:
+        f.write(encode_text(patch_content))
+    logger.info("Patch file created: %s (%d bytes)", patch_file, len(patch_content))
+    return patch_content
+
+
+class LineEdit(NamedTuple):
+    start: int
+    end: int
+    lines: List[str]
+    hunk_index: int
+
+
+def build_line_edits(file_name: str, hunk_results: List[HunkResult], file_replacements: List[List[str]],
+                     file_lines: List[str]) -> List[LineEdit]:
+    """
+    Turn a file's matched hunks into line edits against the file's original line numbers.
+
+    Every edit replaces the lines from the first to the last match of its hunk with the hunk's
+    replacement, indented like the first replaced line. Since all edits refer to the original
+    file, none of them is affected by the others changing the number of lines.
+
+    Args:
+    file_name: The file the hunks were matched in, used in log messages.
+    hunk_results: The file's hunk results from compare_hunks_to_files, all without errors.
+    file_replacements: The replacement hunks for the file, in the same order as its search hunks.
+    file_lines: The original lines of the file.
+
+    Returns:
+    The edits, sorted by their first line.
+    """
+    edits = []
+    for hunk_index, hunk_result in enumerate(hunk_results):
+        logger.info("Processing hunk %d for file: %s", hunk_index + 1, file_name)
+        replacement_lines = file_replacements[hunk_index][0].replace('\r\n', '\n').split('\n')
+        start_line = hunk_result["matches"][0]["fileLineNum"] - 1
+        end_line = hunk_result["matches"][-1]["fileLineNum"]
+
+        logger.debug("Replacing lines %d-%d with %d lines", start_line + 1, end_line, len(replacement_lines))
 
-    except FileNotFoundError:
-        logging.error("Error: The 'diff' utility is not available on this system.")
+        # Preserve indentation
+        if start_line > 0:
+            original_indent = len(file_lines[start_line]) - len(file_lines[start_line].lstrip())
+            replacement_lines = [' ' * original_indent + line for line in replacement_lines]
+
+        # Keep CRLF line endings, except after a last line that has no newline at all
+        if file_lines[start_line].endswith('\r'):
+            last_end = '\r' if file_lines[end_line - 1].endswith('\r') else ''
+            replacement_lines = [line + '\r' for line in replacement_lines[:-1]] + [replacement_lines[-1] + last_end]
+        if start_line == 0 and file_lines[0].startswith(UTF8_BOM):
+            replacement_lines[0] = UTF8_BOM + replacement_lines[0]
+
+        edits.append(LineEdit(start_line, end_line, replacement_lines, hunk_index))
+
+    edits.sort(key=lambda edit: (edit.start, edit.end))
+    return edits
+
+
+def find_overlapping_edits(edits: List[LineEdit]) -> List[Tuple[LineEdit, LineEdit]]:
+    """
+    Find the edits that replace lines another edit already replaces.
+
+    Args:
+    edits: The edits, sorted by their first line.
+
+    Returns:
+    Each overlapping edit, paired with the earlier edit reaching furthest into it.
+    """
+    overlaps = []
+    furthest = None
+    for edit in edits:
+        if furthest is not None and edit.start < furthest.end:
+            overlaps.append((furthest, edit))
+        if furthest is None or edit.end > furthest.end:
+            furthest = edit
+    return overlaps
+
+
+def splice_lines(file_lines: List[str], edits: List[LineEdit]) -> str:
+    """
+    Apply non-overlapping edits to a file in one pass.
+
+    The result is assembled as a piece table: a list of pieces alternating between runs of
+    untouched original lines and the replacement lines of each edit, joined once at the end.
+    This takes time linear in the size of the file plus the edits, however many edits there
+    are, where splicing each edit into a list of lines would shift the rest of the file every time.
+
+    Args:
+    file_lines: The original lines of the file.
+    edits: The edits, sorted by their first line and not overlapping.
+
+    Returns:
+    The updated content.
+    """
+    pieces: List[List[str]] = []
+    position = 0
+    for edit in edits:
+        pieces.append(file_lines[position:edit.start])
+        pieces.append(edit.lines)
+        position = edit.end
+    pieces.append(file_lines[position:])
+    return '\n'.join(line for piece in pieces for line in piece)
+
+
+def check_hunk_overlaps(file_name: str, hunk_results: List[HunkResult]) -> bool:
+    """
+    Add an error to every matched hunk whose last match comes before its first, and to every
+    matched hunk that overlaps an earlier hunk of the same file.
+
+    An inverted range would make the splice emit lines twice, and overlapping hunks cannot both
+    be applied, so a file with any of them is not modified.
+
+    Args:
+    file_name: The file the hunks were matched in.
+    hunk_results: The file's hunk results from compare_hunks_to_files, all without errors.
+
+    Returns:
+    True if any hunk has an inverted range or any hunks overlap.
+    """
+    edits = sorted((LineEdit(hunk["matches"][0]["fileLineNum"] - 1, hunk["matches"][-1]["fileLineNum"], [], index)
+                    for index, hunk in enumerate(hunk_results)), key=lambda edit: (edit.start, edit.end))
+    inverted = [edit for edit in edits if edit.end <= edit.start]
+    for edit in inverted:
+        hunk_results[edit.hunk_index]["errors"].append(
+            f"Hunk {edit.hunk_index + 1} ends before it starts in {file_name} "
+            f"(first match at line {edit.start + 1}, last at line {edit.end})")
+
+    overlaps = find_overlapping_edits([edit for edit in edits if edit.end > edit.start])
+    for first, second in overlaps:
+        hunk_results[second.hunk_index]["errors"].append(
+            f"Hunk {second.hunk_index + 1} overlaps hunk {first.hunk_index + 1} in {file_name} "
+            f"(lines {second.start + 1}-{second.end} and {first.start + 1}-{first.end})")
+    return bool(inverted or overlaps)
+
+
+def apply_file_hunks(file_name: str, hunk_results: List[HunkResult], file_replacements: List[List[str]],
+                     content: str, transaction: "FileTransaction", backup_copy: bool = False) -> Optional[str]:
+    """
+    Splice in the replacements for all of a file's hunks and stage the result in a transaction.
+
+    All hunks are applied in one pass against the line numbers they were matched at, so the
+    order of the hunks does not matter. Nothing is written to the file itself until the
+    transaction is committed. Each call only stages its own file, so several files can be
+    processed concurrently.
+
+    Args:
+    file_name: The path of the file to modify.
+    hunk_results: The file's hunk results from compare_hunks_to_files, all without errors.
+    file_replacements: The replacement hunks for the file, in the same order as its search hunks.
+    content: The current content of the file.
+    transaction: The FileTransaction to stage the updated content in.
+    backup_copy: Whether to also write a full `.old` copy of the file with create_backup.
+
+    Returns:
+    The updated content, or None if no hunk was applied and nothing was staged.
+
+    Raises:
+    ValueError: If a hunk ends before it starts, or two hunks replace some of the same lines;
+        check_hunk_overlaps finds both first.
+    """
+    file_lines = content.split('\n')
+    edits = build_line_edits(file_name, hunk_results, file_replacements, file_lines)
+    if not edits:
+        logger.info("No changes made to file: %s", file_name)
+        return None
+
+    inverted = [edit for edit in edits if edit.end <= edit.start]
+    if inverted:
+        raise ValueError(f"Hunk {inverted[0].hunk_index + 1} ends before it starts in {file_name}")
+
+    overlaps = find_overlapping_edits(edits)
+    if overlaps:
+        first, second = overlaps[0]
+        raise ValueError(f"Hunk {second.hunk_index + 1} overlaps hunk {first.hunk_index + 1} in {file_name}")
+
+    logger.info("Changes made to file: %s", file_name)
+    updated_content = splice_lines(file_lines, edits)
+
+    # Check if the content has actually changed
+    if content == updated_content:
+        logger.error("File content did not change after replacement: %s", file_name)
+        raise AssertionError(f"File content did not change after replacement: {file_name}")
+
+    if backup_copy:
+        create_backup(file_name)
+        logger.info("Backup created for file: %s", file_name)
+
+    transaction.stage(file_name, updated_content)
+    logger.debug("Staged file %s: %d characters", file_name, len(updated_content))
+    return updated_content
 
 
 def replace_hunks_in_files(searches: Dict[str, List[List[str]]], replacements: Dict[str, List[List[str]]],
-                           file_system: FileSystem) -> Tuple[
+                           file_system: FileSystem, search_mode: str = "block",
+                           min_similarity: Optional[float] = None, jobs: int = 1,
+                           file_indexes: Optional[Dict[str, FileIndex]] = None,
+                           on_hunk: Optional[HunkCallback] = None, backup_copies: bool = False,
+                           durability: str = "file") -> Tuple[
     SearchResult, Dict[str, str], Dict[str, str], str, str, str]:
     """
     Replace specified hunks in files with their corresponding replacements.
@@ -235,146 +1533,143 @@ def replace_hunks_in_files(searches: Dict[str, List[List[str]]], replacements: D
     It's designed to handle multiple files and multiple hunks per file, making it versatile for
     various code modification scenarios.
 
+    All modified files are replaced in one FileTransaction: either every applicable file is
+    updated or, if anything fails, every file is left as it was. The original of each modified
+    file is kept in the BackupStore under the project root's .hunk_backups directory, recorded
+    as one session that restore_session can undo.
+
     Args:
     searches: A dictionary mapping file paths to lists of search hunks.
     replacements: A dictionary mapping file paths to lists of replacement hunks.
     file_system: A dictionary representing the file system, mapping file paths to their content.
+    search_mode: The search mode passed on to compare_hunks_to_files.
+    min_similarity: The fuzzy matching threshold passed on to compare_hunks_to_files.
+    jobs: The number of files to process concurrently; results keep the order of the searches.
+    file_indexes: Already built FileIndex objects passed on to compare_hunks_to_files.
+    on_hunk: Called for every hunk once the hunks of all files are resolved and checked for
+        overlaps, so it gets their final errors, and before any file is modified.
+    backup_copies: Whether to also write full `.old` copies next to the modified files.
+    durability: The FileTransaction durability level: "none", "file", "batch" or "verify".
 
     Returns:
     A tuple containing:
     - Search results
     - Updated file contents
-    - Backup file paths
+    - Backup file paths: the `.old` copy with backup_copies, else the blob, of every modified file
     - Path to the created patch file
     - Path to the base64 encoded patch file
     - Common ancestor directory
     """
 
-    logging.debug(f"replace_hunks_in_files - searches: {json.dumps(searches, indent=2)}")
-    logging.debug(f"replace_hunks_in_files - replacements: {json.dumps(replacements, indent=2)}")
-    logging.debug(f"replace_hunks_in_files - file_system keys: {list(file_system.keys())}")
-
     # Expected structure:
-    expected_searches = {
-        "/path/to/file1.rs": [["hunk1 for file1"], ["hunk2 for file1"]],
-        "/path/to/file2.rs": [["hunk1 for file2"]]
-    }
-    expected_replacements = {
-        "/path/to/file1.rs": [["replacement1 for file1"], ["replacement2 for file1"]],
-        "/path/to/file2.rs": [["replacement1 for file2"]]
-    }
-    logging.debug(
-        f"replace_hunks_in_files - expected searches structure: {json.dumps(expected_searches, indent=2)}")
-    logging.debug(
-        f"replace_hunks_in_files - expected replacements structure: {json.dumps(expected_replacements, indent=2)}")
+    # searches = {"/path/to/file1.rs": [["hunk1 for file1"], ["hunk2 for file1"]], "/path/to/file2.rs": [["hunk1"]]}
+    # replacements = {"/path/to/file1.rs": [["replacement1"], ["replacement2"]], "/path/to/file2.rs": [["replacement1"]]}
+    logger.debug("replace_hunks_in_files - searches: %s", LazyJson(searches))
+    logger.debug("replace_hunks_in_files - replacements: %s", LazyJson(replacements))
 
-    search_results = compare_hunks_to_files(searches, file_system)
+    search_results = compare_hunks_to_files(searches, file_system, search_mode, min_similarity, file_indexes)
     updated_files = file_system.copy()
     backup_files = {}
-    modified_files = []
 
     common_ancestor = find_common_ancestor(list(searches.keys()))
     project_root = find_project_root(list(searches.keys()))
     patch_file = os.path.join(project_root, "changes.patch")
     base64_patch_file = os.path.join(project_root, "changes.patch.b64")
 
-    # Create temporary directories for original and updated files
-    with tempfile.TemporaryDirectory() as original_temp_dir, tempfile.TemporaryDirectory() as updated_temp_dir:
-        for file_name, result in search_results.items():
-            logging.info(f"Processing file: {file_name}")
-            if "error" in result:
-                logging.warning(f"Error found for file: {file_name}")
-                continue
+    applicable = []
+    for file_name, result in search_results.items():
+        logger.info("Processing file: %s", file_name)
+        if "error" in result:
+            logger.warning("Error found for file: %s", file_name)
+            continue
 
-            if any(hunk["errors"] for hunk in result["hunks"]):
-                logging.warning(f"Errors found in hunks for file: {file_name}")
-                continue
+        if any(hunk["errors"] for hunk in result["hunks"]):
+            logger.warning("Errors found in hunks for file: %s", file_name)
+            continue
 
-            # Create backup before making changes
-            backup_files[file_name] = create_backup(file_name)
-            logging.info(f"Backup created for file: {file_name}")
-
-            # Copy original file to temporary directory
-            rel_path = os.path.relpath(file_name, common_ancestor)
-            original_temp_file = os.path.join(original_temp_dir, rel_path)
-            os.makedirs(os.path.dirname(original_temp_file), exist_ok=True)
-            shutil.copy2(backup_files[file_name], original_temp_file)
-
-            file_lines = updated_files[file_name].split('\n')
-            original_content = '\n'.join(file_lines)
-            changes_made = False
-
-            for hunk_index, hunk_result in enumerate(result["hunks"]):
-                logging.info(f"Processing hunk {hunk_index + 1} for file: {file_name}")
-                replacement_lines = replacements[file_name][hunk_index][0].split('\n')
-                start_line = hunk_result["matches"][0]["fileLineNum"] - 1
-                end_line = hunk_result["matches"][-1]["fileLineNum"]
-
-                logging.debug(f"Original lines: {file_lines[start_line:end_line]}")
-                logging.debug(f"Replacement lines: {replacement_lines}")
-
-                # Preserve indentation
-                if start_line > 0:
-                    original_indent = len(file_lines[start_line]) - len(file_lines[start_line].lstrip())
-                    replacement_lines = [' ' * original_indent + line for line in replacement_lines]
-
-                file_lines[start_line:end_line] = replacement_lines
-                changes_made = True
-
-            if changes_made:
-                logging.info(f"Changes made to file: {file_name}")
-                updated_content = '\n'.join(file_lines)
-
-                # Check if the content has actually changed
-                if original_content == updated_content:
-                    logging.error(f"File content did not change after replacement: {file_name}")
-                    raise AssertionError(f"File content did not change after replacement: {file_name}")
-
-                # Write updated content to temporary directory
-                updated_temp_file = os.path.join(updated_temp_dir, rel_path)
-                os.makedirs(os.path.dirname(updated_temp_file), exist_ok=True)
-                with open(updated_temp_file, 'w') as f:
-                    f.write(updated_content)
-
-                # Update the actual file
-                temp_path = file_name + '.tmp'
-                with open(temp_path, 'w') as f:
-                    f.write(updated_content)
-                    f.flush()
-                    os.fsync(f.fileno())
-                os.replace(temp_path, file_name)
-                updated_files[file_name] = updated_content
-                modified_files.append(file_name)
-
-                # Double-check that the file was actually modified
-                with open(file_name, 'r') as f:
-                    current_content = f.read()
-                if current_content != updated_content:
-                    logging.error(f"File content does not match expected content after writing: {file_name}")
-                    raise AssertionError(f"File content does not match expected content after writing: {file_name}")
-
-                logging.debug(f"Updated file content: {updated_files[file_name]}")
-                logging.info(f"File mtime after: {os.path.getmtime(file_name)}")
-            else:
-                logging.info(f"No changes made to file: {file_name}")
+        if check_hunk_overlaps(file_name, result["hunks"]):
+            logger.warning("Overlapping hunks found for file: %s", file_name)
+            continue
 
-        # Create patch file after all changes have been made
-        if modified_files:
-            logging.info(f"Creating patch file: {patch_file}")
-            create_patch(original_temp_dir, updated_temp_dir, patch_file)
+        applicable.append(file_name)
 
-            with open(patch_file, 'r') as f:
-                patch_content = f.read()
+    if on_hunk is not None:
+        for file_name, result in search_results.items():
+            report_hunks(on_hunk, file_name, result)
 
-            with open(base64_patch_file, 'w') as f:
-                f.write(create_base64_patch(patch_content))
+    store = BackupStore(os.path.join(project_root, BACKUP_DIR_NAME))
+    if applicable and store.journals():
+        recover_transactions(store)
+    transaction = FileTransaction(store, durability=durability)
+
+    def apply(file_name: str) -> Optional[str]:
+        with timed_phase("apply", file=file_name, hunks=len(replacements[file_name])):
+            return apply_file_hunks(file_name, search_results[file_name]["hunks"], replacements[file_name],
+                                    file_system[file_name], transaction, backup_copies)
+
+    # Files are independent, so they can be staged concurrently; map keeps results in input order
+    try:
+        if jobs > 1 and len(applicable) > 1:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                outcomes = list(executor.map(apply, applicable))
         else:
-            logging.info("No files were modified. Patch file not created.")
+            outcomes = [apply(file_name) for file_name in applicable]
+    except BaseException:
+        transaction.rollback()
+        raise
+
+    with timed_phase("commit", files=len(transaction.staged)):
+        transaction.commit()
 
-    logging.info("replace_hunks_in_files function completed")
+    patch_changes: List[FileChange] = []
+    for file_name, updated_content in zip(applicable, outcomes):
+        if updated_content is None:
+            continue
+        staged = transaction.staged[file_name]
+        backup_files[file_name] = backup_copy_path(file_name) if backup_copies else \
+            store.find(staged.snapshot)
+        updated_files[file_name] = updated_content
+        patch_changes.append(FileChange(
+            rel_path=os.path.relpath(file_name, common_ancestor),
+            original=file_system[file_name],
+            updated=updated_content,
+            original_mtime_ns=staged.original_mtime_ns,
+            updated_mtime_ns=os.stat(file_name).st_mtime_ns
+        ))
+
+    # Create patch file after all changes have been made
+    write_patch_files(patch_changes, patch_file, base64_patch_file)
+
+    logger.info("replace_hunks_in_files function completed")
     return search_results, updated_files, backup_files, patch_file, base64_patch_file, common_ancestor
 
 
+def write_patch_files(changes: List[FileChange], patch_file: str, base64_patch_file: str) -> Optional[str]:
+    """
+    Write the patch file and its base64 encoded copy for a set of file changes.
+
+    Args:
+    changes: The changes of all modified files.
+    patch_file: Path where the patch file should be created.
+    base64_patch_file: Path where the base64 encoded patch file should be created.
+
+    Returns:
+    The patch content, or None if no file was modified and nothing was written.
+    """
+    if not changes:
+        logger.info("No files were modified. Patch file not created.")
+        return None
+
+    logger.info("Creating patch file: %s", patch_file)
+    with timed_phase("patch", files=len(changes)):
+        patch_content = create_patch(changes, patch_file)
+
+    if patch_content is not None:
+        with open(base64_patch_file, 'w') as f:
+            f.write(create_base64_patch(patch_content))
+    return patch_content
+
+
 def create_base64_patch(patch_content: str) -> str:
     """
     Create a base64 encoded version of the patch content.
@@ -390,7 +1685,7 @@ def create_base64_patch(patch_content: str) -> str:
     Returns:
     A base64 encoded string of the patch content.
     """
-    return base64.b64encode(patch_content.encode()).decode()
+    return base64.b64encode(encode_text(patch_content)).decode()
 
 
 def find_project_root(file_paths: List[str]) -> str:
@@ -462,7 +1757,8 @@ def read_file(file_path: str) -> str:
     Read the contents of a file.
 
     This utility function centralizes file reading operations, making it easier to add
-    error handling or logging if needed in the future.
+    error handling or logging if needed in the future. The file is read as bytes and decoded
+    with decode_text, so line endings, a BOM and bytes that are not UTF-8 are kept as they are.
 
     Args:
     file_path: The path of the file to read.
@@ -470,8 +1766,8 @@ def read_file(file_path: str) -> str:
     Returns:
     The contents of the file as a string.
     """
-    with open(file_path, 'r') as f:
-        return f.read()
+    with open(file_path, 'rb') as f:
+        return decode_text(f.read())
 
 
 def write_file(file_path: str, content: str) -> None:
@@ -486,29 +1782,541 @@ def write_file(file_path: str, content: str) -> None:
     file_path: The path of the file to write.
     content: The content to write to the file.
     """
-    with open(file_path, 'w') as f:
-        f.write(content)
+    with open(file_path, 'wb') as f:
+        f.write(encode_text(content))
 
     # Verify that the file was written correctly
-    with open(file_path, 'r') as f:
-        written_content = f.read()
+    written_content = read_file(file_path)
     if written_content != content:
-        logging.error(f"File content does not match expected content after writing: {file_path}")
+        logger.error("File content does not match expected content after writing: %s", file_path)
         raise AssertionError(f"File content does not match expected content after writing: {file_path}")
 
 
+class FileCache:
+    """
+    Keep file contents and their FileIndex (split lines, stripped non-empty lines, line index and
+    prefix hashes) warm between lookups.
+
+    Entries are keyed by path and validated against the file's mtime_ns and size on every
+    lookup, so a file changed by anything else is re-read and re-indexed the next time it is
+    used. The least recently used entries are evicted once the cached files add up to more than
+    max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int], str, FileIndex]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_path: str) -> Tuple[str, FileIndex]:
+        """
+        Return the content and FileIndex of a file, reading it only if it changed.
+
+        Args:
+        file_path: The path of the file.
+
+        Returns:
+        A tuple of the file content and its FileIndex.
+
+        Raises:
+        OSError: If the file cannot be read.
+        """
+        stat = os.stat(file_path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(file_path)
+                return entry[1], entry[2]
+
+        content = read_file(file_path)
+        file_index = build_file_index(content)
+
+        with self._lock:
+            self._remove(file_path)
+            if stat.st_size <= self.max_bytes:
+                self._entries[file_path] = (key, content, file_index)
+                self.total_bytes += stat.st_size
+                while self.total_bytes > self.max_bytes:
+                    self._remove(next(iter(self._entries)))
+        return content, file_index
+
+    def invalidate(self, file_path: str) -> None:
+        """
+        Drop a file from the cache.
+
+        Args:
+        file_path: The path of the file.
+        """
+        with self._lock:
+            self._remove(file_path)
+
+    def _remove(self, file_path: str) -> None:
+        entry = self._entries.pop(file_path, None)
+        if entry is not None:
+            self.total_bytes -= entry[0][1]
+
+
+def load_files(file_paths: Iterable[str], cache: FileCache) -> Tuple[FileSystem, Dict[str, FileIndex]]:
+    """
+    Load files and their indexes through the cache, skipping files that cannot be read.
+
+    Args:
+    file_paths: The paths of the files to load.
+    cache: The FileCache to load them through.
+
+    Returns:
+    A tuple of the file system and the FileIndex of each loaded file.
+    """
+    file_system: FileSystem = {}
+    file_indexes: Dict[str, FileIndex] = {}
+    with timed_phase("load"):
+        for file_path in file_paths:
+            try:
+                file_system[file_path], file_indexes[file_path] = cache.get(file_path)
+            except OSError as e:
+                logger.warning("Could not read %s: %s", file_path, e)
+    return file_system, file_indexes
+
+
+def has_search_errors(search_results: SearchResult) -> bool:
+    """
+    Check whether any file or hunk of a search failed.
+
+    Args:
+    search_results: The results of compare_hunks_to_files.
+
+    Returns:
+    True if a file was not found or any hunk has errors.
+    """
+    return any("error" in result for result in search_results.values()) or \
+        any(hunk["errors"] for result in search_results.values() if "hunks" in result for hunk in result["hunks"])
+
+
+def manifest_entries_from_value(value) -> List[ManifestEntry]:
+    """
+    Convert one decoded manifest value into manifest entries.
+
+    A value is either a single {"file", "search", "replace"} entry, where "replace" is optional,
+    or a whole batch in the {"searches", "replacements"} shape used by compare_hunks_to_files.
+
+    Args:
+    value: The decoded JSON value.
+
+    Returns:
+    The entries it holds, in order.
+
+    Raises:
+    ValueError: If the value has neither shape.
+    """
+    if isinstance(value, dict) and isinstance(value.get("searches"), dict):
+        replacements = value.get("replacements") or {}
+        entries = []
+        for file_path, hunks in value["searches"].items():
+            file_replacements = replacements.get(file_path, [])
+            for hunk_index, hunk in enumerate(hunks):
+                replace = file_replacements[hunk_index][0] if hunk_index < len(file_replacements) else None
+                entries.append(ManifestEntry(file_path, hunk[0], replace))
+        return entries
+    if isinstance(value, dict) and isinstance(value.get("file"), str) and isinstance(value.get("search"), str):
+        return [ManifestEntry(value["file"], value["search"], value.get("replace"))]
+    raise ValueError(f'Manifest entries need "file" and "search" strings: {json.dumps(value)[:200]}')
+
+
+def iter_manifest_entries(stream: IO[str]) -> Iterator[ManifestEntry]:
+    """
+    Read manifest entries from a stream as they arrive.
+
+    The manifest is either NDJSON, one value per line, or a JSON array of values; see
+    manifest_entries_from_value for the accepted values. The stream is read line by line and
+    each value is yielded as soon as it is complete, so entries can be processed while the rest
+    of the manifest is still being written, e.g. through a pipe.
+
+    Args:
+    stream: The stream to read the manifest from.
+
+    Returns:
+    An iterator over the entries, in order.
+
+    Raises:
+    ValueError: If the manifest is not valid JSON or holds an invalid entry.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    in_array = False
+
+    def read_more(minimum: int) -> str:
+        # Read at least `minimum` characters (or up to the end) so a value spread over many
+        # lines is re-decoded a logarithmic number of times rather than once per line
+        chunks = []
+        size = 0
+        while size < minimum:
+            line = stream.readline()
+            if not line:
+                break
+            chunks.append(line)
+            size += len(line)
+        return ''.join(chunks)
+
+    while True:
+        while position < len(buffer) and (buffer[position].isspace() or (in_array and buffer[position] == ',')):
+            position += 1
+        if position == len(buffer):
+            buffer = read_more(1)
+            position = 0
+            if not buffer:
+                break
+            continue
+
+        if not in_array and buffer[position] == '[':
+            in_array = True
+            position += 1
+            continue
+        if in_array and buffer[position] == ']':
+            in_array = False
+            position += 1
+            continue
+
+        try:
+            value, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as e:
+            more = read_more(len(buffer) - position)
+            if not more:
+                raise ValueError(f"Invalid manifest: {e}") from e
+            buffer = buffer[position:] + more
+            position = 0
+            continue
+
+        yield from manifest_entries_from_value(value)
+
+    if in_array:
+        raise ValueError("Invalid manifest: unterminated JSON array")
+
+
+def process_manifest(entries: Iterable[ManifestEntry], cache: FileCache, search_mode: str = "block",
+                     min_similarity: Optional[float] = None, stream_threshold: Optional[int] = None,
+                     on_hunk: Optional[HunkCallback] = None, backup_copies: bool = False,
+                     durability: str = "file") -> Tuple[
+    SearchResult, Dict[str, str], str, str, str]:
+    """
+    Search for, and where a replacement is given replace, the hunks of a manifest as they arrive.
+
+    Consecutive entries for the same file form one batch, which is searched and applied as soon
+    as an entry for another file (or the end of the manifest) shows it is complete; only one
+    batch is held in memory at a time. A batch is replaced only if all of its entries have a
+    replacement and all of its hunks match, exactly as replace_hunks_in_files does for a file,
+    and each replaced batch is committed in its own FileTransaction, all in one backup session.
+    A file that comes back in a later batch is edited again from its updated content; it keeps
+    its first backup and gets a single combined section in the patch, which is written once at
+    the end.
+
+    Args:
+    entries: The manifest entries, e.g. from iter_manifest_entries.
+    cache: The FileCache to load files through.
+    search_mode: The search mode passed on to compare_hunks_to_files.
+    min_similarity: The fuzzy matching threshold passed on to compare_hunks_to_files.
+    stream_threshold: Size in bytes above which files that are only searched are streamed.
+    on_hunk: Called for every hunk as soon as its batch is resolved and, when replacing, checked
+        for overlaps; hunk indexes count all the file's hunks in the manifest.
+    backup_copies: Whether to also write full `.old` copies next to the modified files.
+    durability: The FileTransaction durability level of every batch.
+
+    Returns:
+    A tuple containing:
+    - Search results, with the hunks of every batch of a file in manifest order
+    - Backup file paths
+    - Path to the patch file
+    - Path to the base64 encoded patch file
+    - Common ancestor directory
+    """
+    search_results: SearchResult = {}
+    backup_files: Dict[str, str] = {}
+    changes: Dict[str, FileChange] = {}
+    recovered_stores: Set[str] = set()
+    session_id = new_session_id()
+
+    for file_name, batch in groupby(entries, key=lambda entry: entry.file):
+        batch = list(batch)
+        logger.debug("Processing %d manifest entries for file: %s", len(batch), file_name)
+        searches = {file_name: [[entry.search] for entry in batch]}
+        replacing = [entry.replace is not None for entry in batch]
+
+        batch_on_hunk = None
+        if on_hunk is not None:
+            offset = len(search_results[file_name]["hunks"]) if file_name in search_results else 0
+
+            def batch_on_hunk(name: str, hunk_index: int, hunk_result: Dict, error: Optional[str]) -> None:
+                on_hunk(name, offset + hunk_index, hunk_result, error)
+
+        if any(replacing) and not all(replacing):
+            result = {
+                "error": "The number of replacement hunks must match the number of search hunks.",
+                "hunks": [{"hunkLines": len(entry.search.split('\n')), "matchPercentage": 0} for entry in batch]
+            }
+            if batch_on_hunk is not None:
+                report_hunks(batch_on_hunk, file_name, result)
+        elif all(replacing):
+            file_system, file_indexes = load_files([file_name], cache)
+            result = compare_hunks_to_files(searches, file_system, search_mode, min_similarity,
+                                            file_indexes)[file_name]
+            applicable = "error" not in result and not any(hunk["errors"] for hunk in result["hunks"]) and \
+                not check_hunk_overlaps(file_name, result["hunks"])
+            if batch_on_hunk is not None:
+                report_hunks(batch_on_hunk, file_name, result)
+            if applicable:
+                store = BackupStore(os.path.join(find_project_root([file_name]), BACKUP_DIR_NAME))
+                if store.store_dir not in recovered_stores:
+                    if store.journals():
+                        recover_transactions(store)
+                    recovered_stores.add(store.store_dir)
+                transaction = FileTransaction(store, session_id, durability)
+                # A file edited again in a later batch keeps the backup copy of its original
+                backup_copy = backup_copies and file_name not in backup_files
+                with timed_phase("apply", file=file_name, hunks=len(batch)):
+                    updated_content = apply_file_hunks(file_name, result["hunks"], [[entry.replace] for entry in batch],
+                                                       file_system[file_name], transaction, backup_copy)
+                    transaction.commit()
+                cache.invalidate(file_name)
+                if updated_content is not None:
+                    staged = transaction.staged[file_name]
+                    if file_name not in backup_files:
+                        backup_files[file_name] = backup_copy_path(file_name) if backup_copies else \
+                            store.find(staged.snapshot)
+                    updated_mtime_ns = os.stat(file_name).st_mtime_ns
+                    previous = changes.get(file_name)
+                    changes[file_name] = previous._replace(updated=updated_content, updated_mtime_ns=updated_mtime_ns) \
+                        if previous is not None else FileChange(file_name, file_system[file_name], updated_content,
+                                                                staged.original_mtime_ns, updated_mtime_ns)
+        else:
+            streamed_files = find_large_files([file_name], stream_threshold)
+            file_system, file_indexes = load_files([path for path in searches if path not in streamed_files], cache)
+            result = compare_hunks_to_files(searches, file_system, search_mode, min_similarity, file_indexes,
+                                            streamed_files, batch_on_hunk)[file_name]
+
+        previous_result = search_results.get(file_name)
+        if previous_result is None:
+            search_results[file_name] = result
+        else:
+            previous_result["hunks"].extend(result["hunks"])
+            if "error" in result and "error" not in previous_result:
+                search_results[file_name] = {"error": result["error"], "hunks": previous_result["hunks"]}
+
+    file_paths = list(search_results.keys())
+    common_ancestor = find_common_ancestor(file_paths)
+    project_root = find_project_root(file_paths) if file_paths else os.getcwd()
+    patch_file = os.path.join(project_root, "changes.patch")
+    base64_patch_file = os.path.join(project_root, "changes.patch.b64")
+
+    # Patch paths can only be made relative once every file of the manifest is known
+    write_patch_files([change._replace(rel_path=os.path.relpath(file_name, common_ancestor))
+                       for file_name, change in changes.items()], patch_file, base64_patch_file)
+    return search_results, backup_files, patch_file, base64_patch_file, common_ancestor
+
+
+def handle_request(request: Dict, cache: FileCache, stream_threshold: Optional[int] = None) -> Dict:
+    """
+    Run one search or search-and-replace request against the warm file cache.
+
+    A request is a JSON object with "searches" and optional "replacements" in the same
+    {file path: [[hunk], ...]} shape used by compare_hunks_to_files, plus the optional
+    "searchMode", "minSimilarity", "jobs", "backupCopies" and "durability" settings, and "summary"
+    to get summarized hunks without per-line content. Any "id" is echoed back.
+
+    Args:
+    request: The decoded request.
+    cache: The FileCache shared by all requests.
+    stream_threshold: Size in bytes above which searched files are streamed instead of cached.
+
+    Returns:
+    The response object: the search results under "result", and for replacements also
+    "replaced" and the backup and patch details; or an "error" message.
+    """
+    response = {"id": request.get("id")}
+    searches = request.get("searches")
+    replacements = request.get("replacements") or {}
+    if not isinstance(searches, dict) or not searches:
+        response["error"] = 'Request must contain a non-empty "searches" object.'
+        return response
+    if replacements and any(len(replacements.get(file_path, [])) != len(hunks)
+                            for file_path, hunks in searches.items()):
+        response["error"] = "The number of replacement hunks must match the number of search hunks."
+        return response
+
+    search_mode = request.get("searchMode", "block")
+    min_similarity = request.get("minSimilarity")
+    if not replacements:
+        streamed_files = find_large_files(searches, stream_threshold)
+        file_system, file_indexes = load_files((path for path in searches if path not in streamed_files), cache)
+        search_results = compare_hunks_to_files(searches, file_system, search_mode, min_similarity, file_indexes,
+                                                streamed_files)
+        response["result"] = summarize_search_results(search_results) if request.get("summary") else search_results
+        return response
+
+    file_system, file_indexes = load_files(searches, cache)
+
+    search_results, _, backup_files, patch_file, base64_patch_file, common_ancestor = replace_hunks_in_files(
+        searches, replacements, file_system, search_mode, min_similarity, request.get("jobs", 1), file_indexes,
+        backup_copies=bool(request.get("backupCopies")), durability=request.get("durability", "file"))
+    for file_path in backup_files:
+        cache.invalidate(file_path)
+
+    response["result"] = summarize_search_results(search_results) if request.get("summary") else search_results
+    response.update(replacement_outcome(search_results, backup_files, patch_file, base64_patch_file, common_ancestor))
+    return response
+
+
+def replacement_outcome(search_results: SearchResult, backup_files: Dict[str, str], patch_file: str,
+                        base64_patch_file: str, common_ancestor: str) -> Dict:
+    """
+    Describe the outcome of a replacement as a JSON-serializable object.
+
+    Args:
+    search_results: The search results of the replacement.
+    backup_files: The backup path of every modified file.
+    patch_file: The path the patch file was to be written to.
+    base64_patch_file: The path the base64 encoded patch file was to be written to.
+    common_ancestor: The common ancestor directory of the files.
+
+    Returns:
+    An object with "replaced", "backupFiles", "patchFile", "base64PatchFile" and "commonAncestor";
+    the patch paths are None if no patch was written.
+    """
+    return {
+        "replaced": not has_search_errors(search_results),
+        "backupFiles": backup_files,
+        "patchFile": patch_file if os.path.exists(patch_file) else None,
+        "base64PatchFile": base64_patch_file if os.path.exists(base64_patch_file) else None,
+        "commonAncestor": common_ancestor
+    }
+
+
+def serve_lines(input_stream: IO[str], output_stream: IO[str], cache: FileCache,
+                stream_threshold: Optional[int] = None) -> None:
+    """
+    Answer newline-delimited JSON requests from a stream until it is closed.
+
+    Each request line gets exactly one compact JSON response line, in order.
+
+    Args:
+    input_stream: The stream to read requests from.
+    output_stream: The stream to write responses to.
+    cache: The FileCache shared by all requests.
+    stream_threshold: Size in bytes above which searched files are streamed instead of cached.
+    """
+    for line in input_stream:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            with timed_phase("request", id=request.get("id") if isinstance(request, dict) else None):
+                response = handle_request(request, cache, stream_threshold)
+        except Exception as e:
+            logger.exception("Request failed")
+            response = {"error": f"{type(e).__name__}: {e}"}
+        output_stream.write(json.dumps(response) + '\n')
+        output_stream.flush()
+
+
+def serve_socket(socket_path: str, cache: FileCache, stream_threshold: Optional[int] = None) -> None:
+    """
+    Answer newline-delimited JSON requests on a Unix socket, one connection at a time.
+
+    Args:
+    socket_path: The path of the socket to create; a stale socket file is replaced.
+    cache: The FileCache shared by all connections.
+    stream_threshold: Size in bytes above which searched files are streamed instead of cached.
+    """
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            serve_lines(io.TextIOWrapper(self.rfile, encoding='utf-8'),
+                        io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True), cache, stream_threshold)
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    with socketserver.UnixStreamServer(socket_path, Handler) as server:
+        logger.info("Serving requests on %s", socket_path)
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
 def parse_arguments(args: List[str] = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Search for hunks in files and optionally replace them, creating backups and patch files.")
-    parser.add_argument("-f", "--file", action='append', required=True, help="Path to the file to search in")
-    parser.add_argument("-s", "--search", action='append', required=True, help="Hunk to search for")
+    parser.add_argument("-f", "--file", action='append', help="Path to the file to search in")
+    parser.add_argument("-s", "--search", action='append', help="Hunk to search for")
     parser.add_argument("-r", "--replace", action='append', help="Hunk to replace with")
+    parser.add_argument("--search-mode", choices=SEARCH_MODES, default="block",
+                        help="Search each hunk on its own (block) or all hunks of a file in one pass (multi)")
+    parser.add_argument("--min-similarity", type=float,
+                        help="Accept the most similar location of a hunk with no exact match if it scores at least "
+                             "this percentage (0-100)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of files to process concurrently when replacing")
+    parser.add_argument("--backup-copies", action='store_true',
+                        help="Also keep a full .old copy next to every modified file; originals are always "
+                             "snapshotted under .hunk_backups in the project root")
+    parser.add_argument("--durability", choices=DURABILITY_LEVELS, default="file",
+                        help="How replaced files reach the disk: no fsync (none), fsync every file as it is written "
+                             "(file), fsync all files then their directories once per run (batch), or batch plus "
+                             "checking every replaced file's hash (verify)")
+    parser.add_argument("--list-sessions", action='store_true',
+                        help="List the backup sessions of the project containing the current directory")
+    parser.add_argument("--restore", metavar="SESSION",
+                        help="Put the files modified in a backup session back to their content before it")
+    parser.add_argument("--prune-sessions", type=int, metavar="KEEP",
+                        help="Delete all but the KEEP most recent backup sessions of the project containing the "
+                             "current directory, and the originals that only the deleted sessions kept")
+    parser.add_argument("--manifest",
+                        help="Read file/search/replace entries from this JSON or NDJSON file ('-' for stdin) "
+                             "instead of -f/-s/-r, processing them as they arrive")
+    parser.add_argument("--output", choices=OUTPUT_FORMATS, default="json",
+                        help="Print the results as one JSON document at the end (json), or as one compact JSON "
+                             "line per hunk as soon as it is resolved, followed by the replacement outcome (ndjson)")
+    parser.add_argument("--summary", action='store_true',
+                        help="Leave the content of matched lines out of the results")
+    parser.add_argument("--serve", action='store_true',
+                        help="Keep running and answer JSON requests, one per line, on stdin/stdout")
+    parser.add_argument("--socket", help="With --serve, answer requests on this Unix socket instead of stdin/stdout")
+    parser.add_argument("--cache-bytes", type=int, default=DEFAULT_CACHE_BYTES,
+                        help="Total size in bytes of the files kept in the in-memory file cache")
+    parser.add_argument("--stream-threshold", type=int, default=DEFAULT_STREAM_THRESHOLD,
+                        help="When only searching, stream files larger than this many bytes from a memory map "
+                             "instead of loading them (-1 disables streaming)")
+    parser.add_argument("--log-level", default=os.environ.get(LOG_LEVEL_ENV, DEFAULT_LOG_LEVEL),
+                        help=f"Log level for messages on stderr, e.g. DEBUG or INFO (default: ${LOG_LEVEL_ENV} "
+                             f"or {DEFAULT_LOG_LEVEL})")
+    parser.add_argument("--timings", action='store_true',
+                        default=os.environ.get(TIMINGS_ENV, "").lower() in ("1", "true", "yes"),
+                        help=f"Write one JSON timing event per phase to stderr (default: ${TIMINGS_ENV})")
 
     parsed_args = parser.parse_args(args)
+    try:
+        parsed_args.log_level = parse_log_level(parsed_args.log_level)
+    except ValueError as e:
+        parser.error(str(e))
+    if parsed_args.min_similarity is not None and not 0 <= parsed_args.min_similarity <= 100:
+        parser.error("--min-similarity must be between 0 and 100")
+    if parsed_args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if parsed_args.stream_threshold < 0:
+        parsed_args.stream_threshold = None
+    if parsed_args.socket and not parsed_args.serve:
+        parser.error("--socket requires --serve")
+    if parsed_args.manifest and (parsed_args.serve or parsed_args.file):
+        parser.error("--manifest cannot be combined with --serve or -f/--file")
+    if parsed_args.prune_sessions is not None and parsed_args.prune_sessions < 0:
+        parser.error("--prune-sessions must be 0 or more")
+    if not (parsed_args.serve or parsed_args.manifest or parsed_args.list_sessions or parsed_args.restore or
+            parsed_args.prune_sessions is not None) and not (parsed_args.file and parsed_args.search):
+        parser.error("the following arguments are required: -f/--file, -s/--search")
 
     searches = {}
     replacements = {}
-    for i, file_path in enumerate(parsed_args.file):
+    for i, file_path in enumerate(parsed_args.file or []):
         if file_path not in searches:
             searches[file_path] = []
         searches[file_path].append([parsed_args.search[i]])
@@ -522,56 +2330,127 @@ def parse_arguments(args: List[str] = None) -> argparse.Namespace:
     parsed_args.searches = searches
     parsed_args.replacements = replacements
 
-    logging.debug(f"parse_arguments - searches: {json.dumps(searches, indent=2)}")
-    logging.debug(f"parse_arguments - replacements: {json.dumps(replacements, indent=2)}")
-
     return parsed_args
 
 
+def print_replacement_summary(backup_files: Dict[str, str], patch_file: str, base64_patch_file: str,
+                              common_ancestor: str) -> None:
+    for file_path, backup_path in backup_files.items():
+        print(f"Original file {file_path} backed up to: {backup_path}")
+    if os.path.exists(patch_file):
+        print(f"Patch file created: {patch_file}")
+        print(f"Base64 encoded patch file created: {base64_patch_file}")
+    else:
+        print("No patch file created as no changes were made.")
+    print(f"Project root directory: {os.path.dirname(patch_file)}")
+    print(f"Common ancestor directory: {common_ancestor}")
+
+
+def print_search_results(search_results: SearchResult, summary: bool) -> None:
+    print(json.dumps(summarize_search_results(search_results) if summary else search_results, indent=2))
+
+
 def main():
     args = parse_arguments()
+    configure_logging(args.log_level, args.timings)
+
+    cache = FileCache(args.cache_bytes)
+    if args.serve:
+        if args.socket:
+            serve_socket(args.socket, cache, args.stream_threshold)
+        else:
+            serve_lines(sys.stdin, sys.stdout, cache, args.stream_threshold)
+        return
+
+    if args.list_sessions or args.restore or args.prune_sessions is not None:
+        store = BackupStore(os.path.join(find_project_root([os.getcwd()]), BACKUP_DIR_NAME))
+        if args.list_sessions:
+            print(json.dumps(store.sessions(), indent=2))
+        elif args.prune_sessions is not None:
+            print(json.dumps({"pruned": store.prune(args.prune_sessions)}, indent=2))
+        else:
+            restored, session_id = restore_session(store, args.restore, args.durability)
+            print(json.dumps({"restored": restored, "session": session_id}, indent=2))
+        return
+
+    # With NDJSON output every hunk is written as soon as it is resolved and the replacement
+    # outcome follows as the last record; the human-readable messages are left out
+    ndjson = args.output == "ndjson"
+    on_hunk = ndjson_hunk_writer(sys.stdout, args.summary) if ndjson else None
+
+    if args.manifest:
+        manifest = sys.stdin if args.manifest == '-' else open(args.manifest, 'r')
+        try:
+            search_results, backup_files, patch_file, base64_patch_file, common_ancestor = process_manifest(
+                iter_manifest_entries(manifest), cache, args.search_mode, args.min_similarity, args.stream_threshold,
+                on_hunk, args.backup_copies, args.durability)
+        except ValueError as e:
+            if ndjson:
+                write_ndjson(sys.stdout, {"error": str(e)})
+            else:
+                print(f"Error: {e}")
+            return
+        finally:
+            if manifest is not sys.stdin:
+                manifest.close()
+
+        if ndjson:
+            write_ndjson(sys.stdout, replacement_outcome(search_results, backup_files, patch_file,
+                                                         base64_patch_file, common_ancestor))
+            return
+
+        if has_search_errors(search_results):
+            print("Errors occurred during search. Files with errors were left unchanged.")
+        elif backup_files:
+            print("Replacement successful.")
+        if backup_files:
+            print_replacement_summary(backup_files, patch_file, base64_patch_file, common_ancestor)
+        print_search_results(search_results, args.summary)
+        return
 
     # Use args.searches directly instead of recreating it
     searches = args.searches
     replacements = args.replacements
-
-
-    logging.debug(f"main - searches: {json.dumps(searches, indent=2)}")
-    logging.debug(f"main - replacements: {json.dumps(replacements, indent=2)}")
+    logger.debug("main - searches: %s", LazyJson(searches))
+    logger.debug("main - replacements: %s", LazyJson(replacements))
 
     if args.replace and len(args.replace) != len(args.search):
         print("Error: The number of replacement hunks must match the number of search hunks.")
         return
 
-    file_system = {file_path: read_file(file_path) for file_path in searches.keys()}
-
     if args.replace:
-        search_results, updated_files, backup_files, patch_file, base64_patch_file, common_ancestor = replace_hunks_in_files(
-            searches, replacements, file_system)
-
-        if any("error" in result for result in search_results.values()) or \
-                any(hunk["errors"] for result in search_results.values() if "hunks" in result for hunk in
-                    result["hunks"]):
+        file_system, file_indexes = load_files(searches.keys(), cache)
+        try:
+            search_results, _, backup_files, patch_file, base64_patch_file, common_ancestor = replace_hunks_in_files(
+                searches, replacements, file_system, args.search_mode, args.min_similarity, args.jobs, file_indexes,
+                on_hunk, args.backup_copies, args.durability)
+        except ValueError as e:
+            # Every file was rolled back; e.g. a replacement that cannot be encoded
+            if ndjson:
+                write_ndjson(sys.stdout, {"error": str(e)})
+            else:
+                print(f"Error: {e}")
+            return
+
+        # replace_hunks_in_files has already committed every modified file
+        search_failed = has_search_errors(search_results)
+        if ndjson:
+            write_ndjson(sys.stdout, replacement_outcome(search_results, backup_files, patch_file,
+                                                         base64_patch_file, common_ancestor))
+        elif search_failed:
             print("Errors occurred during search. Replacement aborted.")
-            print(json.dumps(search_results, indent=2))
+            print_search_results(search_results, args.summary)
         else:
-            for file_path, content in updated_files.items():
-                write_file(file_path, content)
-
             print("Replacement successful.")
-            for file_path, backup_path in backup_files.items():
-                print(f"Original file {file_path} backed up to: {backup_path}")
-            if os.path.exists(patch_file):
-                print(f"Patch file created: {patch_file}")
-                print(f"Base64 encoded patch file created: {base64_patch_file}")
-            else:
-                print("No patch file created as no changes were made.")
-            print(f"Project root directory: {os.path.dirname(patch_file)}")
-            print(f"Common ancestor directory: {common_ancestor}")
-            print(json.dumps(search_results, indent=2))
+            print_replacement_summary(backup_files, patch_file, base64_patch_file, common_ancestor)
+            print_search_results(search_results, args.summary)
     else:
-        result = compare_hunks_to_files(searches, file_system)
-        print(json.dumps(result, indent=2))
+        streamed_files = find_large_files(searches.keys(), args.stream_threshold)
+        file_system, file_indexes = load_files((path for path in searches if path not in streamed_files), cache)
+        result = compare_hunks_to_files(searches, file_system, args.search_mode, args.min_similarity, file_indexes,
+                                        streamed_files, on_hunk)
+        if not ndjson:
+            print_search_results(result, args.summary)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,563 @@
+"""
+Replace files as one recoverable transaction, keeping their originals in a backup store.
+
+hunk_search_and_replace.py stages the new content of every file it modifies in a
+FileTransaction. The originals go into a content-addressed BackupStore under the project
+root, recorded as a session that restore_session can undo; recover_transactions rolls back
+a transaction that was interrupted while committing. decode_text and encode_text turn a
+file's bytes into text and back without changing a byte the replacement did not touch.
+"""
+import os
+import json
+import hashlib
+import datetime
+import zlib
+import logging
+import threading
+import uuid
+from typing import Dict, List, NamedTuple, Optional, Union, Tuple
+
+# The tool's logger: hunk_search_and_replace.main() configures it
+logger = logging.getLogger("hunk_search_and_replace")
+
+DURABILITY_LEVELS = ("none", "file", "batch", "verify")
+
+# Files are read as bytes and decoded so that encoding them again gives back the same bytes:
+# bytes that are not valid UTF-8 (Latin-1, cp1252...) survive as lone surrogates
+TEXT_ENCODING = "utf-8"
+TEXT_ERRORS = "surrogateescape"
+
+
+class BackupStore:
+    """
+    A content-addressed store for the originals of modified files, with an index of sessions.
+
+    Every distinct file content is kept once, as a blob named by its SHA-256 digest. A blob is a
+    hard link to the original file whenever possible: the transaction then replaces the file with
+    a new inode, so keeping its original costs no copy and no space beyond the old content itself.
+    When a hard link is not possible (another filesystem, or a file that already has other links
+    that could still modify it) the blob is a zlib-compressed copy instead.
+
+    Each session (a replacement run) is recorded under sessions/ with the digest of the original
+    of every file it modified, so the files can later be restored with restore_session. Nothing
+    is deleted automatically: prune drops the oldest sessions and the blobs only they refer to.
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+
+    def create(self) -> None:
+        """Create the store directory, with a .gitignore so version control ignores it."""
+        if os.path.isdir(self.store_dir):
+            return
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(os.path.join(self.store_dir, ".gitignore"), 'w') as f:
+            f.write("*\n")
+
+    def blob_path(self, digest: str, compressed: bool = False) -> str:
+        """
+        Return the path of a blob, fanned out over sub-directories by the first two digits.
+
+        Args:
+        digest: The SHA-256 hex digest of the blob's content.
+        compressed: Whether to return the path of the zlib-compressed form.
+
+        Returns:
+        The blob's path.
+        """
+        path = os.path.join(self.store_dir, "objects", digest[:2], digest[2:])
+        return path + ".z" if compressed else path
+
+    def find(self, digest: str) -> Optional[str]:
+        """
+        Return the path of the stored blob with the given digest, or None if there is none.
+
+        Args:
+        digest: The digest of the blob.
+
+        Returns:
+        The path of the linked or compressed blob, or None.
+        """
+        for compressed in (False, True):
+            path = self.blob_path(digest, compressed)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def put(self, file_path: str, sync: bool = True) -> Tuple[str, bool]:
+        """
+        Store the current content of a file, unless the store already holds the same bytes.
+
+        Args:
+        file_path: The file to store.
+        sync: Whether to fsync a compressed blob before it is moved into place.
+
+        Returns:
+        A tuple of the content's digest and whether a new blob was created for it.
+        """
+        self.create()
+        temp_path = os.path.join(self.store_dir, f"blob.{os.getpid()}.{threading.get_ident()}.tmp")
+        linked = False
+        if os.stat(file_path).st_nlink == 1:
+            try:
+                os.link(file_path, temp_path)
+                linked = True
+            except OSError:
+                pass
+
+        # Hash the linked inode itself, so the digest names exactly the bytes that were kept
+        with open(temp_path if linked else file_path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if self.find(digest) is not None:
+            if linked:
+                os.remove(temp_path)
+            return digest, False
+
+        path = self.blob_path(digest, compressed=not linked)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not linked:
+            with open(temp_path, 'wb') as f:
+                f.write(zlib.compress(data))
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        return digest, True
+
+    def read(self, digest: str) -> bytes:
+        """
+        Read the content of a blob.
+
+        Args:
+        digest: The digest of the blob.
+
+        Returns:
+        The original bytes.
+
+        Raises:
+        FileNotFoundError: If the store has no blob with that digest.
+        """
+        path = self.find(digest)
+        if path is None:
+            raise FileNotFoundError(f"No blob {digest} in {self.store_dir}")
+        with open(path, 'rb') as f:
+            data = f.read()
+        return zlib.decompress(data) if path.endswith(".z") else data
+
+    def restore(self, digest: str, file_path: str) -> None:
+        """
+        Atomically replace a file with a copy of a blob; the blob itself is never linked back.
+
+        Args:
+        digest: The digest of the blob to restore.
+        file_path: The file to restore.
+        """
+        temp_path = f"{file_path}.restore.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(self.read(digest))
+        os.replace(temp_path, file_path)
+
+    def discard(self, digest: str) -> None:
+        """
+        Remove a blob, e.g. one created for a file whose replacement was rolled back.
+
+        Args:
+        digest: The digest of the blob.
+        """
+        path = self.find(digest)
+        if path is not None:
+            os.remove(path)
+
+    def session_path(self, session_id: str) -> str:
+        return os.path.join(self.store_dir, "sessions", f"{session_id}.json")
+
+    def journal_dir(self) -> str:
+        return os.path.join(self.store_dir, "journal")
+
+    def journals(self) -> List[str]:
+        """
+        List the journals left by transactions that were interrupted while committing.
+
+        Returns:
+        The paths of the journal files, oldest first.
+        """
+        journal_dir = self.journal_dir()
+        if not os.path.isdir(journal_dir):
+            return []
+        return [os.path.join(journal_dir, name) for name in sorted(os.listdir(journal_dir))]
+
+    def record_session(self, session_id: str, files: Dict[str, str]) -> None:
+        """
+        Add files to a session's index entry; a file already in the session keeps its first digest.
+
+        Args:
+        session_id: The session to record the files in.
+        files: The digest of the original of every file, keyed by path.
+        """
+        path = self.session_path(session_id)
+        session = self.load_session(session_id) if os.path.exists(path) else {
+            "id": session_id,
+            "created": datetime.datetime.now().isoformat(timespec='seconds'),
+            "files": {}
+        }
+        for file_path, digest in files.items():
+            session["files"].setdefault(file_path, digest)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w') as f:
+            f.write(json.dumps(session, separators=(',', ':')))
+        os.replace(temp_path, path)
+
+    def load_session(self, session_id: str) -> Dict:
+        """
+        Load a session's index entry.
+
+        Args:
+        session_id: The session to load.
+
+        Returns:
+        The session, with its "id", "created" time and "files" mapping paths to digests.
+        """
+        with open(self.session_path(session_id), 'r') as f:
+            return json.load(f)
+
+    def sessions(self) -> List[Dict]:
+        """
+        List the recorded sessions, oldest first.
+
+        Returns:
+        Every session's index entry.
+        """
+        sessions_dir = os.path.join(self.store_dir, "sessions")
+        if not os.path.isdir(sessions_dir):
+            return []
+        return [self.load_session(name[:-len(".json")]) for name in sorted(os.listdir(sessions_dir))
+                if name.endswith(".json")]
+
+    def prune(self, keep: int) -> List[str]:
+        """
+        Delete all but the most recent sessions, and every blob no remaining session refers to.
+
+        Blobs named in a journal are kept, so an interrupted transaction can still be recovered.
+        A transaction that is still staging its files has blobs nothing refers to yet, so this
+        must not run while files are being replaced.
+
+        Args:
+        keep: The number of most recent sessions to keep.
+
+        Returns:
+        The ids of the deleted sessions, oldest first.
+        """
+        sessions = self.sessions()
+        removed = sessions[:max(0, len(sessions) - keep)]
+        for session in removed:
+            os.remove(self.session_path(session["id"]))
+
+        referenced = {digest for session in sessions[len(removed):] for digest in session["files"].values()}
+        for journal_path in self.journals():
+            try:
+                with open(journal_path, 'r') as f:
+                    referenced.update(snapshot for _, _, snapshot in json.load(f)["files"])
+            except ValueError:
+                continue
+
+        objects_dir = os.path.join(self.store_dir, "objects")
+        if os.path.isdir(objects_dir):
+            for fan_out in os.listdir(objects_dir):
+                fan_out_dir = os.path.join(objects_dir, fan_out)
+                for name in os.listdir(fan_out_dir):
+                    digest = fan_out + (name[:-len(".z")] if name.endswith(".z") else name)
+                    if digest not in referenced:
+                        os.remove(os.path.join(fan_out_dir, name))
+                if not os.listdir(fan_out_dir):
+                    os.rmdir(fan_out_dir)
+
+        if removed:
+            logger.info("Pruned %d backup sessions from %s", len(removed), self.store_dir)
+        return [session["id"] for session in removed]
+
+
+def new_session_id() -> str:
+    # Ids sort in creation order, which is the order sessions are listed in
+    return f"{datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class StagedFile(NamedTuple):
+    file_path: str
+    staged_path: str
+    snapshot: str
+    snapshot_created: bool
+    original_mtime_ns: int
+    digest: str
+
+
+def decode_text(data: bytes) -> str:
+    """
+    Decode a file's bytes so that encode_text gives the same bytes back.
+
+    Nothing is normalized: a CRLF file keeps its '\\r' at the end of every line and a UTF-8
+    BOM stays as a leading '\\ufeff'. Bytes that are not valid UTF-8 become lone surrogates.
+    CPython decodes the ASCII runs of the data without looking at them one character at a time,
+    so this is as cheap as a plain ASCII decode for most source files.
+
+    Args:
+    data: The raw content of the file.
+
+    Returns:
+    The content as text.
+    """
+    return data.decode(TEXT_ENCODING, TEXT_ERRORS)
+
+
+def encode_text(content: str) -> bytes:
+    """
+    Encode text read with decode_text back into the bytes it was read from.
+
+    The lone surrogates standing for bytes that were not valid UTF-8 give back those bytes, and
+    everything else is encoded as UTF-8, so every line a replacement did not touch is written
+    exactly as it was read, whatever the file's encoding. New text is always written as UTF-8.
+
+    Args:
+    content: The text to encode.
+
+    Returns:
+    The bytes to write.
+
+    Raises:
+    ValueError: If the text holds a lone surrogate that decode_text cannot have produced.
+    """
+    try:
+        return content.encode(TEXT_ENCODING, TEXT_ERRORS)
+    except UnicodeEncodeError as e:
+        raise ValueError(f"Cannot encode {content[e.start:e.end]!r} as UTF-8") from e
+
+
+def fsync_path(path: str) -> None:
+    """
+    Flush a file or directory to stable storage.
+
+    Args:
+    path: The path of the file or directory.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class FileTransaction:
+    """
+    Replace the content of several files as one unit: either all of them change or none does.
+
+    New contents are first staged in temporary files next to their targets, and the original of
+    every file is put in the BackupStore. Committing writes a journal listing the staged files,
+    moves them into place with os.replace, records the originals in the session's index entry
+    and removes the journal. If committing fails the files already replaced are restored from
+    the store; if the process dies instead, recover_transactions finds the journal and does the
+    same.
+
+    How much of this reaches stable storage before commit returns depends on the durability level:
+    - "none": nothing is fsynced and nothing is read back; the OS writes the files when it likes.
+    - "file": every staged file, blob and the journal are fsynced as they are written.
+    - "batch": the staged files and new blobs are fsynced in one pass just before the journal is
+      written, along with the blob directories, and the journal's directory right after it.
+      After the renames each directory holding a replaced file is fsynced once, so the renames
+      themselves survive a crash.
+    - "verify": like "batch", and every replaced file is read back and its SHA-256 compared to
+      that of the staged content.
+    """
+
+    def __init__(self, store: BackupStore, session_id: Optional[str] = None, durability: str = "file"):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown durability level: {durability}")
+        self.store = store
+        self.id = new_session_id()
+        self.session_id = session_id or self.id
+        self.durability = durability
+        self.staged: Dict[str, StagedFile] = {}
+        self.committed: List[StagedFile] = []
+        self.lock = threading.Lock()
+
+    @property
+    def journal_path(self) -> str:
+        return os.path.join(self.store.journal_dir(), f"{self.id}.json")
+
+    def stage(self, file_path: str, content: Union[str, bytes]) -> None:
+        """
+        Store a file's original and stage its new content, without touching the file itself.
+
+        Args:
+        file_path: The file to replace on commit.
+        content: Its new content, as text to encode with encode_text or as the exact bytes to write.
+
+        Raises:
+        ValueError: If the text cannot be encoded; nothing is stored or staged for the file.
+        """
+        try:
+            data = content if isinstance(content, bytes) else encode_text(content)
+        except ValueError as e:
+            raise ValueError(f"Cannot write {file_path}: {e}") from e
+        original_mtime_ns = os.stat(file_path).st_mtime_ns
+        snapshot, snapshot_created = self.store.put(file_path, sync=self.durability == "file")
+        staged_path = f"{file_path}.{self.id}.tmp"
+        with open(staged_path, 'wb') as f:
+            f.write(data)
+            if self.durability == "file":
+                f.flush()
+                os.fsync(f.fileno())
+        digest = hashlib.sha256(data).hexdigest() if self.durability == "verify" else ""
+        with self.lock:
+            self.staged[file_path] = StagedFile(file_path, staged_path, snapshot, snapshot_created,
+                                                original_mtime_ns, digest)
+
+    def commit(self) -> None:
+        """
+        Move every staged file into place, rolling all of them back if any step fails.
+
+        Raises:
+        AssertionError: If a file does not hold its new content after being replaced.
+        """
+        if not self.staged:
+            return
+
+        # Directories cannot be opened, let alone fsynced, on Windows
+        sync_directories = os.name != 'nt'
+        batched = self.durability in ("batch", "verify")
+        if batched:
+            blob_directories = set()
+            for staged in self.staged.values():
+                fsync_path(staged.staged_path)
+                if staged.snapshot_created:
+                    blob = self.store.find(staged.snapshot)
+                    fsync_path(blob)
+                    blob_directories.add(os.path.dirname(blob))
+            if sync_directories and blob_directories:
+                # A new fan-out directory is itself an entry of objects/
+                for directory in blob_directories | {os.path.join(self.store.store_dir, "objects")}:
+                    fsync_path(directory)
+
+        os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+        journal = {"id": self.id, "files": [[staged.file_path, staged.staged_path, staged.snapshot]
+                                            for staged in self.staged.values()]}
+        with open(self.journal_path, 'w') as f:
+            f.write(json.dumps(journal, separators=(',', ':')))
+            if self.durability != "none":
+                f.flush()
+                os.fsync(f.fileno())
+        if batched and sync_directories:
+            fsync_path(os.path.dirname(self.journal_path))
+
+        try:
+            for staged in self.staged.values():
+                os.replace(staged.staged_path, staged.file_path)
+                self.committed.append(staged)
+
+            if batched and sync_directories:
+                for directory in {os.path.dirname(os.path.abspath(staged.file_path)) for staged in self.committed}:
+                    fsync_path(directory)
+
+            if self.durability == "verify":
+                for staged in self.committed:
+                    with open(staged.file_path, 'rb') as f:
+                        current_digest = hashlib.sha256(f.read()).hexdigest()
+                    if current_digest != staged.digest:
+                        logger.error("File content does not match expected content after writing: %s",
+                                     staged.file_path)
+                        raise AssertionError(
+                            f"File content does not match expected content after writing: {staged.file_path}")
+
+            self.store.record_session(self.session_id, {staged.file_path: staged.snapshot
+                                                        for staged in self.committed})
+        except BaseException:
+            self.rollback()
+            raise
+
+        os.remove(self.journal_path)
+        logger.info("Transaction %s committed %d files", self.id, len(self.committed))
+
+    def rollback(self) -> None:
+        """
+        Restore every file this transaction replaced and discard the ones still staged.
+
+        The blobs the transaction added to the store are discarded as well: no session refers
+        to them, and the blob of a file that was never replaced may still be a hard link to it.
+        A committed transaction is undone with restore_session instead.
+        """
+        for staged in reversed(self.committed):
+            self.store.restore(staged.snapshot, staged.file_path)
+
+        for staged in self.staged.values():
+            if os.path.exists(staged.staged_path):
+                os.remove(staged.staged_path)
+            if staged.snapshot_created:
+                self.store.discard(staged.snapshot)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        if self.committed:
+            logger.warning("Transaction %s rolled back %d files", self.id, len(self.committed))
+        self.committed = []
+
+
+def recover_transactions(store: BackupStore) -> List[str]:
+    """
+    Roll back transactions that were interrupted while committing.
+
+    A journal left in the store means its transaction never finished: files whose staged copy
+    is still there were not replaced yet and are left alone, the others are restored from the
+    store.
+
+    Args:
+    store: The BackupStore to look for journals in.
+
+    Returns:
+    The paths of the files that were restored.
+    """
+    restored = []
+    for journal_path in store.journals():
+        try:
+            with open(journal_path, 'r') as f:
+                journal = json.load(f)
+        except ValueError:
+            # The journal is written before any file is replaced, so a torn one means nothing was
+            logger.warning("Discarding incomplete journal %s", journal_path)
+            os.remove(journal_path)
+            continue
+        logger.warning("Rolling back interrupted transaction %s", journal["id"])
+        for file_path, staged_path, snapshot in journal["files"]:
+            if os.path.exists(staged_path):
+                os.remove(staged_path)
+                # The file was never replaced, so a blob linked to it would change along with it
+                blob = store.find(snapshot)
+                if blob is not None and os.path.exists(file_path) and os.path.samefile(blob, file_path):
+                    store.discard(snapshot)
+            else:
+                store.restore(snapshot, file_path)
+                restored.append(file_path)
+        os.remove(journal_path)
+    return restored
+
+
+def restore_session(store: BackupStore, session_id: str, durability: str = "file") -> Tuple[List[str], str]:
+    """
+    Put every file modified in a session back to the content it had before the session.
+
+    The restore is itself a transaction, so it can be undone by restoring the session it creates.
+
+    Args:
+    store: The BackupStore holding the session.
+    session_id: The session to restore.
+    durability: The FileTransaction durability level.
+
+    Returns:
+    A tuple of the restored file paths and the id of the restoring session.
+    """
+    if store.journals():
+        recover_transactions(store)
+    transaction = FileTransaction(store, durability=durability)
+    for file_path, digest in store.load_session(session_id)["files"].items():
+        transaction.stage(file_path, store.read(digest))
+    transaction.commit()
+    return [staged.file_path for staged in transaction.committed], transaction.session_id